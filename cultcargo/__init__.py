@@ -0,0 +1,25 @@
+import warnings
+from omegaconf import OmegaConf
+from .resolvers import image_version_resolver, numba_cache_resolver, catalog_resolver, cabs_resolver
+
+
+def _register_resolver(name, resolver):
+    if not OmegaConf.has_resolver(name):
+        with warnings.catch_warnings():
+            # newer omegaconf versions deprecate register_new_resolver() in favour of register_resolver()
+            warnings.simplefilter("ignore", UserWarning)
+            OmegaConf.register_new_resolver(name, resolver)
+
+
+# vars.cult-cargo.images.version resolves to the best CPU variant of an image for the host, optionally pinned
+# to its digest, see resolvers.py
+_register_resolver("cultcargo.image_version", image_version_resolver)
+
+# vars.cult-cargo.numba-cache resolves to the host directory of persistent numba caches when a cab mounts it
+_register_resolver("cultcargo.numba_cache", numba_cache_resolver)
+
+# catalog.yml pulls the cab definitions out of the compiled catalog, see catalog.py
+_register_resolver("cultcargo.catalog", catalog_resolver)
+
+# "cabs: ${cultcargo.cabs:}" in a recipe file materialises just the cabs its recipes use, see catalog.py
+_register_resolver("cultcargo.cabs", cabs_resolver)
@@ -6,11 +6,13 @@ import requests
 import os.path
 import re
 import subprocess
+from functools import partial
 from typing import List, Dict, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from omegaconf import OmegaConf
 from rich.console import Console
 from rich.rule import Rule
+from rich.table import Table
 from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn
 import importlib
 try:
@@ -19,13 +21,60 @@ except ImportError: # for Python<3.8
     import importlib_metadata as metadata
 from cultcargo.builder.build_utils import (
     substitute_environment_variables,
-    resolve_version_substitutions
+    resolve_version_substitutions,
+    parse_size,
+    default_cache_dir,
+    with_retries
 )
+from cultcargo.builder.scheduler import Task, TaskFailed, run_tasks, parse_base_images
+from cultcargo.builder.registry import RegistryProbe, RegistryError, ProbeResult, local_repo_digest
+from cultcargo.builder.fingerprint import (
+    FINGERPRINT_LABEL,
+    BuildState,
+    compute_fingerprint,
+    local_image_fingerprint
+)
+from cultcargo.builder.report import (
+    BuildReport,
+    load_report,
+    compare_reports,
+    image_size_and_layers,
+    format_size,
+    PHASES
+)
+from cultcargo.builder.buildkit import (
+    resolve_cache_spec,
+    uses_buildx,
+    buildx_cache_args,
+    commit_local_cache
+)
+from cultcargo.builder.runtime import add_runtime_stage
+from cultcargo.builder.jitcache import add_numba_warmup, stage_hook, HOOK_DIR, HOOK_SOURCE
+from cultcargo.builder.startup import optimise_startup, startup_settings
+from cultcargo.builder.sif import SifCache
+from cultcargo.builder.journal import BuildJournal
+from cultcargo.builder.changes import (
+    GitError,
+    changed_files,
+    file_at,
+    changed_keys,
+    dependent_keys,
+    referenced_keys,
+    file_changed,
+    context_changed
+)
+from cultcargo.builder.plan import PlanJob, heuristic_cost, recorded_costs, make_shards, shard_cost, parse_shard
+from cultcargo.builder.layers import check_layer_formats, format_reference, buildx_output_args, timed_pull
+from cultcargo.cpu import CPU_VARIANTS, march_flags
+from cultcargo.lockfile import Lockfile, user_lockfile
 
 
 
 DEFAULT_MANIFEST = os.path.join(os.path.dirname(__file__), "cargo-manifest.yml")
 
+# manifest entries that control the build process, but not the image content
+BUILD_SETTINGS_KEYS = ("build_cpus", "build_memory", "build_cache", "cpu_variants", "size_budget", "layer_formats")
+
 
 @dataclass
 class ImageInfo(object):
@@ -33,6 +82,14 @@ class ImageInfo(object):
     assign: Optional[Dict[str, Any]] = None       # optional assignments
     latest: Optional[str] = None                  # latest version -- use last 'versions' entry if not given
     dockerfile: Optional[str] = None
+    build_cpus: Optional[float] = None            # CPUs reserved for building each version (default 1)
+    build_memory: Optional[str] = None            # memory reserved for building each version, e.g. 8G
+    build_cache: Optional[str] = None             # build cache mode, overrides BUILD_CACHE in metadata
+    runtime: Optional[Dict[str, Any]] = None      # runtime stage: base, copy (list of paths), packages
+    numba_warmup: Optional[Dict[str, Any]] = None  # pre-warmed numba cache: modules, ms, commands
+    startup: Optional[Dict[str, Any]] = None      # overrides manifest-wide startup optimisation settings
+    size_budget: Optional[str] = None             # maximum image size, e.g. 1.5G. Builds exceeding it fail.
+    layer_formats: Optional[List[str]] = None     # additional layer formats to push, see builder/layers.py
 
 @dataclass
 class Manifest(object):
@@ -45,20 +102,91 @@ class Manifest(object):
         BASE_IMAGE_PATH: str = "images"
         PACKAGE_VERSION: str = "auto"
         GITHUB_REPOSITORY: str = ""
+        BUILD_CACHE: str = "pull"          # pull, none, local[:DIR] or registry[:REF], see builder/buildkit.py
 
     metadata: Metadata
     assign: Dict[str, Any]
     images: Dict[str, ImageInfo]
+    # startup optimisation of images that pip-install Python packages: enabled, strip, keep, docs.
+    # See builder/startup.py.
+    startup: Optional[Dict[str, Any]] = None
 
 
-def run(command, cwd=None, input=None):
-    print(f"[bold]{cwd or '.'}$ {command}[/bold]")
-    args = command.split()
-    result = subprocess.run(args, cwd=cwd, input=input, text=True)
-    if result.returncode:
-        print(f"{command} failed with exit code {result.returncode}")
-        sys.exit(1)
-    return 0
+@dataclass
+class BuildJob(object):
+    image: str
+    version: str
+    image_version: str                            # tag, i.e. VERSION-BUNDLE_VERSION[-CPU_VARIANT]
+    full_image: str                               # REGISTRY/IMAGE:IMAGE_VERSION
+    path: str                                     # image directory
+    dockerpath: str                               # Dockerfile template
+    build_dir: str                                # build context
+    content: str                                  # rendered Dockerfile
+    cpu_variant: str = ""                         # CPU microarchitecture level (-march) of variant, "" for generic
+    cache_mode: str = "pull"                      # build cache mode, see builder/buildkit.py
+    cache_location: str = ""                      # local directory or registry reference of buildx cache
+    assign: Dict[str, Any] = field(default_factory=dict)   # assignments that went into this version
+    latest_tag: Optional[str] = None              # full name of latest tag, if this version is to be tagged as such
+    cpus: float = 1
+    memory: int = 0
+    size_budget: int = 0                          # maximum image size in bytes, 0 for no limit
+    layer_formats: List[str] = field(default_factory=list)  # additional layer formats (zstd, estargz) to push
+    parents: List[str] = field(default_factory=list)   # names of jobs this one is built FROM
+    remote_exists: Optional[bool] = None
+    remote_digest: Optional[str] = None
+    fingerprint: Optional[str] = None
+    remote_current: Optional[bool] = None         # does remote image carry the same fingerprint?
+    replica: bool = False                         # only built as a base for this shard, owned by another shard
+
+    @property
+    def name(self):
+        return f"{self.image}:{self.image_version}"
+
+    @property
+    def pushes_with_buildx(self):
+        """Is the image built or pushed by a buildx builder, which resolves FROM against the registry, so that
+        its parents have to be pushed first?"""
+        return uses_buildx(self.cache_mode) or bool(self.layer_formats)
+
+
+class BuildError(Exception):
+    pass
+
+
+def load_manifest(conf):
+    """Merges loaded manifest with its schema, and resolves environment variables and version substitutions"""
+    conf = OmegaConf.merge(OmegaConf.structured(Manifest), conf)
+
+    # NOTE(JSKenyon): Replace environment varaibles with values. Currently,
+    # this function does not traverse collections other than dictionaries.
+    conf = substitute_environment_variables(conf)
+    # NOTE(JSKenyon): Resolve versioning substitutions on images to make
+    # manipulating the config more consistent between use-cases.
+    resolve_version_substitutions(conf)
+    return conf
+
+
+def run(command, cwd=None, input=None, capture=False, retries=0, retry_delay=5):
+    """Runs command, raising BuildError if it fails. Commands prone to transient failures (pushes and pulls)
+    can be retried a number of times, with exponential backoff starting at retry_delay seconds."""
+    def attempt():
+        print(f"[bold]{cwd or '.'}$ {command}[/bold]")
+        args = command.split()
+        if capture:
+            result = subprocess.run(args, cwd=cwd, input=input, text=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        else:
+            result = subprocess.run(args, cwd=cwd, input=input, text=True)
+        if result.returncode:
+            if capture:
+                print(result.stdout, markup=False)
+            raise BuildError(f"{command} failed with exit code {result.returncode}")
+        return 0
+
+    def on_retry(exc, retry, wait):
+        print(f"[yellow]{exc}, retrying in {wait:g}s (retry {retry} of {retries})[/yellow]")
+
+    return with_retries(attempt, retries, retry_delay, exceptions=(BuildError,), on_retry=on_retry)
 
 console = Console(highlight=False)
 print = console.print
@@ -77,10 +205,89 @@ print = console.print
 @click.option('-v', '--verbose', is_flag=True, help='Be verbose.')
 @click.option('--ignore-latest-tag', is_flag=True, help='Neither require nor apply latest tag.')
 @click.option('--boring', is_flag=True, help='Be boring -- no progress bar.')
+@click.option('-j', '--jobs', 'jobs_', type=click.IntRange(min=1), default=1,
+                help='Number of build/push tasks to run concurrently. Default is 1.')
+@click.option('--max-cpus', type=float, metavar='N',
+                help='CPU budget for concurrent builds (see build_cpus in manifest). Default is number of cores.')
+@click.option('--max-memory', type=str, metavar='SIZE',
+                help='Memory budget for concurrent builds (see build_memory in manifest), e.g. 64G. Default is unlimited.')
+@click.option('--probe', type=click.Choice(['http', 'docker']), default='http',
+                help='How to check the registry for existing images: registry HTTP API (falling back to docker '
+                     'for registries where this fails), or "docker manifest inspect". Default is http.')
+@click.option('--probe-cache-ttl', type=float, default=600, metavar='SECONDS',
+                help='With -l, reuse registry check results cached within this many seconds. '
+                     'Default is 600, use 0 to disable.')
+@click.option('--state', 'state_file', type=click.Path(dir_okay=False),
+                default=os.path.join(default_cache_dir(), "build-state.json"),
+                help='File recording fingerprints of built and pushed images. Image versions whose fingerprint '
+                     'has not changed are not rebuilt or pushed again, unless -r is given. '
+                     'Default is ~/.cache/cult-cargo/build-state.json.')
+@click.option('--journal', 'journal_file', type=click.Path(dir_okay=False),
+                default=os.path.join(default_cache_dir(), "build-journal.json"),
+                help='File recording the build, push and conversion steps completed by the current run. '
+                     'Default is ~/.cache/cult-cargo/build-journal.json.')
+@click.option('--resume', is_flag=True,
+                help='Resume the last run recorded in the journal, if it didn\'t finish: steps it completed are '
+                     'skipped (unless the image fingerprint has changed since), without checking the registry again.')
+@click.option('--retries', type=click.IntRange(min=0), default=3, show_default=True,
+                help='Number of times to retry a failed push or pull.')
+@click.option('--retry-delay', type=float, default=5, show_default=True, metavar='SECONDS',
+                help='Delay before the first retry. Each further retry waits twice as long as the previous one.')
+@click.option('--report', 'report_file', type=click.Path(dir_okay=False), metavar='FILE',
+                help='Write JSON report with per-phase timings, image sizes and layer counts to FILE.')
+@click.option('--compare', 'compare_file', type=click.Path(exists=True, dir_okay=False), metavar='FILE',
+                help='Compare build times and image sizes against a previous report. '
+                     'Returns error if any grew by more than --threshold.')
+@click.option('--threshold', type=float, default=0.2,
+                help='Fractional growth in build time or image size flagged by --compare. Default is 0.2.')
+@click.option('--since', metavar='REF',
+                help='Only process image versions affected by changes since the given git ref (including uncommitted '
+                     'changes): changed files in their build context, changed manifest entries, or changed variables '
+                     'used by them, and the images built upon these. Implies -a if no images are specified.')
+@click.option('--plan', 'plan_file', type=click.Path(dir_okay=False), metavar='FILE',
+                help='Write JSON build plan (image versions, dependencies, estimated costs, and shards if --shard '
+                     'is given) to FILE, and print it, instead of building anything.')
+@click.option('--shard', 'shard_spec', metavar='I/N',
+                help='Split the selected image versions into N shards of similar estimated cost, and only process '
+                     'shard I (1 <= I <= N). Bases needed by a shard are built by it, but only pushed by the shard '
+                     'owning them.')
+@click.option('--cost-report', 'cost_reports', type=click.Path(exists=True, dir_okay=False), metavar='FILE',
+                multiple=True,
+                help='Estimate costs for --plan and --shard from build times recorded in past --report files '
+                     '(images not found in them are estimated from their Dockerfiles). Can be given multiple times.')
+@click.option('--cache', 'cache_spec', type=str, metavar='MODE[:LOCATION]',
+                help='Build cache mode, overriding the manifest: "pull" pulls existing images before building, '
+                     '"none" does not, "local[:DIR]" and "registry[:REF]" use docker buildx with --cache-from/--cache-to '
+                     'pointing to a local directory or registry cache image. Default is BUILD_CACHE in manifest, '
+                     'or "pull".')
+@click.option('--no-pip-cache', is_flag=True,
+                help='Do not use the shared BuildKit pip cache mount (pip_cache_mount in manifest) for pip installs.')
+@click.option('--lockfile', 'lockfile_path', metavar='FILE', default=user_lockfile,
+                show_default='~/.local/share/cult-cargo/image-digests.yml',
+                help='Lockfile in which to record digests of pushed images. Use "" to not write one. When '
+                     'pushing a release, use cultcargo/image-digests.yml, the lockfile shipped with the package.')
+@click.option('--sif', 'sif_dir', metavar='DIR',
+                help='Convert the selected images (as found in the registry) into Singularity/Apptainer SIF files in '
+                     'this directory, in parallel. Images whose registry digest hasn\'t changed since their last '
+                     'conversion are skipped. Without -b/-p, only the conversion is done.')
+@click.option('--sif-converter', metavar='COMMAND',
+                help='Command used to convert images, invoked as "COMMAND build FILE docker://IMAGE". '
+                     'Default is apptainer or singularity, whichever is found.')
+@click.option('--measure-pulls', 'measure_registry', metavar='REGISTRY',
+                help='Push each built image in gzip and its other layer formats to this (local) registry, e.g. '
+                     'localhost:5000, and report compressed sizes and pull times.')
 @click.argument('imagenames', type=str, nargs=-1)
 def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False, rebuild=False, boring=False,
-                experimental=False, ignore_latest_tag=False, verbose=False, imagenames: List[str] = []):
-    if not (build or push or do_list):
+                experimental=False, ignore_latest_tag=False, verbose=False, jobs_=1,
+                max_cpus: Optional[float] = None, max_memory: Optional[str] = None,
+                probe: str = 'http', probe_cache_ttl: float = 600, state_file: Optional[str] = None,
+                journal_file: Optional[str] = None, resume: bool = False, retries: int = 3, retry_delay: float = 5,
+                report_file: Optional[str] = None, compare_file: Optional[str] = None, threshold: float = 0.2,
+                since: Optional[str] = None, plan_file: Optional[str] = None, shard_spec: Optional[str] = None, cost_reports: List[str] = [],
+                cache_spec: Optional[str] = None, no_pip_cache: bool = False, measure_registry: Optional[str] = None,
+                lockfile_path: Optional[str] = None, sif_dir: Optional[str] = None,
+                sif_converter: Optional[str] = None, imagenames: List[str] = []):
+    if not (build or push or do_list or sif_dir):
         build = push = True
 
     with Progress(
@@ -94,15 +301,7 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
 
         print(Rule(f"Loading manifest {manifest}"))
 
-        conf = OmegaConf.load(manifest)
-        conf = OmegaConf.merge(OmegaConf.structured(Manifest), conf)
-
-        # NOTE(JSKenyon): Replace environment varaibles with values. Currently,
-        # this function does not traverse collections other than dictionaries.
-        conf = substitute_environment_variables(conf)
-        # NOTE(JSKenyon): Resolve versioning substitutions on images to make
-        # manipulating the config more consistent between use-cases.
-        resolve_version_substitutions(conf)
+        conf = load_manifest(OmegaConf.load(manifest))
 
         # get package version
         if conf.metadata.PACKAGE_VERSION == "auto":
@@ -147,11 +346,11 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
 
 
         # get registry
-        def resolve_config_reference(value):
+        def resolve_config_reference(value, load=OmegaConf.load):
             comps =  value.split("::")
             if len(comps) == 3:
                 module = importlib.import_module(comps[0])
-                container = OmegaConf.load(f"{os.path.dirname(module.__file__)}/{comps[1]}")
+                container = load(f"{os.path.dirname(module.__file__)}/{comps[1]}")
                 try:
                     for key in comps[2].split('.'):
                         container = container[key]
@@ -178,11 +377,18 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
 
         print(f"Loaded {len(conf.images)} image entries")
 
+        # variables as given in the manifest, for comparison with a previous version of it
+        manifest_assign = OmegaConf.to_container(conf.assign)
+
+        if no_pip_cache:
+            conf.assign.pip_cache_mount = ''
+            conf.assign.pip_cache_opt = '--no-cache-dir'
+
         global_vars = OmegaConf.merge(dict(**conf.metadata), conf.assign)
         registry = global_vars.REGISTRY
         BUNDLE_VERSION = global_vars.BUNDLE_VERSION
 
-        if all:
+        if all or (since and not imagenames):
             imagenames = list(conf.images.keys())
 
         # Check latest versions in manifest for consistency
@@ -233,29 +439,31 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
                 print(f"Unknown image '{image}:{version}'")
                 sys.exit(1)
 
-        remote_images_exist = {}
-
-        for i_image,image in enumerate(imagenames):
-            progress.update(progress_task, description=f"image [bold]{image}[/bold] [{i_image}/{len(imagenames)}]")
-
-            print(Rule(f"Processing image {image}"))
+        # selected versions of each image (None means all versions)
+        selected_versions: Dict[str, Optional[List[str]]] = {}
+        for image in imagenames:
             if ':' in image:
                 image, version = image.split(":", 1)
-                versions = [version]
+                if selected_versions.get(image, []) is not None:
+                    selected_versions.setdefault(image, []).append(version)
             else:
-                versions = conf.images[image].versions.keys()
+                selected_versions[image] = None
+
+        # Resolve jobs for all image versions in the manifest, since unselected images can still contribute
+        # to the fingerprints of selected ones. Only the selected jobs are built and/or pushed.
+        all_jobs: Dict[str, BuildJob] = {}
+        jobs: List[BuildJob] = []
 
-            image_info = conf.images[image]
+        for image, image_info in conf.images.items():
             image_vars = global_vars.copy()
             image_vars.update(IMAGE=image, **(image_info.assign or {}))
             image_vars.setdefault("CMD", image)
 
             path = os.path.join(global_vars.BASE_IMAGE_PATH, image).format(**image_vars)
 
-            for i_version, version in enumerate(versions):
-                progress.update(progress_task, description=
-                    f"image [bold]{image}[/bold] [{i_image}/{len(imagenames)}]: "
-                    f"version [bold]{version}[/bold] [{i_version}/{len(versions)}]")
+            for version in image_info.versions.keys():
+                selected = image in selected_versions and \
+                    (selected_versions[image] is None or version in selected_versions[image])
 
                 if version == "latest":
                     image_version = BUNDLE_VERSION
@@ -273,104 +481,631 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
 
                 if is_exp or exp_deps:
                     if not experimental:
-                        print(f"[bold]{image}:{image_version}[/bold] is experimental and -E switch not given, skipping")
+                        if selected:
+                            print(f"[bold]{image}:{image_version}[/bold] is experimental and -E switch not given, skipping")
                         continue
-                    # check dependencies
-                    print(f"[bold]{image}:{image_version}[/bold] is experimental")
-                    for dep in exp_deps:
-                        if not os.path.exists(dep):
-                            print(f"  [red]ERROR: dependency {dep} doesn't exist[/red]")
-                            sys.exit(1)
+                    if selected:
+                        # check dependencies
+                        print(f"[bold]{image}:{image_version}[/bold] is experimental")
+                        for dep in exp_deps:
+                            if not os.path.exists(dep):
+                                print(f"  [red]ERROR: dependency {dep} doesn't exist[/red]")
+                                sys.exit(1)
 
                 dockerfile = version_info.get('dockerfile') or image_info.dockerfile or 'Dockerfile'
                 dockerfile = dockerfile.format(**version_vars)
-                full_image = f"{registry}/{image}:{image_version}"
-                remote_image_exists = True
 
                 # find Dockerfile for this image
                 dockerpath = os.path.join(path, dockerfile)
-                print(f"[bold]{image}:{image_version}[/bold] defined by {dockerpath}")
+                if selected:
+                    print(f"[bold]{image}:{image_version}[/bold] defined by {dockerpath}")
                 if not os.path.exists(dockerpath):
+                    if not selected:
+                        continue
                     print(f"  {dockerpath} doesn't exist")
                     sys.exit(1)
-                build_dir = os.path.dirname(dockerpath)
 
-                # check if remote image exists
-                if push or build or do_list:
-                    print(f"Checking if registry already contains {full_image}")
-                    cmd = ['docker', 'manifest', 'inspect', full_image]
+                # CPU-tuned variants are built from the same Dockerfile, with MARCH_FLAGS set
+                cpu_variants = list(version_info.get('cpu_variants') or [])
+                for cpu_variant in cpu_variants:
+                    if cpu_variant not in CPU_VARIANTS:
+                        print(f"[red]{image}:{image_version}: unknown CPU variant '{cpu_variant}', expecting one of {', '.join(CPU_VARIANTS)}[/red]")
+                        sys.exit(1)
+
+                for cpu_variant in [""] + cpu_variants:
+                    variant_version = f"{image_version}-{cpu_variant}" if cpu_variant else image_version
+                    variant_vars = version_vars.copy()
+                    variant_vars.update(IMAGE_VERSION=variant_version, CPU_VARIANT=cpu_variant,
+                                        MARCH_FLAGS=march_flags(cpu_variant))
+
+                    # substitute Dockerfile
                     try:
-                        print(f"  [bold].$ {' '.join(cmd)}[/bold]", highlight=False)
-                        # Execute the command
-                        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-                        print(f"  Manifest returned for {full_image}")
-                    except subprocess.CalledProcessError as e:
-                        output = e.stderr.strip()
-                        if "no such manifest" in output or "was deleted" in output:
-                            print(f"  {output}")
-                            print(f"  [green]No manifest returned for {full_image}[/green]")
-                            remote_image_exists = False
-                        else:
-                            print(f"  Error inspecting manifest: {e.stderr}")
+                        content = open(dockerpath, "rt").read().format(**variant_vars)
+                    except KeyError:
+                        if not selected:
+                            continue
+                        raise
+
+                    # copy build products into a slim runtime stage, if one is defined
+                    runtime = version_info['runtime'] if 'runtime' in version_info else image_info.runtime
+                    if runtime:
+                        try:
+                            runtime_base = runtime.get('base') or variant_vars.get('runtime_base_image')
+                            if not runtime_base:
+                                raise ValueError("runtime stage needs a base image")
+                            content = add_runtime_stage(content, runtime_base.format(**variant_vars),
+                                                        copy=list(runtime.get('copy') or []),
+                                                        packages=runtime.get('packages'))
+                        except ValueError as exc:
+                            if not selected:
+                                continue
+                            print(f"[red]{image}:{variant_version}: {exc}[/red]")
+                            sys.exit(1)
+
+                    # strip tests and docs, and precompile bytecode, in images that pip-install Python packages
+                    startup = startup_settings(conf.startup, image_info.startup, version_info.get('startup'))
+                    if startup['enabled']:
+                        content = optimise_startup(content, **startup)
+
+                    # compile numba kernels into a pre-warmed cache, if a warm-up is defined
+                    numba_warmup = version_info['numba_warmup'] if 'numba_warmup' in version_info \
+                        else image_info.numba_warmup
+                    if numba_warmup:
+                        try:
+                            content = add_numba_warmup(content, numba_warmup,
+                                                       python=variant_vars.get('python', 'python3'),
+                                                       image=f"{image}:{variant_version}", cpu_variant=cpu_variant)
+                            # before fingerprinting, which covers the build context
+                            stage_hook(os.path.dirname(dockerpath))
+                        except (ValueError, OSError) as exc:
+                            if not selected:
+                                continue
+                            print(f"[red]{image}:{variant_version}: {exc}[/red]")
                             sys.exit(1)
-                    remote_images_exist.setdefault(image, {})[image_version] = remote_image_exists
 
-                # go build
-                if build:
-                    if remote_image_exists and not no_cache:
-                        print(f"Pulling {full_image} from registry")
-                        run(f"docker pull {full_image}")
-                    # substitute Dockerfile and build
-                    content = open(dockerpath, "rt").read().format(**version_vars)
-                    if verbose:
-                        print(f"Dockerfile:", style="bold")
-                        print(f"{content}", style="dim", highlight=True)
-                    run(f"docker build {no_cache} -t {full_image} -f- {build_dir}", cwd=build_dir, input=content)
                     # is this the latest version that needs to be tagged
+                    latest_tag = None
                     if image_version == tag_latest.get(image):
-                        run(f"docker tag {registry}/{image}:{image_version} {registry}/{image}:{BUNDLE_VERSION}")
+                        latest_tag = f"{registry}/{image}:{BUNDLE_VERSION}"
+                        if cpu_variant:
+                            latest_tag += f"-{cpu_variant}"
 
-                # go push
-                if push:
-                    if remote_image_exists:
-                        # version mismatch
-                        if unprefixed_image_version != conf.metadata.PACKAGE_VERSION:
-                            if unprefixed_image_version == candidate_base:
-                                print(f"  Image exists but package is a release candidate for image version: ok to push.")
-                            else:
-                                print(f"  [red]Image exists and package version doesn't match image version: won't push.[/red]")
-                                continue
-                        elif current_release:
-                            if not candidate_release:
-                                print(f"  [red]Image exists and package released: won't push.[/red]")
-                                continue
-                            else:
-                                print(f"  Image exists, but package is a release candidate: ok to push.")
+                    # assignments that went into this version, for fingerprinting
+                    assign = OmegaConf.to_container(OmegaConf.merge(conf.assign, image_info.assign or {}, version_info),
+                                                    resolve=True)
+                    for key in BUILD_SETTINGS_KEYS:
+                        assign.pop(key, None)
+                    assign.update(IMAGE=image, VERSION=version)
+                    if cpu_variant:
+                        assign.update(CPU_VARIANT=cpu_variant)
+
+                    try:
+                        cache_mode, cache_location = resolve_cache_spec(
+                            cache_spec or version_info.get('build_cache') or image_info.build_cache or conf.metadata.BUILD_CACHE,
+                            dict(IMAGE=image, VERSION=f"{version}-{cpu_variant}" if cpu_variant else version,
+                                 IMAGE_VERSION=variant_version, REGISTRY=registry, CACHE_DIR=default_cache_dir()))
+                    except ValueError as exc:
+                        print(f"[red]{image}:{variant_version}: {exc}[/red]")
+                        sys.exit(1)
+
+                    layer_formats = list(version_info.get('layer_formats') or image_info.layer_formats or [])
+                    try:
+                        check_layer_formats(layer_formats)
+                    except ValueError as exc:
+                        print(f"[red]{image}:{variant_version}: {exc}[/red]")
+                        sys.exit(1)
+
+                    job = all_jobs[f"{image}:{variant_version}"] = BuildJob(
+                        image=image, version=version, image_version=variant_version,
+                        full_image=f"{registry}/{image}:{variant_version}",
+                        path=path, dockerpath=dockerpath, build_dir=os.path.dirname(dockerpath),
+                        content=content, cpu_variant=cpu_variant, assign=assign, latest_tag=latest_tag,
+                        cpus=float(version_info.get('build_cpus') or image_info.build_cpus or 1),
+                        memory=parse_size(version_info.get('build_memory') or image_info.build_memory) or 0,
+                        size_budget=parse_size(version_info.get('size_budget') or image_info.size_budget) or 0,
+                        cache_mode=cache_mode, cache_location=cache_location, layer_formats=layer_formats)
+                    if selected:
+                        jobs.append(job)
+
+        # keep the order in which images were specified
+        image_order = {image: i for i, image in enumerate(selected_versions)}
+        jobs.sort(key=lambda job: image_order[job.image])
+
+        # work out dependencies between images from the FROM lines of their Dockerfiles
+        jobs_by_ref = {}
+        for job in all_jobs.values():
+            jobs_by_ref[job.full_image] = job
+            if job.latest_tag:
+                jobs_by_ref[job.latest_tag] = job
+        for job in all_jobs.values():
+            for base_image in parse_base_images(job.content):
+                parent = jobs_by_ref.get(base_image)
+                if parent is not None and parent is not job and parent.name not in job.parents:
+                    job.parents.append(parent.name)
+        for job in jobs:
+            if job.parents:
+                print(f"[bold]{job.name}[/bold] depends on {', '.join(job.parents)}")
+
+        # fingerprint everything, parents first
+        def get_fingerprint(job: BuildJob, stack=()):
+            if job.fingerprint is None:
+                if job.name in stack:
+                    print(f"[red]Circular image dependency: {' -> '.join(stack + (job.name,))}[/red]")
+                    sys.exit(1)
+                parent_fingerprints = [get_fingerprint(all_jobs[parent], stack + (job.name,)) for parent in job.parents]
+                job.fingerprint = compute_fingerprint(job.content, job.build_dir, job.assign, parent_fingerprints)
+            return job.fingerprint
+
+        for job in all_jobs.values():
+            get_fingerprint(job)
+
+        # restrict selection to image versions affected by changes since a git ref
+        if since:
+            print(Rule(f"Finding image versions affected by changes since {since}"))
+            try:
+                changed = changed_files(since, manifest)
+                old_manifest = file_at(since, manifest)
+            except GitError as exc:
+                print(f"[red]{exc}[/red]")
+                sys.exit(1)
+            reasons: Dict[str, str] = {}
+            if old_manifest is None:
+                reasons = {name: "new manifest" for name in all_jobs}
+            else:
+                old_conf = load_manifest(OmegaConf.create(old_manifest))
+                load_old = lambda path: OmegaConf.create(file_at(since, path) or "{}")
+                if (resolve_config_reference(old_conf.metadata.REGISTRY, load_old) != registry or
+                        resolve_config_reference(old_conf.metadata.BUNDLE_VERSION, load_old) != BUNDLE_VERSION):
+                    reasons = {name: "registry or bundle version changed" for name in all_jobs}
+                elif old_conf.startup != conf.startup:
+                    reasons = {name: "startup settings changed" for name in all_jobs}
+                else:
+                    # changed variables, and the variables that refer to them
+                    changed_vars = dependent_keys(
+                        changed_keys(OmegaConf.to_container(old_conf.assign), manifest_assign, ignore=BUILD_SETTINGS_KEYS),
+                        manifest_assign)
+                    if changed_vars:
+                        print(f"Changed variables: {', '.join(sorted(changed_vars))}")
+                    for name, job in all_jobs.items():
+                        image_info = OmegaConf.to_container(conf.images[job.image])
+                        old_info = old_conf.images.get(job.image)
+                        old_info = old_info and OmegaConf.to_container(old_info)
+                        version_info = image_info["versions"][job.version] or {}
+                        if old_info is None:
+                            reasons[name] = "new image"
+                        elif job.version not in old_info["versions"]:
+                            reasons[name] = "new version"
+                        elif changed_keys(old_info, image_info, ignore=BUILD_SETTINGS_KEYS + ("versions",)) or \
+                                changed_keys(old_info["versions"][job.version] or {}, version_info,
+                                             ignore=BUILD_SETTINGS_KEYS):
+                            reasons[name] = "manifest entry changed"
+                        elif file_changed(job.dockerpath, changed):
+                            reasons[name] = "Dockerfile changed"
+                        elif context_changed(job.build_dir, changed):
+                            reasons[name] = "build context changed"
+                        elif HOOK_DIR in job.content and file_changed(HOOK_SOURCE, changed):
+                            reasons[name] = "numba cache hook changed"
                         else:
-                            print(f"  Image exists, but package unreleased, ok to push.")
-                    run(f"docker push {full_image}", cwd=path)
-                    if image_version == tag_latest.get(image):
-                        run(f"docker push {registry}/{image}:{BUNDLE_VERSION}")
-            progress.update(progress_task, description=
-                f"image [bold]{image}[/bold] [{i_image}/{len(imagenames)}]: tagging latest version")
-
-            # # apply :latest tag to images
-            # if all_versions and built_or_pushed_versions:
-            #     if latest is None:
-            #         latest = image_version  # use last version from loop above
-            #         run(f"docker tag {registry}/{image}:{latest} {registry}/{image}:{BUNDLE_VERSION}", cwd=build_dir)
-            #         if push:
-            #             run(f"docker push {registry}/{image}:{BUNDLE_VERSION}", cwd=path)
-            #     run(f"docker tag {registry}/{image}:{BUNDLE_VERSION} {registry}/{image}:latest", cwd=build_dir)
-            #     if push:
-            #         run(f"docker push {registry}/{image}:latest", cwd=path)
+                            uses_runtime = version_info.get("runtime", image_info.get("runtime"))
+                            used_vars = referenced_keys(
+                                open(job.dockerpath).read() + json.dumps(image_info, default=str) +
+                                ("{runtime_base_image}" if uses_runtime else ""), changed_vars)
+                            if used_vars:
+                                reasons[name] = f"{', '.join(sorted(used_vars))} changed"
+            # propagate to images built upon affected ones
+            children: Dict[str, List[str]] = {}
+            for job in all_jobs.values():
+                for parent in job.parents:
+                    children.setdefault(parent, []).append(job.name)
+            stack = list(reasons)
+            while stack:
+                name = stack.pop()
+                for child in children.get(name, []):
+                    if child not in reasons:
+                        reasons[child] = f"base {name} affected"
+                        stack.append(child)
+            for job in jobs:
+                if job.name in reasons:
+                    print(f"  [bold]{job.name}[/bold]: {reasons[job.name]}")
+            print(f"{sum(job.name in reasons for job in jobs)} of {len(jobs)} selected image version(s) affected")
+            jobs = [job for job in jobs if job.name in reasons]
+
+        # estimate costs and split into shards
+        if plan_file or shard_spec:
+            try:
+                shard_index, nshards = parse_shard(shard_spec) if shard_spec else (None, 1)
+            except ValueError as exc:
+                print(f"[red]{exc}[/red]")
+                sys.exit(1)
+            costs = recorded_costs([load_report(path) for path in cost_reports])
+            selected_names = {job.name for job in jobs}
+            plan_jobs = {}
+            for job in jobs:
+                cost = costs.get((job.image, job.version, job.cpu_variant))
+                plan_jobs[job.name] = PlanJob(job.name, heuristic_cost(job.content) if cost is None else cost,
+                                              "heuristic" if cost is None else "report",
+                                              parents=[parent for parent in job.parents if parent in selected_names],
+                                              pushed_parents=job.pushes_with_buildx)
+            shards = make_shards(plan_jobs, nshards)
+
+            if plan_file:
+                print(Rule(f"Build plan for {len(jobs)} image version(s) in {nshards} shard(s)"))
+                owners = {name: i for i, shard in enumerate(shards, 1) for name, owned in shard.items() if owned}
+                table = Table("image", "depends on", "cost (s)", "estimate", "shard", title="Build plan")
+                for name, plan_job in plan_jobs.items():
+                    table.add_row(name, ", ".join(plan_job.parents), f"{plan_job.cost:.0f}", plan_job.cost_source,
+                                  str(owners[name]))
+                print(table)
+                for i, shard in enumerate(shards, 1):
+                    bases = [name for name, owned in shard.items() if not owned]
+                    print(f"Shard {i}: {len(shard) - len(bases)} image version(s)" +
+                          (f" plus {len(bases)} base(s)" if bases else "") +
+                          f", estimated {shard_cost(shard, plan_jobs):.0f}s")
+                plan = dict(registry=registry, bundle=BUNDLE_VERSION, shards=nshards,
+                            jobs=[dict(name=job.name, image=job.image, version=job.version,
+                                       image_version=job.image_version, cpu_variant=job.cpu_variant,
+                                       full_image=job.full_image, fingerprint=job.fingerprint,
+                                       parents=plan_jobs[job.name].parents, cost=plan_jobs[job.name].cost,
+                                       cost_source=plan_jobs[job.name].cost_source, shard=owners[job.name])
+                                  for job in jobs],
+                            shard_costs=[shard_cost(shard, plan_jobs) for shard in shards],
+                            shard_jobs=[list(shard) for shard in shards])
+                with open(plan_file, "wt") as f:
+                    json.dump(plan, f, indent=2)
+                print(f"Wrote build plan to {plan_file}")
+                return
+
+            shard = shards[shard_index - 1]
+            for job in jobs:
+                job.replica = not shard.get(job.name, True)
+            jobs = [job for job in jobs if job.name in shard]
+            nbases = sum(job.replica for job in jobs)
+            print(f"Shard {shard_index}/{nshards}: {len(jobs) - nbases} image version(s)" +
+                  (f" plus {nbases} base(s) owned by other shards" if nbases else "") +
+                  f", estimated {shard_cost(shard, plan_jobs):.0f}s "
+                  f"(slowest shard {max(shard_cost(other, plan_jobs) for other in shards):.0f}s)")
+
+        # capture command output when running concurrently, so that it doesn't get interleaved
+        capture = jobs_ > 1
+
+        # pushes and pulls are retried on failure, since these often fail for transient reasons
+        transient = dict(retries=retries, retry_delay=retry_delay)
+
+        # registry checks are only served from the cache when listing, since the push policy depends on them
+        registry_probe = RegistryProbe(cache_dir=default_cache_dir(), ttl=probe_cache_ttl,
+                                       use_cache=do_list and not (build or push),
+                                       max_workers=max(jobs_, 16), method=probe)
+
+        build_state = BuildState(state_file)
+
+        lockfile = Lockfile(lockfile_path) if lockfile_path else None
+
+        lockfile_errors = set()
+
+        def record_digest(job: BuildJob, digest: Optional[str], layer_format: str = "gzip"):
+            """Records digest of pushed image (and of its latest tag) in lockfile. The image has been pushed
+            by now, so failing to record it is only worth a warning."""
+            if lockfile and digest:
+                refs = [job.full_image] + ([job.latest_tag] if job.latest_tag else [])
+                for ref in refs:
+                    if not lockfile.set(format_reference(ref, layer_format), digest) and \
+                            lockfile.error not in lockfile_errors:
+                        lockfile_errors.add(lockfile.error)
+                        print(f"[yellow]Warning: {lockfile.error}[/yellow]")
+
+        report = BuildReport(package_version=conf.metadata.PACKAGE_VERSION, bundle=BUNDLE_VERSION, registry=registry)
+        for job in jobs:
+            report.add_image(job.name, image=job.image, version=job.version, cpu_variant=job.cpu_variant,
+                             fingerprint=job.fingerprint)
+
+        def is_remote_current(job: BuildJob):
+            """Checks if registry image has the same fingerprint as the job"""
+            if job.remote_current is None:
+                job.remote_current = bool(job.remote_exists) and (
+                    build_state.get(job.full_image, "pushed") == job.fingerprint or
+                    (registry_probe.image_labels(job.full_image) or {}).get(FINGERPRINT_LABEL) == job.fingerprint)
+            return job.remote_current
+
+        def build_image(job: BuildJob):
+            print(Rule(f"Building {job.name}"))
+            # skip build if fingerprint hasn't changed
+            if not rebuild:
+                if local_image_fingerprint(job.full_image) == job.fingerprint:
+                    print(f"[green]{job.name} is unchanged (fingerprint {job.fingerprint[:12]}), skipping build[/green]")
+                    if job.latest_tag:
+                        with report.phase(job.name, "tag"):
+                            run(f"docker tag {job.full_image} {job.latest_tag}", capture=capture)
+                    build_state.set(job.full_image, "built", job.fingerprint)
+                    report.add_image(job.name, build="unchanged")
+                    return
+                if is_remote_current(job):
+                    print(f"[green]{job.name} in registry is unchanged (fingerprint {job.fingerprint[:12]}), skipping build[/green]")
+                    report.add_image(job.name, build="unchanged in registry")
+                    return
+            report.add_image(job.name, build="failed")
+            if job.cache_mode == "pull" and job.remote_exists and not no_cache:
+                print(f"Pulling {job.full_image} from registry")
+                with report.phase(job.name, "pull"):
+                    run(f"docker pull {job.full_image}", capture=capture, **transient)
+            if verbose:
+                print(f"Dockerfile:", style="bold")
+                print(f"{job.content}", style="dim", highlight=True)
+            if uses_buildx(job.cache_mode):
+                print(f"Using {job.cache_mode} build cache {job.cache_location}")
+                builder = f"docker buildx build --load {' '.join(buildx_cache_args(job.cache_mode, job.cache_location))}"
+            else:
+                builder = "docker build"
+            with report.phase(job.name, "build"):
+                run(f"{builder} {no_cache} --label {FINGERPRINT_LABEL}={job.fingerprint} -t {job.full_image} -f- {job.build_dir}",
+                    cwd=job.build_dir, input=job.content, capture=capture)
+            if job.cache_mode == "local":
+                commit_local_cache(job.cache_location)
+            size, layers = image_size_and_layers(job.full_image)
+            report.add_image(job.name, size=size, layers=layers)
+            if job.size_budget and size and size > job.size_budget:
+                report.add_image(job.name, build="over budget")
+                # remove the image, so that it is neither considered unchanged nor pushed by a later run
+                run(f"docker image rm {job.full_image}", capture=capture)
+                raise BuildError(f"{job.name} is {format_size(size)}, which exceeds its size budget of "
+                                 f"{format_size(job.size_budget)}")
+            build_state.set(job.full_image, "built", job.fingerprint)
+            if job.latest_tag:
+                with report.phase(job.name, "tag"):
+                    run(f"docker tag {job.full_image} {job.latest_tag}", capture=capture)
+            report.add_image(job.name, build="built")
+            print(f"[green]Built {job.name}[/green]" + (f", {format_size(size)} in {layers} layers" if size else ""))
+
+        def buildx_push(job: BuildJob, refs: List[str], layer_format: str, insecure: bool = False):
+            """Pushes image in the given layer format via buildx, reusing its build cache"""
+            args = buildx_cache_args(job.cache_mode, job.cache_location) if uses_buildx(job.cache_mode) else []
+            args += buildx_output_args(refs, layer_format, insecure)
+            run(f"docker buildx build {' '.join(args)} --label {FINGERPRINT_LABEL}={job.fingerprint} -f- {job.build_dir}",
+                cwd=job.build_dir, input=job.content, capture=capture, **transient)
+            if job.cache_mode == "local":
+                commit_local_cache(job.cache_location)
+
+        def push_layer_formats(job: BuildJob):
+            """Pushes additional layer formats of image, unless already pushed with the same fingerprint"""
+            for layer_format in job.layer_formats:
+                ref = format_reference(job.full_image, layer_format)
+                if not rebuild and build_state.get(ref, "pushed") == job.fingerprint:
+                    print(f"[green]{ref} is unchanged (fingerprint {job.fingerprint[:12]}), skipping push[/green]")
+                    continue
+                refs = [ref]
+                if job.latest_tag:
+                    refs.append(format_reference(job.latest_tag, layer_format))
+                with report.phase(job.name, "push"):
+                    buildx_push(job, refs, layer_format)
+                digest = registry_probe.digest(ref)
+                record_digest(job, digest, layer_format)
+                registry_probe.record(ref, ProbeResult(True, digest))
+                build_state.set(ref, "pushed", job.fingerprint)
+                print(f"[green]Pushed {ref}[/green]")
+
+        def measure_pulls(job: BuildJob):
+            print(Rule(f"Measuring pulls of {job.name} from {measure_registry}"))
+            for layer_format in ["gzip"] + job.layer_formats:
+                ref = format_reference(f"{measure_registry}/{job.image}:{job.image_version}", layer_format)
+                if layer_format == "gzip":
+                    run(f"docker tag {job.full_image} {ref}", capture=capture)
+                    run(f"docker push {ref}", capture=capture, **transient)
+                    run(f"docker image rm {ref}", capture=capture)
+                else:
+                    buildx_push(job, [ref], layer_format, insecure=True)
+                size = registry_probe.compressed_size(ref)
+                try:
+                    # every format is pulled into an empty store, see timed_pull()
+                    pull_time = timed_pull(ref, insecure_registry=measure_registry)
+                except subprocess.CalledProcessError as exc:
+                    raise BuildError(f"pull of {ref} failed: {exc.stderr.strip()}")
+                report.add_format(job.name, layer_format, compressed_size=size, pull=pull_time)
+                print(f"{ref}: {format_size(size) or 'unknown size'}, pulled in {pull_time:.1f}s")
+
+        sif_cache = sif_dir and SifCache(sif_dir, sif_converter)
+
+        def convert_sif(job: BuildJob):
+            print(Rule(f"Converting {job.name} to SIF"))
+            digest = registry_probe.digest(job.full_image) if push else job.remote_digest
+            if not (push or job.remote_exists):
+                print(f"[yellow]{job.full_image} not in registry, can't convert it[/yellow]")
+                return
+            if not rebuild and sif_cache.is_current(job.full_image, digest):
+                print(f"[green]{sif_cache.path(job.full_image)} is up to date (digest {digest}), skipping[/green]")
+                report.add_image(job.name, sif="unchanged")
+                return
+            try:
+                with report.phase(job.name, "sif"):
+                    entry = with_retries(
+                        partial(sif_cache.convert, job.full_image, digest, capture=capture,
+                                aliases=[job.latest_tag] if job.latest_tag else []),
+                        retries, retry_delay, exceptions=(RuntimeError,),
+                        on_retry=lambda exc, retry, wait:
+                            print(f"[yellow]{exc}, retrying in {wait:g}s (retry {retry} of {retries})[/yellow]"))
+            except RuntimeError as exc:
+                raise BuildError(f"{job.name}: {exc}")
+            report.add_image(job.name, sif="converted", sif_size=entry["size"])
+            print(f"[green]Converted {job.name} to {sif_cache.path(job.full_image)} ({format_size(entry['size'])})[/green]")
+
+        def push_image(job: BuildJob):
+            print(Rule(f"Pushing {job.name}"))
+            if not rebuild and is_remote_current(job):
+                print(f"[green]{job.name} in registry is unchanged (fingerprint {job.fingerprint[:12]}), skipping push[/green]")
+                record_digest(job, job.remote_digest)
+                push_layer_formats(job)
+                return
+            if job.remote_exists:
+                # version mismatch
+                if unprefixed_image_version != conf.metadata.PACKAGE_VERSION:
+                    if unprefixed_image_version == candidate_base:
+                        print(f"  Image exists but package is a release candidate for image version: ok to push.")
+                    else:
+                        print(f"  [red]Image exists and package version doesn't match image version: won't push {job.name}.[/red]")
+                        return
+                elif current_release:
+                    if not candidate_release:
+                        print(f"  [red]Image exists and package released: won't push {job.name}.[/red]")
+                        return
+                    else:
+                        print(f"  Image exists, but package is a release candidate: ok to push.")
+                else:
+                    print(f"  Image exists, but package unreleased, ok to push.")
+            report.add_image(job.name, push="failed")
+            with report.phase(job.name, "push"):
+                run(f"docker push {job.full_image}", cwd=job.path, capture=capture, **transient)
+                if job.latest_tag:
+                    run(f"docker push {job.latest_tag}", capture=capture, **transient)
+            report.add_image(job.name, push="pushed")
+            digest = local_repo_digest(job.full_image) or registry_probe.digest(job.full_image)
+            record_digest(job, digest)
+            registry_probe.record(job.full_image, ProbeResult(True, digest))
+            build_state.set(job.full_image, "pushed", job.fingerprint)
+            print(f"[green]Pushed {job.name}[/green]")
+            push_layer_formats(job)
+
+        def update_progress(running, ndone, ntotal):
+            description = f"{ndone}/{ntotal} done"
+            if running:
+                description += f", running [bold]{', '.join(sorted(running))}[/bold]"
+            progress.update(progress_task, description=description)
+
+        # journal of completed steps, so that an interrupted run can be resumed
+        journal_active = bool(journal_file) and bool(build or push or sif_dir)
+        journal = BuildJournal(journal_file if journal_active else None)
+        resumed = journal_active and journal.start(sys.argv[1:], resume=resume)
+        if resumed:
+            print(f"Resuming run of {journal.run['started']}: {' '.join(journal.run.get('command') or [])}")
+        elif resume:
+            print("[yellow]No unfinished run found in journal, starting afresh[/yellow]")
+        task_jobs: Dict[str, BuildJob] = {}
+
+        def journalled(func, step: str, job: BuildJob):
+            """Wraps step of job, recording its completion in the journal"""
+            name = f"{step} {job.name}"
+            task_jobs[name] = job
+
+            def wrapper():
+                func(job)
+                journal.record(name, job.fingerprint)
+            return wrapper
+
+        max_cpus = max_cpus or os.cpu_count()
+        max_memory = parse_size(max_memory)
+        print(f"Running up to {jobs_} task(s) concurrently, CPU budget {max_cpus}" +
+              (f", memory budget {max_memory/2**30:.1f}G" if max_memory else ""))
+
+        try:
+            tasks = []
+            run_names = {job.name for job in jobs}
+            for job in jobs:
+                if build:
+                    # parents outside this run are taken from the registry (or local images)
+                    parents = [parent for parent in job.parents if parent in run_names]
+                    deps = {f"build {parent}" for parent in parents}
+                    # buildx builders with a container driver can't see local images, so parents have to
+                    # be pushed first. Sharding keeps such parents in the same shard (see make_shards()),
+                    # so that they are never replicas, which aren't pushed.
+                    if push and job.pushes_with_buildx:
+                        deps |= {f"push {parent}" for parent in parents}
+                    tasks.append(Task(f"build {job.name}", journalled(build_image, "build", job), deps=deps,
+                                      cpus=job.cpus, memory=job.memory))
+                if job.replica:
+                    continue
+                if push:
+                    tasks.append(Task(f"push {job.name}", journalled(push_image, "push", job),
+                                      deps={f"build {job.name}"} if build else set(), cpus=0))
+                if sif_dir:
+                    tasks.append(Task(f"sif {job.name}", journalled(convert_sif, "sif", job),
+                                      deps={f"push {job.name}"} if push else set()))
+                if measure_registry and build:
+                    tasks.append(Task(f"measure {job.name}", journalled(measure_pulls, "measure", job),
+                                      deps={f"build {job.name}"} | ({f"push {job.name}"} if push else set())))
+
+            # skip steps completed by the run being resumed, along with the dependencies on them. Images with
+            # nothing left to do need not be looked up in the registry.
+            probe_jobs = jobs
+            if resumed:
+                completed = [task.name for task in tasks if journal.is_done(task.name, task_jobs[task.name].fingerprint)]
+                for name in completed:
+                    print(f"[green]{name} was completed by the previous run, skipping[/green]")
+                tasks = [task for task in tasks if task.name not in completed]
+                for task in tasks:
+                    task.deps -= set(completed)
+                probe_jobs = [job for job in jobs if any(task_jobs[task.name] is job for task in tasks)]
+
+            # check if remote images exist
+            if (push or build or do_list or sif_dir) and probe_jobs:
+                print(Rule(f"Checking registry for {len(probe_jobs)} image(s)"))
+                progress.update(progress_task, description=f"checking registry for {len(probe_jobs)} image(s)")
+                try:
+                    results = registry_probe.check([job.full_image for job in probe_jobs])
+                except RegistryError as exc:
+                    raise BuildError(str(exc))
+                for job in probe_jobs:
+                    job.remote_exists, job.remote_digest = results[job.full_image]
+                    report.add_time(job.name, "inspect", registry_probe.durations.get(job.full_image, 0))
+                    if job.remote_exists:
+                        print(f"  Manifest returned for {job.full_image}")
+                    else:
+                        print(f"  [green]No manifest returned for {job.full_image}[/green]")
+
+            if tasks:
+                print(Rule(f"Running {len(tasks)} build/push task(s)"))
+                try:
+                    run_tasks(tasks, max_workers=jobs_, max_cpus=max_cpus, max_memory=max_memory,
+                              callback=update_progress)
+                except ValueError as exc:
+                    # dependency cycle, duplicate task names, or dependencies on missing tasks
+                    raise BuildError(str(exc))
+            if journal_active:
+                journal.finish()
+        except TaskFailed as exc:
+            for name, error in exc.failures.items():
+                print(f"[red]{name} failed: {error}[/red]")
+            sys.exit(1)
+        except BuildError as exc:
+            print(f"[red]{exc}[/red]")
+            sys.exit(1)
+        finally:
+            registry_probe.save()
+            if report_file:
+                report.save(report_file)
+                print(f"Wrote build report to {report_file}")
+
+        regressions = []
+        if report_file or compare_file:
+            report_dict = report.to_dict()
+            table = Table("image", *PHASES, "total", "size", "layers", title="Build timings (s)")
+            for name, entry in report_dict["images"].items():
+                phases = entry["phases"]
+                table.add_row(name, *[f"{phases[phase]:.1f}" if phase in phases else "" for phase in PHASES],
+                              f"{entry['total']:.1f}", format_size(entry.get("size")), str(entry.get("layers") or ""))
+            print(table)
+            formats = [(name, layer_format, info) for name, entry in report_dict["images"].items()
+                       for layer_format, info in entry.get("formats", {}).items()]
+            if formats:
+                table = Table("image", "format", "compressed", "pull", title="Layer formats")
+                for name, layer_format, info in formats:
+                    table.add_row(name, layer_format, format_size(info.get("compressed_size")),
+                                  f"{info['pull']:.1f}" if info.get("pull") is not None else "")
+                print(table)
+            if compare_file:
+                print(Rule(f"Comparing against {compare_file}"))
+                regressions = compare_reports(load_report(compare_file), report_dict, threshold)
+                for message in regressions:
+                    print(f"  [red]{message}[/red]")
+                if not regressions:
+                    print(f"  [green]No build time or size increases above {threshold*100:.0f}%[/green]")
+
+        remote_images_exist = {}
+        for job in jobs:
+            remote_images_exist.setdefault(job.image, {})[job.image_version] = job.remote_exists
 
     if do_list:
         print(Rule(f"Image list follows"))
         any_not_found = False
         for image in imagenames:
-            found = [version for version, exists in remote_images_exist[image].items() if exists]
-            not_found = [version for version, exists in remote_images_exist[image].items() if not exists]
+            found = [version for version, exists in remote_images_exist.get(image, {}).items() if exists]
+            not_found = [version for version, exists in remote_images_exist.get(image, {}).items() if not exists]
             messages = [f"[green]{' '.join(found)}[/green] found"] if found else []
             if not_found:
                 messages.append(f"[red]{' '.join(not_found)}[/red] not found")
@@ -383,6 +1118,10 @@ def build_cargo(manifest: str, do_list=False, build=False, push=False, all=False
             print("One or more image versions not found", style="red")
             sys.exit(1)
 
+    if regressions:
+        print(f"{len(regressions)} build time or size regression(s) found", style="red")
+        sys.exit(1)
+
 
     print("Success!", style="green")
 
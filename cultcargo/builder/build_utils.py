@@ -1,5 +1,6 @@
 import os
-from typing import Any
+import time
+from typing import Any, Callable, Optional, Tuple, Type
 from omegaconf import OmegaConf, DictConfig
 
 
@@ -41,3 +42,35 @@ def resolve_version_substitutions(config):
 
     return
 
+
+_SIZE_UNITS = dict(K=2**10, M=2**20, G=2**30, T=2**40)
+
+def parse_size(size: Any):
+    """Converts a size such as 512M or 1.5G into a number of bytes. Plain numbers are taken as bytes."""
+    if size is None or isinstance(size, (int, float)):
+        return size
+    size = str(size).strip().upper().rstrip("B").rstrip("I")
+    if size and size[-1] in _SIZE_UNITS:
+        return int(float(size[:-1]) * _SIZE_UNITS[size[-1]])
+    return int(float(size))
+
+def default_cache_dir():
+    """Returns directory for build-cargo caches and state files, following XDG conventions"""
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "cult-cargo")
+
+def with_retries(func: Callable[[], Any], retries: int = 0, delay: float = 5,
+                 exceptions: Tuple[Type[BaseException], ...] = (Exception,),
+                 on_retry: Optional[Callable[[BaseException, int, float], None]] = None):
+    """Calls func(), retrying up to the given number of times if it raises one of the given exceptions.
+    Retries back off exponentially (delay, 2*delay, 4*delay, ...). on_retry, if given, is called with
+    the exception, the number of the upcoming retry and the time waited before it."""
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except exceptions as exc:
+            if attempt >= retries:
+                raise
+            wait = delay * 2**attempt
+            if on_retry:
+                on_retry(exc, attempt + 1, wait)
+            time.sleep(wait)
@@ -0,0 +1,69 @@
+import os.path
+import shutil
+from typing import List, Dict, Tuple, Any
+
+
+# Build cache modes:
+#   pull:               pull existing image from registry before building, to seed the docker build cache
+#   none:               no cache seeding, plain docker build
+#   local[:DIR]:        buildx build importing/exporting the layer cache from/to a local directory
+#   registry[:REF]:     buildx build importing/exporting the layer cache from/to a registry cache image
+CACHE_MODES = ("pull", "none", "local", "registry")
+
+DEFAULT_LOCAL_CACHE = "{CACHE_DIR}/buildkit/{IMAGE}/{VERSION}"
+DEFAULT_REGISTRY_CACHE = "{REGISTRY}/{IMAGE}:buildcache-{VERSION}"
+
+
+def resolve_cache_spec(spec: str, fields: Dict[str, Any]) -> Tuple[str, str]:
+    """Resolves a cache specification (see CACHE_MODES) into a (mode, location) tuple.
+
+    A location may contain {IMAGE}, {VERSION}, {IMAGE_VERSION}, {REGISTRY} and {CACHE_DIR} placeholders.
+    If it contains none, a per-version component is appended to it.
+    """
+    mode, _, location = spec.partition(":")
+    if mode not in CACHE_MODES:
+        raise ValueError(f"unknown build cache mode '{mode}', expecting one of {', '.join(CACHE_MODES)}")
+    if mode == "local":
+        if not location:
+            location = DEFAULT_LOCAL_CACHE
+        elif "{" not in location:
+            location = os.path.join(location, "{IMAGE}", "{VERSION}")
+        location = os.path.abspath(os.path.expanduser(location.format(**fields)))
+    elif mode == "registry":
+        if not location:
+            location = DEFAULT_REGISTRY_CACHE
+        elif "{" not in location:
+            location = location.rstrip("/") + "/{IMAGE}:{VERSION}"
+        location = location.format(**fields)
+    return mode, location
+
+
+def uses_buildx(mode: str):
+    return mode in ("local", "registry")
+
+
+def buildx_cache_args(mode: str, location: str) -> List[str]:
+    """Returns --cache-from/--cache-to arguments for docker buildx build.
+
+    The local cache is exported into a staging directory, which replaces the cache directory once
+    the build has succeeded (see commit_local_cache()), since buildkit never prunes a local cache in place.
+    """
+    if mode == "local":
+        args = []
+        if os.path.exists(os.path.join(location, "index.json")):
+            args.append(f"--cache-from=type=local,src={location}")
+        args.append(f"--cache-to=type=local,dest={location}.new,mode=max")
+        return args
+    elif mode == "registry":
+        return [f"--cache-from=type=registry,ref={location}",
+                f"--cache-to=type=registry,ref={location},mode=max"]
+    return []
+
+
+def commit_local_cache(location: str):
+    """Replaces local cache directory by newly exported cache"""
+    staging = f"{location}.new"
+    if os.path.isdir(staging):
+        if os.path.isdir(location):
+            shutil.rmtree(location)
+        os.rename(staging, location)
@@ -0,0 +1,79 @@
+import os
+import re
+import subprocess
+from typing import List, Dict, Set, Optional, Any, Iterable
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(args: List[str], cwd: str):
+    result = subprocess.run(["git"] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode:
+        raise GitError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def git_toplevel(path: str):
+    """Returns top directory of git working tree containing path"""
+    return os.path.realpath(_git(["rev-parse", "--show-toplevel"], cwd=os.path.dirname(os.path.abspath(path))).strip())
+
+
+def changed_files(since: str, path: str) -> Set[str]:
+    """Returns paths of files in the git working tree containing path which differ from the given ref,
+    including uncommitted and untracked files"""
+    top = git_toplevel(path)
+    try:
+        _git(["rev-parse", "--verify", "--quiet", f"{since}^{{commit}}"], cwd=top)
+    except GitError:
+        raise GitError(f"unknown git ref '{since}'")
+    names = _git(["diff", "--name-only", since, "--"], cwd=top).split("\n")
+    names += _git(["ls-files", "--others", "--exclude-standard"], cwd=top).split("\n")
+    return {os.path.join(top, name) for name in names if name}
+
+
+def file_at(since: str, path: str) -> Optional[str]:
+    """Returns content of file at the given git ref, or None if it didn't exist then"""
+    top = git_toplevel(path)
+    relpath = os.path.relpath(os.path.realpath(path), top)
+    try:
+        return _git(["show", f"{since}:{relpath}"], cwd=top)
+    except GitError:
+        return None
+
+
+def changed_keys(old: Dict[str, Any], new: Dict[str, Any], ignore: Iterable[str] = ()) -> Set[str]:
+    """Returns keys whose values differ between two dicts (including added and removed keys)"""
+    return {key for key in set(old) | set(new)
+            if key not in ignore and (key not in old or key not in new or old[key] != new[key])}
+
+
+def dependent_keys(keys: Set[str], assign: Dict[str, Any]) -> Set[str]:
+    """Extends a set of changed variables by all variables whose values refer to them as {VAR}"""
+    keys = set(keys)
+    while True:
+        more = {key for key, value in assign.items() if key not in keys and isinstance(value, str) and
+                any(f"{{{var}}}" in value for var in keys)}
+        if not more:
+            return keys
+        keys |= more
+
+
+def referenced_keys(text: str, keys: Set[str]) -> Set[str]:
+    """Returns those of the given variables that are referred to as {VAR} in text"""
+    return set(re.findall(r"{(\w+)}", text)) & keys
+
+
+def file_changed(path: str, changed: Set[str]):
+    """Checks if file (or, if it is a symlink, its target) is among the changed files"""
+    return os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path)) in changed or \
+        os.path.realpath(path) in changed
+
+
+def context_changed(build_dir: str, changed: Set[str]):
+    """Checks if any file in a build context directory is among the changed files. Dockerfiles are excluded
+    (as in the fingerprint), since a directory can hold the Dockerfiles of several versions."""
+    build_dir = os.path.join(os.path.realpath(build_dir), "")
+    return any(path.startswith(build_dir) and not os.path.basename(path).startswith("Dockerfile")
+               for path in changed)
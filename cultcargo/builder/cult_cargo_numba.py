@@ -0,0 +1,217 @@
+"""Numba cache support for cult-cargo images.
+
+This file is installed into images that ship a pre-warmed numba cache (see cultcargo/builder/jitcache.py),
+together with a .pth file putting it on the path and importing it, so that seed() runs at interpreter
+startup, before numba reads its configuration. It sticks to the standard library (importing little of it on
+the common paths, as it runs whenever Python starts), and never raises.
+
+seed() picks the numba cache directory of the container:
+
+* if NUMBA_CACHE_DIR was set to something other than the pre-warmed cache, that directory is used;
+* if a persistent cache directory is mounted at CULT_CARGO_NUMBA_MOUNT, a subdirectory specific to this
+  build of the image is used, so that images (and rebuilds of an image) never overwrite each other's entries;
+* if the pre-warmed cache itself is writable (i.e. the container runs as root), it is used in place;
+* otherwise (e.g. a read-only singularity image), a directory under $TMPDIR is used.
+
+Anything but the pre-warmed cache itself is first seeded with a copy of it, so that kernels compiled during
+the build are never compiled again, and kernels compiled at run time are kept for later steps when the directory
+is persistent.
+
+Run as "python -m cult_cargo_numba warmup" during the build, it imports the given modules (compiling and
+caching any kernels declared with explicit signatures) and, optionally, creates a tiny synthetic Measurement
+Set that warm-up commands can run the tools on.
+"""
+import os
+import sys
+
+PREWARMED_ENV = "CULT_CARGO_NUMBA_PREWARMED"
+MOUNT_ENV = "CULT_CARGO_NUMBA_MOUNT"
+IMAGE_ENV = "CULT_CARGO_IMAGE"
+
+# file in the pre-warmed cache identifying the build that produced it
+BUILD_ID_FILE = "BUILD_ID"
+
+
+def _writable(path):
+    return os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK)
+
+
+def _build_key(prewarmed):
+    """Returns name of the cache subdirectory for this build of the image"""
+    image = os.environ.get(IMAGE_ENV, "image").replace("/", "_").replace(":", "-")
+    try:
+        with open(os.path.join(prewarmed, BUILD_ID_FILE)) as f:
+            build_id = f.read().strip()
+    except OSError:
+        build_id = ""
+    return "{}-{}".format(image, build_id[:16]) if build_id else image
+
+
+def _copy_tree(src, dest):
+    """Copies files from src to dest, leaving existing files alone. Each file is copied under a temporary name
+    and renamed into place, so that concurrent containers seeding the same directory never see partial files."""
+    import shutil
+    import tempfile
+    for root, _, files in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            if name == BUILD_ID_FILE or os.path.exists(os.path.join(target, name)):
+                continue
+            fd, tmp = tempfile.mkstemp(dir=target, prefix=".seed-")
+            os.close(fd)
+            try:
+                shutil.copyfile(os.path.join(root, name), tmp)
+                os.replace(tmp, os.path.join(target, name))
+            except OSError:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+
+
+def _seed(prewarmed, cache_dir):
+    """Seeds cache_dir from the pre-warmed cache, once. Returns True if cache_dir is usable."""
+    marker = os.path.join(cache_dir, ".seeded-" + _build_key(prewarmed))
+    if os.path.exists(marker):
+        return True
+    try:
+        _copy_tree(prewarmed, cache_dir)
+        open(marker, "w").close()
+    except OSError:
+        return _writable(cache_dir)
+    return True
+
+
+def seed():
+    prewarmed = os.environ.get(PREWARMED_ENV)
+    if not prewarmed or not os.path.isdir(prewarmed):
+        return
+    try:
+        cache_dir = os.environ.get("NUMBA_CACHE_DIR")
+        mount = os.environ.get(MOUNT_ENV)
+        candidates = []
+        if cache_dir and os.path.abspath(cache_dir) != os.path.abspath(prewarmed):
+            candidates.append(cache_dir)
+        elif mount and _writable(mount):
+            candidates.append(os.path.join(mount, _build_key(prewarmed)))
+        elif _writable(prewarmed):
+            os.environ["NUMBA_CACHE_DIR"] = prewarmed
+            return
+        import tempfile
+        candidates.append(os.path.join(tempfile.gettempdir(), "cult-cargo-numba", _build_key(prewarmed)))
+        for candidate in candidates:
+            if _seed(prewarmed, candidate):
+                os.environ["NUMBA_CACHE_DIR"] = candidate
+                return
+    except Exception:
+        pass
+
+
+def make_ms(path, nant=4, ntime=4, nchan=8):
+    """Creates a tiny Measurement Set with a single field, spectral window and four correlations, with DATA
+    and MODEL_DATA columns, for warm-up runs of calibration and flagging tools. Needs python-casacore."""
+    import numpy as np
+    from casacore import tables
+
+    ncorr = 4
+    ant1, ant2 = np.triu_indices(nant, 1)
+    nbl = len(ant1)
+    nrow = nbl * ntime
+    shape = (nrow, nchan, ncorr)
+    rng = np.random.default_rng(42)
+
+    columns = [tables.makearrcoldesc(name, 0j, shape=[nchan, ncorr], valuetype="complex")
+               for name in ("DATA", "MODEL_DATA")]
+    ms = tables.default_ms(path, tables.maketabdesc(columns))
+    ms.addrows(nrow)
+    ms.putcol("TIME", np.repeat(5e9 + 8.0 * np.arange(ntime), nbl))
+    ms.putcol("TIME_CENTROID", ms.getcol("TIME"))
+    for name in ("INTERVAL", "EXPOSURE"):
+        ms.putcol(name, np.full(nrow, 8.0))
+    ms.putcol("ANTENNA1", np.tile(ant1, ntime))
+    ms.putcol("ANTENNA2", np.tile(ant2, ntime))
+    ms.putcol("UVW", rng.normal(scale=1000.0, size=(nrow, 3)))
+    ms.putcol("DATA", (1 + 0.1 * rng.normal(size=shape)).astype(np.complex64))
+    ms.putcol("MODEL_DATA", np.ones(shape, np.complex64))
+    ms.putcol("FLAG", np.zeros(shape, bool))
+    ms.putcol("FLAG_ROW", np.zeros(nrow, bool))
+    for name in ("WEIGHT", "SIGMA"):
+        ms.putcol(name, np.ones((nrow, ncorr), np.float32))
+    ms.close()
+
+    def subtable(name, nrow, **values):
+        with tables.table(os.path.join(path, name), readonly=False, ack=False) as tab:
+            tab.addrows(nrow)
+            for column, value in values.items():
+                tab.putcol(column, value)
+
+    chan_freq = 1.4e9 + 1e6 * np.arange(nchan)
+    subtable("ANTENNA", nant, NAME=["A{}".format(i) for i in range(nant)],
+             STATION=["S{}".format(i) for i in range(nant)], TYPE=["GROUND-BASED"] * nant, MOUNT=["alt-az"] * nant,
+             POSITION=5109000.0 + 100.0 * rng.normal(size=(nant, 3)), DISH_DIAMETER=np.full(nant, 13.5))
+    subtable("FEED", nant, ANTENNA_ID=np.arange(nant), NUM_RECEPTORS=np.full(nant, 2),
+             POLARIZATION_TYPE=np.array([["X", "Y"]] * nant), RECEPTOR_ANGLE=np.zeros((nant, 2)),
+             BEAM_OFFSET=np.zeros((nant, 2, 2)), POL_RESPONSE=np.tile(np.eye(2, dtype=complex), (nant, 1, 1)),
+             POSITION=np.zeros((nant, 3)), SPECTRAL_WINDOW_ID=np.full(nant, -1))
+    subtable("SPECTRAL_WINDOW", 1, NUM_CHAN=[nchan], CHAN_FREQ=chan_freq[None], REF_FREQUENCY=[chan_freq[0]],
+             CHAN_WIDTH=np.full((1, nchan), 1e6), EFFECTIVE_BW=np.full((1, nchan), 1e6),
+             RESOLUTION=np.full((1, nchan), 1e6), TOTAL_BANDWIDTH=[1e6 * nchan], NAME=["SPW0"])
+    # XX, XY, YX, YY
+    subtable("POLARIZATION", 1, NUM_CORR=[ncorr], CORR_TYPE=np.array([[9, 10, 11, 12]]),
+             CORR_PRODUCT=np.array([[[0, 0], [0, 1], [1, 0], [1, 1]]]))
+    subtable("DATA_DESCRIPTION", 1, SPECTRAL_WINDOW_ID=[0], POLARIZATION_ID=[0])
+    direction = np.array([[[0.0, -0.5]]])
+    subtable("FIELD", 1, NAME=["FIELD0"], NUM_POLY=[0], PHASE_DIR=direction, DELAY_DIR=direction,
+             REFERENCE_DIR=direction)
+    subtable("OBSERVATION", 1, TELESCOPE_NAME=["MeerKAT"], OBSERVER=["cult-cargo"],
+             TIME_RANGE=np.array([[5e9, 5e9 + 8.0 * ntime]]))
+    subtable("STATE", 1, OBS_MODE=["TARGET"])
+
+
+def warmup(argv):
+    import argparse
+    import importlib
+    import pkgutil
+    import uuid
+
+    parser = argparse.ArgumentParser(prog="python -m cult_cargo_numba warmup",
+                                     description="Populates the pre-warmed numba cache of a cult-cargo image")
+    parser.add_argument("--import", dest="modules", action="append", default=[],
+                        help="import this package and all its submodules (may be repeated)")
+    parser.add_argument("--ms", help="create a tiny synthetic Measurement Set at this path")
+    args = parser.parse_args(argv)
+
+    prewarmed = os.environ.get(PREWARMED_ENV)
+    if not prewarmed:
+        parser.error("{} not set".format(PREWARMED_ENV))
+    os.makedirs(prewarmed, exist_ok=True)
+
+    failures = 0
+    for name in args.modules:
+        module = importlib.import_module(name)
+        for info in pkgutil.walk_packages(getattr(module, "__path__", []), name + ".",
+                                          onerror=lambda name: None):
+            # __main__ modules would run the tool
+            if info.name.endswith(".__main__"):
+                continue
+            # tests and optional integrations may need packages that aren't installed, which costs us nothing
+            try:
+                importlib.import_module(info.name)
+            except Exception as exc:
+                failures += 1
+                print("warm-up: skipping {}: {}: {}".format(info.name, type(exc).__name__, exc))
+    if args.ms:
+        make_ms(args.ms)
+
+    # identifies the build, and thereby the image digest, see _build_key()
+    with open(os.path.join(prewarmed, BUILD_ID_FILE), "w") as f:
+        f.write(uuid.uuid4().hex + "\n")
+    print("warm-up: {} module(s) could not be imported".format(failures))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["warmup"]:
+        warmup(sys.argv[2:])
+    else:
+        print("usage: python -m cult_cargo_numba warmup [--import MODULE] [--ms PATH]")
+        sys.exit(1)
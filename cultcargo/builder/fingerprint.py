@@ -0,0 +1,89 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+from typing import List, Dict, Optional, Any
+
+
+# image label under which fingerprints are stored
+FINGERPRINT_LABEL = "org.cult-cargo.fingerprint"
+
+
+def hash_build_context(build_dir: str, hasher=None):
+    """Hashes the content of a build context directory (Dockerfiles and .git excepted). Returns the hash object."""
+    hasher = hasher or hashlib.sha256()
+    for root, dirs, files in os.walk(build_dir):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        for filename in sorted(files):
+            # Dockerfiles are rendered and hashed separately
+            if filename.startswith("Dockerfile"):
+                continue
+            filepath = os.path.join(root, filename)
+            hasher.update(os.path.relpath(filepath, build_dir).encode())
+            hasher.update(b"\0")
+            if os.path.islink(filepath):
+                hasher.update(os.readlink(filepath).encode())
+            elif os.path.isfile(filepath):
+                with open(filepath, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        hasher.update(chunk)
+            hasher.update(b"\0")
+    return hasher
+
+
+def compute_fingerprint(content: str, build_dir: str, assign: Dict[str, Any], parent_fingerprints: List[str]):
+    """Computes fingerprint of an image version from its rendered Dockerfile, build context,
+    assigned variables and the fingerprints of its parent images"""
+    hasher = hashlib.sha256()
+    hasher.update(content.encode())
+    hasher.update(b"\0")
+    hash_build_context(build_dir, hasher)
+    hasher.update(json.dumps(assign, sort_keys=True, default=str).encode())
+    for fingerprint in parent_fingerprints:
+        hasher.update(fingerprint.encode())
+    return hasher.hexdigest()
+
+
+class BuildState(object):
+    """Local record of fingerprints of built and pushed images, kept in a JSON file"""
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.images = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            try:
+                self.images = json.load(open(path))
+            except Exception:
+                self.images = {}
+
+    def get(self, full_image: str, what: str):
+        """Returns fingerprint recorded for image. what is 'built' or 'pushed'."""
+        return self.images.get(full_image, {}).get(what)
+
+    def set(self, full_image: str, what: str, fingerprint: str):
+        with self._lock:
+            self.images.setdefault(full_image, {})[what] = fingerprint
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmpfile = f"{self.path}.{os.getpid()}"
+            with open(tmpfile, "wt") as f:
+                json.dump(self.images, f, indent=1)
+            os.replace(tmpfile, self.path)
+
+
+
+def local_image_fingerprint(full_image: str) -> Optional[str]:
+    """Returns fingerprint label of local docker image, or None if the image (or label) doesn't exist"""
+    result = subprocess.run(["docker", "image", "inspect", "--format",
+                             f'{{{{ index .Config.Labels "{FINGERPRINT_LABEL}" }}}}', full_image],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if result.returncode:
+        return None
+    fingerprint = result.stdout.strip()
+    return fingerprint if fingerprint and fingerprint != "<no value>" else None
@@ -0,0 +1,105 @@
+import os
+import shlex
+from typing import Dict, Any, Optional
+
+
+# pre-warmed numba cache inside the image
+NUMBA_CACHE_DIR = "/opt/cult-cargo/numba-cache"
+
+# where cabs mount a persistent (host) cache directory, see lib.misc.cult-cargo.numba-cache
+NUMBA_MOUNT = "/cult-cargo/numba-cache"
+
+# scratch directory of the warm-up run, removed afterwards. Warm-up commands find the synthetic
+# Measurement Set (if requested) in $WARMUP_MS.
+WARMUP_DIR = "/tmp/cult-cargo-warmup"
+
+# module installed into the image, which seeds the cache directory of each container from the pre-warmed cache.
+# It is staged into the build context of the image (see stage_hook()), and copied into HOOK_DIR, which a .pth
+# file puts on the path of the image's Python.
+HOOK_MODULE = "cult_cargo_numba"
+HOOK_SOURCE = os.path.join(os.path.dirname(__file__), f"{HOOK_MODULE}.py")
+HOOK_DIR = "/opt/cult-cargo/python"
+
+
+def numba_cpu_name(cpu_variant: str = "", portable: bool = False) -> Optional[str]:
+    """Returns the CPU that numba compiles for, both during the warm-up and at run time, since caches are keyed
+    on the CPU name and features. Images tuned for a CPU variant (an x86-64 microarchitecture level, which LLVM
+    knows as a CPU name) compile for that level. Portable images compile for a generic CPU, which makes the
+    pre-warmed cache usable on any host, at the cost of SIMD instructions in kernels compiled at run time too.
+    Others compile for the host CPU (None), so the pre-warmed cache only serves hosts with the same CPU as the
+    build machine, and other hosts compile their own kernels on first use."""
+    if cpu_variant:
+        return cpu_variant
+    return "generic" if portable else None
+
+
+def add_numba_warmup(content: str, warmup: Dict[str, Any], python: str, image: str, cpu_variant: str = ""):
+    """Adds a pre-warmed numba cache to a rendered Dockerfile.
+
+    The warmup dict gives the packages to import ("modules": importing them compiles kernels that declare
+    their signatures), whether to create a tiny synthetic Measurement Set ("ms"), and shell commands exercising
+    the remaining kernels ("commands"), and whether to compile for a generic CPU ("portable", see
+    numba_cpu_name()). Commands run on a best-effort basis: a failing command merely leaves its
+    kernels to be compiled at run time, so it is reported but doesn't fail the build.
+
+    Also installs the cult_cargo_numba module, which has to be staged into the build context with stage_hook(),
+    and a .pth file running it at interpreter startup, which points numba at a writable copy of the cache if
+    the image is read-only, or at a persistent cache directory if one is mounted. The pre-warmed cache itself is
+    only writable by root.
+    """
+    modules = warmup.get("modules") or []
+    if isinstance(modules, str):
+        modules = [modules]
+    commands = warmup.get("commands") or []
+    if isinstance(commands, str):
+        commands = [commands]
+    if not modules and not commands:
+        raise ValueError("numba warm-up needs modules to import or commands to run")
+
+    warmup_args = " ".join(f"--import {module}" for module in modules)
+    if warmup.get("ms"):
+        warmup_args += " --ms $WARMUP_MS"
+
+    cpu_name = numba_cpu_name(cpu_variant, bool(warmup.get("portable")))
+    # set for run time as well, or kernels compiled for the host CPU would miss the pre-warmed cache
+    cpu_env = [f"    NUMBA_CPU_NAME={cpu_name} \\", "    NUMBA_CPU_FEATURES=\"\" \\"] if cpu_name else []
+
+    lines = [
+        "",
+        "# pre-warmed numba cache, see cultcargo/builder/jitcache.py",
+        f"ENV NUMBA_CACHE_DIR={NUMBA_CACHE_DIR} \\",
+        *cpu_env,
+        f"    CULT_CARGO_NUMBA_PREWARMED={NUMBA_CACHE_DIR} \\",
+        f"    CULT_CARGO_NUMBA_MOUNT={NUMBA_MOUNT} \\",
+        f"    CULT_CARGO_IMAGE={image}",
+        f"COPY {HOOK_MODULE}.py {HOOK_DIR}/",
+        f"RUN site=$({python} -c 'import sysconfig; print(sysconfig.get_paths()[\"purelib\"])') && \\",
+        f"    printf '%s\\n' {HOOK_DIR} 'import {HOOK_MODULE}; {HOOK_MODULE}.seed()' > $site/{HOOK_MODULE}.pth",
+        f"RUN set -e; mkdir -p {WARMUP_DIR}; cd {WARMUP_DIR}; export WARMUP_MS={WARMUP_DIR}/warmup.ms; \\",
+        f"    {python} -m {HOOK_MODULE} warmup {warmup_args}; \\",
+    ]
+    for command in commands:
+        message = shlex.quote(f"numba warm-up command failed, continuing: {command}")
+        lines.append(f"    ({command}) || echo {message}; \\")
+    lines += [
+        f"    cd /; rm -rf {WARMUP_DIR}; chmod -R a+rX {NUMBA_CACHE_DIR}",
+        "",
+    ]
+    return content.rstrip() + "\n" + "\n".join(lines)
+
+
+def stage_hook(build_dir: str):
+    """Copies the cult_cargo_numba module into a build context, unless it is there already. Raises OSError
+    if the build context can't be written."""
+    target = os.path.join(build_dir, f"{HOOK_MODULE}.py")
+    source = open(HOOK_SOURCE, "rb").read()
+    if os.path.exists(target) and open(target, "rb").read() == source:
+        return
+    tmpfile = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmpfile, "wb") as f:
+            f.write(source)
+        os.replace(tmpfile, target)
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
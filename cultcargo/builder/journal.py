@@ -0,0 +1,72 @@
+import os
+import json
+import datetime
+import threading
+from typing import List, Dict, Optional, Any
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class BuildJournal(object):
+    """Journal of the steps (build, push, sif, measure) completed by a build-cargo run, kept in a JSON file.
+
+    Each step is recorded, as soon as it completes, under its task name (e.g. "push wsclean:3.3-cc0.1.3")
+    along with the fingerprint of the image version. A run that is resumed skips steps recorded with the
+    same fingerprint by the previous (unfinished) run, so that a change to an image still gets it rebuilt.
+    """
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.run: Dict[str, Any] = {}
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            try:
+                content = json.load(open(path))
+                self.run, self.steps = content.get("run", {}), content.get("steps", {})
+            except Exception:
+                self.run, self.steps = {}, {}
+
+    @property
+    def unfinished(self):
+        """True if the journal holds a run that didn't complete"""
+        return bool(self.run) and not self.run.get("finished")
+
+    def start(self, command: List[str], resume: bool = False):
+        """Starts a run. When resuming an unfinished run, its completed steps are kept,
+        otherwise the journal is cleared. Returns True if a run is resumed."""
+        with self._lock:
+            resumed = resume and self.unfinished
+            if resumed:
+                self.run.setdefault("resumed", []).append(_now())
+            else:
+                self.run = dict(started=_now(), command=command)
+                self.steps = {}
+            self.save()
+            return resumed
+
+    def is_done(self, step: str, fingerprint: Optional[str]):
+        """Checks if step was completed with the given fingerprint"""
+        entry = self.steps.get(step)
+        return bool(entry) and entry.get("fingerprint") == fingerprint
+
+    def record(self, step: str, fingerprint: Optional[str]):
+        with self._lock:
+            self.steps[step] = dict(fingerprint=fingerprint, finished=_now())
+            self.save()
+
+    def finish(self):
+        with self._lock:
+            self.run["finished"] = _now()
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmpfile = f"{self.path}.{os.getpid()}"
+            with open(tmpfile, "wt") as f:
+                json.dump(dict(run=self.run, steps=self.steps), f, indent=1)
+            os.replace(tmpfile, self.path)
@@ -0,0 +1,69 @@
+import time
+import uuid
+import subprocess
+from typing import List, Optional
+
+
+# Layer formats that images can be pushed in, in addition to the default gzip-compressed layers, with the
+# corresponding buildx image exporter options. Each format is pushed under its own tag, e.g.
+# casa:5.8.0-cc0.1.3-estargz. eStargz layers can be lazily pulled by the stargz snapshotter, and are
+# pulled like ordinary gzip layers otherwise.
+LAYER_FORMATS = {
+    "zstd": "compression=zstd,compression-level=3,force-compression=true,oci-mediatypes=true",
+    "estargz": "compression=estargz,force-compression=true,oci-mediatypes=true",
+}
+
+# image of the throwaway docker daemon that pulls are measured with, see timed_pull()
+PULL_DAEMON_IMAGE = "docker:dind"
+
+
+def format_reference(ref: str, layer_format: str):
+    """Returns image reference under which a layer format of the image is pushed"""
+    return ref if layer_format == "gzip" else f"{ref}-{layer_format}"
+
+
+def check_layer_formats(formats: List[str]):
+    """Raises ValueError on unknown layer formats"""
+    for layer_format in formats:
+        if layer_format not in LAYER_FORMATS:
+            raise ValueError(f"unknown layer format '{layer_format}', expecting one of {', '.join(LAYER_FORMATS)}")
+
+
+def buildx_output_args(refs: List[str], layer_format: str, insecure: bool = False):
+    """Returns docker buildx build arguments pushing the image in the given layer format under the given references"""
+    output = f"type=image,\"name={','.join(refs)}\",push=true,{LAYER_FORMATS[layer_format]}"
+    if insecure:
+        output += ",registry.insecure=true"
+    return ["--output", output]
+
+
+def _docker(*args: str, **kw):
+    return subprocess.run(["docker", *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, **kw)
+
+
+def timed_pull(ref: str, insecure_registry: Optional[str] = None, daemon_image: str = PULL_DAEMON_IMAGE,
+               timeout: float = 60):
+    """Pulls image into an empty image store, and returns time taken (download and unpack).
+
+    Pulling with the local daemon would reuse any layers it already holds, e.g. those of the image just built, so
+    the pull goes through a throwaway docker daemon instead, started in a privileged container whose data root
+    is an anonymous volume, removed along with it. The daemon shares the host's network, so that it can reach a
+    registry on localhost, without setting up a bridge or touching iptables."""
+    name = f"cult-cargo-pull-{uuid.uuid4().hex[:12]}"
+    args = ["--host=unix:///var/run/docker.sock", "--bridge=none", "--iptables=false"]
+    if insecure_registry:
+        args.append(f"--insecure-registry={insecure_registry}")
+    _docker("run", "-d", "--rm", "--privileged", "--network", "host", "--name", name, "-e", "DOCKER_TLS_CERTDIR=",
+            daemon_image, *args, check=True)
+    try:
+        deadline = time.time() + timeout
+        while _docker("exec", name, "docker", "version").returncode:
+            if time.time() > deadline:
+                raise subprocess.CalledProcessError(1, ["docker", "exec", name, "docker", "version"],
+                                                    stderr=f"docker daemon in {daemon_image} didn't start")
+            time.sleep(0.5)
+        t0 = time.time()
+        _docker("exec", name, "docker", "pull", "-q", ref, check=True)
+        return time.time() - t0
+    finally:
+        _docker("rm", "-f", "-v", name)
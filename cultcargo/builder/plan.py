@@ -0,0 +1,128 @@
+import re
+from typing import List, Dict, Set, Any, Tuple
+from dataclasses import dataclass, field
+
+
+# rough cost (seconds) of rendered Dockerfile content, used for images without recorded build times.
+# Each pattern is charged once per match.
+HEURISTIC_COSTS = (
+    (re.compile(r"^\s*RUN\s", re.IGNORECASE | re.MULTILINE), 5),
+    (re.compile(r"\bapt(-get)?\s+(-\S+\s+)*install\b"), 60),
+    (re.compile(r"(\bpip3?|-m\s*pip)\s+install\b"), 90),
+    (re.compile(r"\bconda\s+(install|create|env)\b"), 300),
+    (re.compile(r"\b(git\s+clone|wget|curl)\b"), 15),
+    (re.compile(r"\b(cmake|make|ninja|setup\.py\s+build)\b"), 300),
+)
+HEURISTIC_BASE_COST = 10
+
+# phases of a past build that count towards its cost
+COST_PHASES = ("pull", "build", "tag", "push")
+
+
+@dataclass
+class PlanJob(object):
+    name: str                                     # IMAGE:IMAGE_VERSION
+    cost: float                                   # estimated seconds to build and push
+    cost_source: str                              # "report" or "heuristic"
+    parents: List[str] = field(default_factory=list)    # parents among the planned jobs
+    pushed_parents: bool = False                  # parents must be pushed before the job is built (buildx)
+
+
+def heuristic_cost(content: str):
+    """Estimates build cost (seconds) from the instructions of a rendered Dockerfile"""
+    return HEURISTIC_BASE_COST + sum(cost * len(pattern.findall(content)) for pattern, cost in HEURISTIC_COSTS)
+
+
+def recorded_costs(reports: List[Dict[str, Any]]) -> Dict[Tuple[str, str, str], float]:
+    """Returns mean build+push times of image versions actually built in past reports (as returned by
+    load_report()), keyed by (image, version, cpu_variant), so that they carry over across bundle versions"""
+    times: Dict[Tuple[str, str, str], List[float]] = {}
+    for report in reports:
+        for entry in report.get("images", {}).values():
+            phases = entry.get("phases", {})
+            if entry.get("build") != "built" or "build" not in phases:
+                continue
+            key = entry.get("image"), entry.get("version"), entry.get("cpu_variant") or ""
+            times.setdefault(key, []).append(sum(phases.get(phase, 0) for phase in COST_PHASES))
+    return {key: sum(values) / len(values) for key, values in times.items()}
+
+
+def ancestors(name: str, jobs: Dict[str, PlanJob]) -> Set[str]:
+    """Returns names of all planned jobs that the named job (indirectly) builds upon"""
+    result = set()
+    stack = list(jobs[name].parents)
+    while stack:
+        parent = stack.pop()
+        if parent not in result and parent in jobs:
+            result.add(parent)
+            stack += jobs[parent].parents
+    return result
+
+
+def make_shards(jobs: Dict[str, PlanJob], nshards: int) -> List[Dict[str, bool]]:
+    """Splits jobs into shards that can be run independently, e.g. on separate CI runners.
+
+    Each job is owned by one shard. A shard also includes the ancestors of the jobs it owns, since it must
+    build these locally as bases (they are only pushed by the shard owning them). Jobs whose parents must be
+    pushed before they are built are owned by the same shard as their parents, since replicated bases are not
+    pushed. Jobs (or such groups of jobs) are assigned in order of decreasing cost (including that of their
+    ancestors) to the shard where they add the least to the total, i.e. longest-processing-time-first
+    scheduling with the shared bases charged to each shard that needs them.
+
+    Returns list of shards, each a dict mapping job names to True if owned, False for replicated bases.
+    Shard dicts list jobs in the original order, which preserves the build order.
+    """
+    shards: List[Dict[str, bool]] = [{} for _ in range(nshards)]
+    loads = [0.0] * nshards
+
+    # groups of jobs owned together: each job whose parents must be pushed joins the group of its parents
+    group_of = {name: name for name in jobs}
+
+    def find(name):
+        while group_of[name] != name:
+            name = group_of[name]
+        return name
+
+    for name, job in jobs.items():
+        if job.pushed_parents:
+            for parent in job.parents:
+                if parent in jobs:
+                    group_of[find(parent)] = find(name)
+    groups: Dict[str, List[str]] = {}
+    for name in jobs:
+        groups.setdefault(find(name), []).append(name)
+    # jobs to build for each group: its members and their ancestors
+    closure = {key: set(members).union(*(ancestors(name, jobs) for name in members))
+               for key, members in groups.items()}
+
+    def added_cost(shard, key):
+        return sum(jobs[job].cost for job in closure[key] if job not in shard)
+
+    for key in sorted(groups, key=lambda key: -sum(jobs[job].cost for job in closure[key])):
+        members = groups[key]
+        # in case of a tie, prefer a shard which already holds the most of the group as bases
+        index = min(range(nshards), key=lambda i: (loads[i] + added_cost(shards[i], key),
+                                                   -sum(name in shards[i] for name in members), i))
+        shard = shards[index]
+        loads[index] += added_cost(shard, key)
+        for job in closure[key]:
+            shard.setdefault(job, False)
+        for name in members:
+            shard[name] = True
+    order = {name: i for i, name in enumerate(jobs)}
+    return [dict(sorted(shard.items(), key=lambda item: order[item[0]])) for shard in shards]
+
+
+def shard_cost(shard: Dict[str, bool], jobs: Dict[str, PlanJob]):
+    return sum(jobs[name].cost for name in shard)
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parses shard specification I/N (1 <= I <= N). Returns (I, N). Raises ValueError if invalid."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec)
+    if not match:
+        raise ValueError(f"invalid shard specification '{spec}', expecting I/N")
+    index, count = map(int, match.groups())
+    if not 1 <= index <= count:
+        raise ValueError(f"invalid shard specification '{spec}', expecting 1 <= I <= N")
+    return index, count
@@ -0,0 +1,257 @@
+import os.path
+import re
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, NamedTuple, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+
+MANIFEST_MEDIA_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json"
+])
+
+# registries that docker talks to over plain http by default
+INSECURE_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+DOCKER_HUB = "registry-1.docker.io"
+
+
+class RegistryError(Exception):
+    pass
+
+
+class ProbeResult(NamedTuple):
+    exists: bool
+    digest: Optional[str] = None        # content digest of manifest, if known
+
+
+def split_image_reference(ref: str) -> Tuple[str, str, str]:
+    """Splits an image reference such as quay.io/stimela2/wsclean:3.3-cc0.1.3 into host, repository and tag"""
+    name, tag = ref.rsplit(":", 1) if ":" in ref.rsplit("/", 1)[-1] else (ref, "latest")
+    host, _, repo = name.partition("/")
+    # no registry host component: this is a Docker Hub image
+    if not repo or not ("." in host or ":" in host or host == "localhost"):
+        host, repo = DOCKER_HUB, name
+        if "/" not in repo:
+            repo = f"library/{repo}"
+    return host, repo, tag
+
+
+def docker_manifest_exists(ref: str) -> ProbeResult:
+    """Checks for an image by running 'docker manifest inspect'"""
+    cmd = ['docker', 'manifest', 'inspect', ref]
+    try:
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        return ProbeResult(True)
+    except subprocess.CalledProcessError as e:
+        output = e.stderr.strip()
+        if "no such manifest" in output or "was deleted" in output:
+            return ProbeResult(False)
+        raise RegistryError(f"Error inspecting manifest: {output}")
+
+
+def local_repo_digest(ref: str) -> Optional[str]:
+    """Returns the digest under which a local image was pushed to the repository of the given reference
+    (from its RepoDigests), or None if not known"""
+    result = subprocess.run(["docker", "image", "inspect", "--format", "{{json .RepoDigests}}", ref],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if result.returncode:
+        return None
+    host, repo, _ = split_image_reference(ref)
+    try:
+        for repo_digest in json.loads(result.stdout) or []:
+            name, _, digest = repo_digest.partition("@")
+            if split_image_reference(name)[:2] == (host, repo):
+                return digest
+    except ValueError:
+        pass
+    return None
+
+
+class RegistryProbe(object):
+    """Checks which image tags exist in a registry.
+
+    Tags are probed concurrently via HEAD requests against the registry HTTP v2 API, using a pooled session
+    and anonymous (or ~/.docker/config.json basic-auth) bearer tokens. If the API can't be used for some
+    registry, the probe falls back to 'docker manifest inspect'.
+
+    Results are kept in a JSON file under cache_dir. Cached entries younger than ttl seconds are used
+    in place of a registry lookup when use_cache is set.
+    """
+    def __init__(self, cache_dir: Optional[str] = None, ttl: float = 600, use_cache: bool = True,
+                 max_workers: int = 16, timeout: float = 30, method: str = "http"):
+        self.ttl = ttl
+        self.use_cache = use_cache
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.method = method
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._tokens = {}
+        self.durations = {}                 # time taken by last registry lookup of each image
+        self._lock = threading.Lock()
+        self.cache_file = cache_dir and os.path.join(cache_dir, "registry-probe.json")
+        self.cache = {}
+        if self.cache_file and os.path.exists(self.cache_file):
+            try:
+                self.cache = json.load(open(self.cache_file))
+            except Exception:
+                self.cache = {}
+        self._auths = {}
+        docker_config = os.path.join(os.environ.get("DOCKER_CONFIG", os.path.expanduser("~/.docker")), "config.json")
+        if os.path.exists(docker_config):
+            try:
+                self._auths = json.load(open(docker_config)).get("auths", {})
+            except Exception:
+                pass
+
+    def _base_url(self, host: str):
+        scheme = "http" if host.split(":")[0] in INSECURE_HOSTS or host.startswith("[::1]") else "https"
+        return f"{scheme}://{host}"
+
+    def _get_token(self, host: str, challenge: str):
+        """Gets a bearer token according to a WWW-Authenticate challenge"""
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm", None)
+        if not challenge.lower().startswith("bearer") or not realm:
+            raise RegistryError(f"{host}: unsupported authentication challenge '{challenge}'")
+        key = (realm, params.get("service"), params.get("scope"))
+        with self._lock:
+            if key in self._tokens:
+                return self._tokens[key]
+        headers = {}
+        auth = (self._auths.get(host) or self._auths.get(f"https://{host}") or {}).get("auth")
+        if host == DOCKER_HUB and not auth:
+            auth = self._auths.get("https://index.docker.io/v1/", {}).get("auth")
+        if auth:
+            headers["Authorization"] = f"Basic {auth}"
+        response = self.session.get(realm, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RegistryError(f"{host}: token request failed with status {response.status_code}")
+        payload = response.json()
+        token = payload.get("token") or payload.get("access_token")
+        with self._lock:
+            self._tokens[key] = token
+        return token
+
+    def _request(self, method: str, host: str, path: str, accept: str = MANIFEST_MEDIA_TYPES):
+        """Makes request to registry API, authenticating if challenged"""
+        url = f"{self._base_url(host)}/v2/{path}"
+        headers = {"Accept": accept}
+        response = self.session.request(method, url, headers=headers, timeout=self.timeout)
+        if response.status_code == 401 and "WWW-Authenticate" in response.headers:
+            token = self._get_token(host, response.headers["WWW-Authenticate"])
+            headers["Authorization"] = f"Bearer {token}"
+            response = self.session.request(method, url, headers=headers, timeout=self.timeout)
+        return response
+
+    def _probe_http(self, ref: str) -> ProbeResult:
+        host, repo, tag = split_image_reference(ref)
+        response = self._request("HEAD", host, f"{repo}/manifests/{tag}")
+        if response.status_code == 200:
+            return ProbeResult(True, response.headers.get("Docker-Content-Digest"))
+        if response.status_code == 404:
+            return ProbeResult(False)
+        raise RegistryError(f"{response.url}: unexpected status {response.status_code}")
+
+    def _image_manifest(self, ref: str, platform: str = "linux/amd64"):
+        """Fetches image manifest from the registry, picking the manifest for the given platform from an index.
+        Returns (host, repo, manifest), or None if the image doesn't exist."""
+        host, repo, tag = split_image_reference(ref)
+        response = self._request("GET", host, f"{repo}/manifests/{tag}")
+        if response.status_code != 200:
+            return None
+        manifest = response.json()
+        # for an index, pick manifest for our platform
+        if "manifests" in manifest:
+            entries = [entry for entry in manifest["manifests"]
+                       if "{os}/{architecture}".format(**entry.get("platform", {"os": "", "architecture": ""})) == platform]
+            if not entries:
+                return None
+            response = self._request("GET", host, f"{repo}/manifests/{entries[0]['digest']}")
+            if response.status_code != 200:
+                return None
+            manifest = response.json()
+        return host, repo, manifest
+
+    def image_labels(self, ref: str, platform: str = "linux/amd64") -> Optional[Dict[str, str]]:
+        """Returns labels of an image in the registry, or None if the image doesn't exist or can't be inspected"""
+        try:
+            result = self._image_manifest(ref, platform)
+            if result is None:
+                return None
+            host, repo, manifest = result
+            response = self._request("GET", host, f"{repo}/blobs/{manifest['config']['digest']}", accept="*/*")
+            if response.status_code != 200:
+                return None
+            return response.json().get("config", {}).get("Labels") or {}
+        except (RegistryError, requests.RequestException, ValueError, KeyError):
+            return None
+
+    def compressed_size(self, ref: str, platform: str = "linux/amd64") -> Optional[int]:
+        """Returns compressed size of an image in the registry (i.e. the amount of data to be pulled),
+        or None if the image doesn't exist or can't be inspected"""
+        try:
+            result = self._image_manifest(ref, platform)
+            if result is None:
+                return None
+            manifest = result[2]
+            return manifest["config"]["size"] + sum(layer["size"] for layer in manifest["layers"])
+        except (RegistryError, requests.RequestException, ValueError, KeyError):
+            return None
+
+    def probe(self, ref: str) -> ProbeResult:
+        """Checks if image exists in registry, using cache if allowed"""
+        if self.use_cache and self.ttl > 0:
+            entry = self.cache.get(ref)
+            if entry and time.time() - entry["time"] < self.ttl:
+                return ProbeResult(entry["exists"], entry.get("digest"))
+        t0 = time.time()
+        if self.method == "http":
+            try:
+                result = self._probe_http(ref)
+            except (RegistryError, requests.RequestException):
+                result = docker_manifest_exists(ref)
+        else:
+            result = docker_manifest_exists(ref)
+        self.durations[ref] = time.time() - t0
+        self.record(ref, result)
+        return result
+
+    def digest(self, ref: str) -> Optional[str]:
+        """Looks up current digest of image in registry (bypassing the cache), returns None if not available"""
+        try:
+            return self._probe_http(ref).digest
+        except (RegistryError, requests.RequestException):
+            return None
+
+    def check(self, refs: List[str]) -> Dict[str, ProbeResult]:
+        """Probes a list of image references concurrently. Returns dict of results."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(refs, executor.map(self.probe, refs)))
+        self.save()
+        return results
+
+    def record(self, ref: str, result: ProbeResult):
+        """Records result in cache, e.g. after an image is pushed"""
+        with self._lock:
+            self.cache[ref] = dict(exists=result.exists, digest=result.digest, time=time.time())
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmpfile = f"{self.cache_file}.{os.getpid()}"
+            with open(tmpfile, "wt") as f:
+                json.dump(self.cache, f, indent=1)
+            os.replace(tmpfile, self.cache_file)
@@ -0,0 +1,107 @@
+import json
+import time
+import threading
+import subprocess
+import datetime
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Any
+
+
+# phases reported for each image version, in order
+PHASES = ("inspect", "pull", "build", "tag", "push", "sif")
+
+# build times below this many seconds are too noisy to compare
+MIN_COMPARE_SECONDS = 10
+
+
+def image_size_and_layers(full_image: str):
+    """Returns (size in bytes, number of layers) of local docker image, or (None, None) if not available"""
+    result = subprocess.run(["docker", "image", "inspect", "--format", "{{.Size}} {{len .RootFS.Layers}}", full_image],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        size, layers = result.stdout.split()
+        return int(size), int(layers)
+    except ValueError:
+        return None, None
+
+
+class BuildReport(object):
+    """Collects per-phase timings and image sizes of a build-cargo run"""
+    def __init__(self, **metadata):
+        self.metadata = metadata
+        self.images: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add_image(self, name: str, **info):
+        with self._lock:
+            entry = self.images.setdefault(name, dict(phases={}))
+            entry.update(**info)
+
+    def add_format(self, name: str, layer_format: str, **info):
+        """Records compressed size, pull time etc. of a layer format of the image"""
+        with self._lock:
+            formats = self.images.setdefault(name, dict(phases={})).setdefault("formats", {})
+            formats.setdefault(layer_format, {}).update(**info)
+
+    def add_time(self, name: str, phase: str, seconds: float):
+        with self._lock:
+            phases = self.images.setdefault(name, dict(phases={}))["phases"]
+            phases[phase] = phases.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, name: str, phase: str):
+        """Context manager timing a phase of an image version"""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, phase, time.time() - t0)
+
+    def to_dict(self):
+        with self._lock:
+            images = {name: dict(entry, total=sum(entry["phases"].values())) for name, entry in self.images.items()}
+        return dict(created=datetime.datetime.now().isoformat(timespec="seconds"), **self.metadata, images=images)
+
+    def save(self, path: str):
+        with open(path, "wt") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def load_report(path: str):
+    return json.load(open(path))
+
+
+def compare_reports(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """Compares two reports (as returned by BuildReport.to_dict() or load_report()).
+
+    Images are matched by image name, manifest version and CPU variant, so reports for different bundle
+    versions can be compared. Returns list of messages describing build time or image size increases greater
+    than the threshold fraction.
+    """
+    def key(entry):
+        return entry.get("image"), entry.get("version"), entry.get("cpu_variant") or ""
+
+    old_images = {key(entry): entry for entry in old.get("images", {}).values()}
+    regressions = []
+    for name, entry in new.get("images", {}).items():
+        old_entry = old_images.get(key(entry))
+        if old_entry is None:
+            continue
+        old_time, new_time = old_entry.get("phases", {}).get("build"), entry.get("phases", {}).get("build")
+        if old_time and new_time and new_time >= MIN_COMPARE_SECONDS and new_time > old_time * (1 + threshold):
+            regressions.append(f"{name}: build time grew from {old_time:.1f}s to {new_time:.1f}s "
+                               f"(+{(new_time / old_time - 1) * 100:.0f}%)")
+        old_size, new_size = old_entry.get("size"), entry.get("size")
+        if old_size and new_size and new_size > old_size * (1 + threshold):
+            regressions.append(f"{name}: image size grew from {format_size(old_size)} to {format_size(new_size)} "
+                               f"(+{(new_size / old_size - 1) * 100:.0f}%)")
+    return regressions
+
+
+def format_size(size: Optional[int]):
+    if size is None:
+        return ""
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
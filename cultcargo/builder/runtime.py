@@ -0,0 +1,88 @@
+import re
+from typing import List, Union, Optional
+
+
+# staging directory in the build stage, into which runtime files are collected
+RUNTIME_DIR = "/cult-cargo-runtime"
+
+# libraries that every runtime base image provides, and which are never copied over
+SYSTEM_LIBS = r"/(ld-linux[^/]*|lib(c|m|dl|rt|pthread|resolv|gcc_s|stdc\+\+)\.so[^/]*)$"
+
+# instructions of the build stage that are carried over to the runtime stage
+STAGE_INSTRUCTIONS = ("ENV", "WORKDIR", "CMD", "ENTRYPOINT")
+
+_FROM_LINE = re.compile(r"^\s*FROM\s", re.IGNORECASE)
+
+
+def _instructions(lines: List[str]):
+    """Yields logical Dockerfile instructions, joining continuation lines"""
+    instruction = []
+    for line in lines:
+        if not instruction and (not line.strip() or line.lstrip().startswith("#")):
+            continue
+        instruction.append(line)
+        if not line.rstrip().endswith("\\"):
+            yield "\n".join(instruction)
+            instruction = []
+    if instruction:
+        yield "\n".join(instruction)
+
+
+def add_runtime_stage(content: str, base: str, copy: List[str], packages: Optional[Union[str, List[str]]] = None):
+    """Turns a rendered Dockerfile into a multi-stage build.
+
+    The original (last) stage becomes the builder stage. The given paths (files, directories, or symlinks to
+    these), plus all shared libraries they link against, are collected in the builder stage and copied into
+    a fresh runtime stage based on the given base image, into which optional packages are apt-installed.
+    Symlinks are copied along with their targets, so that library sonames resolve, and ldconfig is run over
+    the directories of the libraries.
+    ENV, WORKDIR, CMD and ENTRYPOINT instructions of the builder stage are carried over.
+    """
+    if not copy:
+        raise ValueError("runtime stage needs a list of paths to copy")
+    lines = content.rstrip().split("\n")
+    from_lines = [i for i, line in enumerate(lines) if _FROM_LINE.match(line)]
+    if not from_lines:
+        raise ValueError("no FROM instruction found")
+    stage_index = len(from_lines) - 1
+    carried = [instr for instr in _instructions(lines[from_lines[-1] + 1:])
+               if instr.split(None, 1)[0].upper() in STAGE_INSTRUCTIONS]
+
+    paths = " ".join(copy)
+    if isinstance(packages, (list, tuple)):
+        packages = " ".join(packages)
+
+    stage = [
+        "",
+        "# collect runtime files and the shared libraries they need. Symlinks (such as library sonames) are copied",
+        "# along with every link of their chain up to the real file, each under its canonical directory, in case",
+        "# e.g. /lib is a symlink to /usr/lib. The directories of the libraries are registered with ldconfig.",
+        f"RUN mkdir -p {RUNTIME_DIR}/etc/ld.so.conf.d && \\",
+        "    copy_chain() { f=$1; n=0; while [ -L \"$f\" ] && [ $n -lt 40 ]; do n=$((n+1)); \\",
+        f"        f=$(readlink -f $(dirname \"$f\"))/$(basename \"$f\"); cp -P --parents \"$f\" {RUNTIME_DIR}; \\",
+        "        t=$(readlink \"$f\"); case $t in /*) f=$t;; *) f=$(dirname \"$f\")/$t;; esac; done; \\",
+        f"        cp -PR --parents $(readlink -f $(dirname \"$f\"))/$(basename \"$f\") {RUNTIME_DIR}; }} && \\",
+        f"    for path in {paths}; do \\",
+        f"        cp -PR --parents $path {RUNTIME_DIR} && \\",
+        "        if [ -L $path ]; then copy_chain $path; fi; \\",
+        "    done && \\",
+        f"    find -H {paths} -type f \\( -perm /111 -o -name '*.so*' \\) -exec ldd {{}} + 2>/dev/null | \\",
+        f"        awk '/=> \\// {{print $3}}' | grep -Ev '{SYSTEM_LIBS}' | sort -u | \\",
+        "        while read lib; do copy_chain $lib && readlink -f $(dirname $lib); done | sort -u \\",
+        f"        > {RUNTIME_DIR}/etc/ld.so.conf.d/cult-cargo-runtime.conf",
+        "",
+        f"FROM {base}",
+        "",
+    ]
+    if packages:
+        stage += [
+            f"RUN apt-get update && apt-get -y install --no-install-recommends {packages} && \\",
+            "    rm -rf /var/lib/apt/lists/* /var/cache/apt/archives",
+            "",
+        ]
+    stage += [
+        f"COPY --from={stage_index} {RUNTIME_DIR}/ /",
+        "RUN ldconfig",
+        "",
+    ] + carried
+    return "\n".join(lines + stage) + "\n"
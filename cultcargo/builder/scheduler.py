@@ -0,0 +1,98 @@
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Set, Optional, Callable, Any
+from dataclasses import dataclass, field
+
+
+# matches the image reference in a Dockerfile FROM line, skipping an optional --platform flag
+_FROM_LINE = re.compile(r"^\s*FROM\s+(?:--\S+\s+)*(\S+)", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_base_images(content: str) -> List[str]:
+    """Returns list of images referenced by the FROM lines of a (rendered) Dockerfile"""
+    return _FROM_LINE.findall(content)
+
+
+@dataclass
+class Task(object):
+    name: str                                       # unique task name, e.g. "build wsclean:3.3-cc0.1.3"
+    func: Callable[[], Any]                         # callable doing the actual work
+    deps: Set[str] = field(default_factory=set)     # names of tasks that must complete first
+    cpus: float = 1                                 # CPUs reserved while task runs
+    memory: int = 0                                 # memory (bytes) reserved while task runs
+
+
+class TaskFailed(Exception):
+    def __init__(self, failures: Dict[str, BaseException]):
+        self.failures = failures
+        super().__init__(f"{len(failures)} task(s) failed: {', '.join(failures)}")
+
+
+def run_tasks(tasks: List[Task], max_workers: int = 1,
+              max_cpus: Optional[float] = None, max_memory: Optional[int] = None,
+              callback: Optional[Callable[[Set[str], int, int], None]] = None):
+    """Runs a DAG of tasks concurrently.
+
+    A task is started once all its dependencies have completed, and enough workers, CPUs and memory
+    are available. Tasks are started in list order whenever there is a choice, so max_workers=1 gives a
+    deterministic serial schedule. A task requesting more than the total budget is still run, but only
+    when nothing else is running. Raises ValueError on dependencies on tasks not in the list.
+
+    After the first failure no new tasks are started; running tasks are allowed to finish, then
+    TaskFailed is raised. The callback, if given, is called with (running task names, number done,
+    number total) whenever the schedule changes.
+    """
+    names = {task.name for task in tasks}
+    if len(names) != len(tasks):
+        raise ValueError("task names must be unique")
+    unknown = sorted(f"{task.name} -> {dep}" for task in tasks for dep in task.deps - names)
+    if unknown:
+        raise ValueError(f"dependencies on unknown tasks: {', '.join(unknown)}")
+    pending = [task for task in tasks]
+    deps = {task.name: set(task.deps) for task in tasks}
+    done: Set[str] = set()
+    failures: Dict[str, BaseException] = {}
+    running = {}
+    cpus_used = memory_used = 0
+
+    def fits(task):
+        if not running:
+            return True
+        if max_cpus is not None and cpus_used + min(task.cpus, max_cpus) > max_cpus:
+            return False
+        if max_memory is not None and memory_used + min(task.memory, max_memory) > max_memory:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        while pending or running:
+            # start whatever we can
+            if not failures:
+                for task in list(pending):
+                    if len(running) >= max_workers:
+                        break
+                    if deps[task.name] <= done and fits(task):
+                        pending.remove(task)
+                        running[executor.submit(task.func)] = task
+                        cpus_used += task.cpus if max_cpus is None else min(task.cpus, max_cpus)
+                        memory_used += task.memory if max_memory is None else min(task.memory, max_memory)
+            elif not running:
+                break
+            if callback:
+                callback({task.name for task in running.values()}, len(done), len(tasks))
+            if not running:
+                # nothing could be started and nothing is running: dependency cycle
+                raise ValueError(f"dependency cycle among tasks: {', '.join(task.name for task in pending)}")
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                cpus_used -= task.cpus if max_cpus is None else min(task.cpus, max_cpus)
+                memory_used -= task.memory if max_memory is None else min(task.memory, max_memory)
+                exc = future.exception()
+                if exc is not None:
+                    failures[task.name] = exc
+                else:
+                    done.add(task.name)
+
+    if failures:
+        raise TaskFailed(failures)
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import hashlib
+import datetime
+import threading
+import subprocess
+from typing import List, Dict, Optional, Any
+
+
+# index of SIF cache directory, recording image digest and checksum of each SIF file
+SIF_INDEX = "sif-index.json"
+
+
+def sif_filename(ref: str):
+    """Returns SIF file name for an image, following the naming of stimela's singularity backend,
+    so that stimela picks up the file when its singularity image_dir points to the cache directory"""
+    return ref.replace("/", "-") + ".simg"
+
+
+def find_converter() -> Optional[str]:
+    return shutil.which("apptainer") or shutil.which("singularity")
+
+
+def file_sha256(path: str):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class SifCache(object):
+    """Directory of SIF images converted from registry images.
+
+    Each image is converted by running "CONVERTER build FILE docker://REF", where the converter is apptainer
+    or singularity (or a stand-in script accepting the same arguments). A SIF file is written next to a
+    .sha256 checksum file, and recorded in the index along with the registry digest of the image, so that
+    images whose digest hasn't changed are not converted again.
+    """
+    def __init__(self, directory: str, converter: Optional[str] = None):
+        self.directory = directory
+        self.converter = converter or find_converter()
+        self.index_file = os.path.join(directory, SIF_INDEX)
+        self._lock = threading.Lock()
+        self.index: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.index_file):
+            try:
+                self.index = json.load(open(self.index_file))
+            except Exception:
+                self.index = {}
+
+    def path(self, ref: str):
+        return os.path.join(self.directory, sif_filename(ref))
+
+    def is_current(self, ref: str, digest: Optional[str]):
+        """Checks if SIF file for image exists, and was converted from an image with the given digest"""
+        entry = self.index.get(ref)
+        return bool(digest and entry and entry.get("digest") == digest and os.path.exists(self.path(ref)))
+
+    def convert(self, ref: str, digest: Optional[str], aliases: List[str] = [], capture: bool = False):
+        """Converts registry image into SIF file, and links aliases (e.g. the latest tag) to it.
+        Returns index entry."""
+        if not self.converter:
+            raise RuntimeError("neither apptainer nor singularity found, please specify a converter")
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(ref)
+        tmpfile = f"{path}.{os.getpid()}.tmp"
+        try:
+            result = subprocess.run([self.converter, "build", tmpfile, f"docker://{ref}"], text=True,
+                                    stdout=subprocess.PIPE if capture else None,
+                                    stderr=subprocess.STDOUT if capture else None)
+            if result.returncode:
+                raise RuntimeError(f"{self.converter} build failed with exit code {result.returncode}" +
+                                   (f": {result.stdout.strip()}" if capture and result.stdout else ""))
+            checksum = file_sha256(tmpfile)
+            os.replace(tmpfile, path)
+        finally:
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+        with open(f"{path}.sha256", "wt") as f:
+            f.write(f"{checksum}  {os.path.basename(path)}\n")
+        entry = dict(file=os.path.basename(path), digest=digest, sha256=checksum, size=os.path.getsize(path),
+                     created=datetime.datetime.now().isoformat(timespec="seconds"))
+        for alias in aliases:
+            alias_path = self.path(alias)
+            if os.path.lexists(alias_path):
+                os.unlink(alias_path)
+            os.symlink(os.path.basename(path), alias_path)
+        with self._lock:
+            self.index[ref] = entry
+            for alias in aliases:
+                self.index[alias] = dict(entry, alias_of=ref)
+            self.save()
+        return entry
+
+    def save(self):
+        tmpfile = f"{self.index_file}.{os.getpid()}"
+        with open(tmpfile, "wt") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmpfile, self.index_file)
@@ -0,0 +1,94 @@
+import re
+from typing import List, Dict, Any, Iterable
+
+
+# default startup optimisation settings, overridden by the 'startup' sections of the manifest
+DEFAULTS = dict(enabled=True, strip=["tests"], keep=["astropy/tests"], docs=True)
+
+_INSTRUCTION = re.compile(r"^\s*([A-Za-z]+)\s")
+_PIP_INSTALL = re.compile(r"(?:(\S*python[\w.]*)\s+-m\s*pip|(?<![\w-])pip[\d.]*)\s+install\b")
+_APT_INSTALL = re.compile(r"\bapt(-get)?\s+(-\S+\s+)*install\b")
+
+# keeps copyright files, which licenses require to be shipped
+STRIP_DOCS = "find /usr/share/doc -type f ! -name copyright -delete && rm -rf /usr/share/man/* /usr/share/info/*"
+
+
+def startup_settings(*sections: Dict[str, Any]) -> Dict[str, Any]:
+    """Merges startup sections (manifest-wide, image, version) over the defaults"""
+    settings = dict(DEFAULTS)
+    for section in sections:
+        settings.update(section or {})
+    return settings
+
+
+def strip_command(strip: Iterable[str], keep: Iterable[str]) -> str:
+    """Returns shell command removing the named directories (e.g. tests) from installed Python packages,
+    except those whose paths end with one of the keep entries (e.g. astropy/tests, which astropy imports)"""
+    names = " -o ".join(f"-name {name}" for name in strip)
+    exclude = "".join(f" ! -path '*/{path}'" for path in keep)
+    return f"find / -xdev -type d \\( {names} \\) -path '*-packages/*'{exclude} -prune -exec rm -rf {{}} +"
+
+
+def _logical_instructions(lines: List[str]):
+    """Yields lists of lines making up each instruction (joined by continuations), or single comment/blank lines"""
+    instruction = []
+    for line in lines:
+        if not instruction and (not line.strip() or line.lstrip().startswith("#")):
+            yield [line]
+            continue
+        instruction.append(line)
+        if not line.rstrip().endswith("\\"):
+            yield instruction
+            instruction = []
+    if instruction:
+        yield instruction
+
+
+def optimise_startup(content: str, strip: List[str], keep: List[str], docs: bool = True, **_) -> str:
+    """Optimises the startup time (and size) of an image given by a rendered Dockerfile that pip-installs
+    Python packages. Dockerfiles without pip installs are returned unchanged.
+
+    Each RUN instruction installing pip packages also strips the strip directories (e.g. tests) from the
+    installed packages, and each RUN instruction installing apt packages strips their documentation, if docs
+    is set. Stripping happens within the same instruction, since files removed by a later layer would still take
+    up space in the image. A final RUN then byte-compiles every module on the path of each Python interpreter
+    used for pip installs, so that containers (which never keep the bytecode they write) don't compile modules
+    on every start. This covers modules that pip doesn't compile for that interpreter, e.g. those of apt-installed
+    python3-* packages when the image runs a different Python version.
+    """
+    lines = content.rstrip().split("\n")
+    output = []
+    interpreters = []
+    for instruction in _logical_instructions(lines):
+        match = _INSTRUCTION.match(instruction[0])
+        if match and match.group(1).upper() == "RUN":
+            text = "\n".join(instruction)
+            cleanup = []
+            pip = _PIP_INSTALL.search(text)
+            if pip:
+                python = pip.group(1) or "python3"
+                if python not in interpreters:
+                    interpreters.append(python)
+                if strip:
+                    cleanup.append(strip_command(strip, keep))
+            if docs and _APT_INSTALL.search(text):
+                cleanup.append(STRIP_DOCS)
+            if cleanup:
+                instruction = instruction[:-1] + [instruction[-1].rstrip() + " && \\"] + \
+                    [f"    {command} && \\" for command in cleanup[:-1]] + [f"    {cleanup[-1]}"]
+        output += instruction
+
+    if not interpreters:
+        return content
+
+    path = "import os, sys; print(\" \".join(p for p in sys.path if os.path.isdir(p)))"
+    compile_cmds = [f"{python} -m compileall -qq -j 0 -x '/tests?/' $({python} -c '{path}') || true"
+                    for python in interpreters]
+    output += [
+        "",
+        "# precompiled bytecode for faster startup, see cultcargo/builder/startup.py. Some packages ship files that",
+        "# aren't valid Python for this interpreter (e.g. templates or test data), so compile errors are ignored.",
+        "RUN " + "; \\\n    ".join(compile_cmds),
+        "",
+    ]
+    return "\n".join(output)
@@ -0,0 +1,149 @@
+import os
+import sys
+import glob
+import pickle
+import logging
+import subprocess
+from functools import lru_cache
+from typing import List, Dict, Set, Any, Iterable, Optional
+from omegaconf import OmegaConf
+
+from .genesis.schema_cache import cached
+
+# directory of the cab definition files
+CATALOG_DIR = os.path.dirname(__file__)
+
+# include file exposing the catalog, see catalog.yml
+CATALOG_FILE = "catalog.yml"
+
+# bump this when the structure of the catalog changes
+CATALOG_FORMAT = 2
+
+_log = logging.getLogger(__name__)
+
+
+def cab_files() -> List[str]:
+    """Returns paths of cab definition files shipped with cult-cargo"""
+    return sorted(path for path in glob.glob(os.path.join(CATALOG_DIR, "*.yml"))
+                  if os.path.basename(path) != CATALOG_FILE)
+
+
+def catalog_sources() -> List[str]:
+    """Returns paths of all files the catalog is built from, i.e. the cab definition files and the
+    genesis files they include"""
+    genesis = [path for ext in ("yml", "yaml")
+               for path in glob.glob(os.path.join(CATALOG_DIR, "genesis", "**", f"*.{ext}"), recursive=True)]
+    return cab_files() + sorted(genesis)
+
+
+@lru_cache(maxsize=None)
+def _base_config():
+    from scabha import configuratt
+    conf, _ = configuratt.load(os.path.join(CATALOG_DIR, "genesis", "cult-cargo-base.yml"), use_sources=None,
+                               use_cache=False)
+    return conf
+
+
+def load_cab_file(path: str):
+    """Loads a cab definition file, resolving its _include and _use statements as a recipe including the file
+    would. Returns tuple of (conf, dependencies), where dependencies is a sorted list of the included files,
+    relative to the catalog directory."""
+    from scabha import configuratt
+    from scabha.configuratt.core import resolve_config_refs
+
+    conf, deps = configuratt.load(path, use_sources=None, use_cache=False)
+    # stimela's own config always includes the cult-cargo base (via cultcargo/stimela.conf), so recipes can rely on
+    # it for _use references even if the cab file doesn't include it
+    conf, _ = resolve_config_refs(conf, pathname=path, location=None, name=os.path.basename(path),
+                                  includes=False, use_sources=[conf, _base_config()])
+    # entries with an origin are packages rather than files
+    dependencies = sorted(os.path.relpath(dep, CATALOG_DIR) for dep, info in deps.deps.items()
+                          if "origin" not in info and os.path.abspath(dep) != os.path.abspath(path))
+    return conf, dependencies
+
+
+def build_catalog() -> Dict[str, Any]:
+    """Loads all cab definition files (see load_cab_file()).
+
+    Returns dict with the merged "lib" and "vars" sections as plain containers, a "cabs" section mapping
+    each cab name to its pickled definition (so that cabs can be materialised individually), and an "index"
+    section mapping each cab name to the (package-relative) file it is defined in, and the files that one
+    depends on. Cabs lacking mandatory fields are left out.
+    """
+    from stimela.kitchen.cab import Cab
+
+    mandatory = OmegaConf.missing_keys(OmegaConf.structured(Cab))
+
+    sections = {section: OmegaConf.create() for section in ("lib", "vars")}
+    cabs = {}
+    index = {}
+    for path in cab_files():
+        conf, dependencies = load_cab_file(path)
+        # files without a cabs section (e.g. old-style single-cab definitions) are not part of the catalog
+        if "cabs" not in conf:
+            _log.debug(f"{path} has no cabs section, skipping")
+            continue
+        # stimela substitutes the whole config into recipes, so an incomplete cab would break every recipe
+        for name, cab in conf.cabs.items():
+            missing = sorted(key for key in mandatory if key not in cab)
+            if missing:
+                _log.warning(f"cab '{name}' in {os.path.basename(path)} is missing {', '.join(missing)}, "
+                             "leaving it out of the catalog")
+                continue
+            cabs[name] = pickle.dumps(OmegaConf.to_container(cab, resolve=False))
+            index[name] = dict(file=os.path.basename(path), dependencies=dependencies)
+        for section in sections:
+            if section in conf:
+                sections[section] = OmegaConf.unsafe_merge(sections[section], conf[section])
+
+    catalog = {section: OmegaConf.to_container(content, resolve=False) for section, content in sections.items()}
+    catalog["cabs"] = cabs
+    catalog["index"] = index
+    return catalog
+
+
+def _build_catalog_subprocess() -> Dict[str, Any]:
+    """Runs build_catalog() in a separate process. The catalog is usually needed while configuratt is in
+    the middle of loading catalog.yml, and configuratt can't load other files at that point."""
+    script = "import sys, pickle; from cultcargo.catalog import build_catalog; " \
+             "pickle.dump(build_catalog(), sys.stdout.buffer)"
+    result = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, check=True)
+    return pickle.loads(result.stdout)
+
+
+@lru_cache(maxsize=None)
+def load_catalog() -> Dict[str, Any]:
+    """Returns the pre-resolved catalog of all cult-cargo cabs (see build_catalog()). The catalog is compiled
+    on first use and cached on disk, keyed on the content of all its source files."""
+    return cached(f"catalog-v{CATALOG_FORMAT}", catalog_sources(), _build_catalog_subprocess)
+
+
+def cab_index() -> Dict[str, Dict[str, Any]]:
+    """Returns index of the catalog: dict of cab name -> dict(file=cab file, dependencies=[included files])"""
+    return load_catalog()["index"]
+
+
+def catalog_cabs(names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Materialises cab definitions from the catalog. Returns dict of cab name -> definition, for the given cab
+    names (skipping those not in the catalog), or for all cabs if names is None."""
+    cabs = load_catalog()["cabs"]
+    if names is None:
+        names = cabs.keys()
+    return {name: pickle.loads(cabs[name]) for name in names if name in cabs}
+
+
+def referenced_cabs(conf: Any) -> Set[str]:
+    """Returns names of the cabs invoked by name from the steps of any recipes (including nested recipes)
+    in a config, given as plain containers"""
+    names = set()
+    if isinstance(conf, dict):
+        steps = conf.get("steps")
+        if isinstance(steps, dict):
+            names.update(step["cab"] for step in steps.values()
+                         if isinstance(step, dict) and isinstance(step.get("cab"), str))
+        for value in conf.values():
+            names |= referenced_cabs(value)
+    elif isinstance(conf, list):
+        for value in conf:
+            names |= referenced_cabs(value)
+    return names
@@ -0,0 +1,94 @@
+import os
+import platform
+from functools import lru_cache
+from typing import List, Dict, Optional
+import yaml
+
+
+# x86-64 microarchitecture levels (as understood by gcc -march) that images can be built for,
+# in increasing order, with the /proc/cpuinfo flags each level adds to the previous one
+CPU_LEVEL_FLAGS = {
+    "x86-64-v2": {"cx16", "lahf_lm", "popcnt", "pni", "sse4_1", "sse4_2", "ssse3"},
+    "x86-64-v3": {"abm", "avx", "avx2", "bmi1", "bmi2", "f16c", "fma", "movbe", "xsave"},
+    "x86-64-v4": {"avx512f", "avx512bw", "avx512cd", "avx512dq", "avx512vl"},
+}
+CPU_VARIANTS = tuple(CPU_LEVEL_FLAGS.keys())
+
+# environment variable enabling CPU variants, which are not used unless it is set: set to a level from
+# CPU_VARIANTS to use variants up to that level (e.g. the lowest common level of the nodes that run the steps),
+# or to "host" to detect the level of the host running stimela, which is only right if steps run on that host
+CPU_VARIANT_ENV = "CULT_CARGO_CPU_VARIANT"
+HOST_CPU_VARIANT = "host"
+
+MANIFEST = os.path.join(os.path.dirname(__file__), "builder", "cargo-manifest.yml")
+
+
+def march_flags(variant: Optional[str]):
+    """Returns compiler flags for a CPU variant"""
+    return f"-march={variant}" if variant else ""
+
+
+def cpu_level() -> Optional[str]:
+    """Returns CPU level from CPU_VARIANTS that images may be tuned for, according to CPU_VARIANT_ENV,
+    or None if variants are not enabled"""
+    setting = os.environ.get(CPU_VARIANT_ENV)
+    if setting == HOST_CPU_VARIANT:
+        return host_cpu_level()
+    return setting if setting in CPU_VARIANTS else None
+
+
+@lru_cache
+def host_cpu_level() -> Optional[str]:
+    """Returns highest CPU level from CPU_VARIANTS supported by this host, or None"""
+    if platform.machine() not in ("x86_64", "AMD64"):
+        return None
+    try:
+        flags = set()
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        return None
+    level = None
+    for variant, required in CPU_LEVEL_FLAGS.items():
+        if not required.issubset(flags):
+            break
+        level = variant
+    return level
+
+
+@lru_cache
+def manifest_cpu_variants() -> Dict[str, List[str]]:
+    """Returns dict of CPU variants built for the latest version of each image, according to the build manifest"""
+    try:
+        manifest = yaml.safe_load(open(MANIFEST))
+    except (OSError, yaml.YAMLError):
+        return {}
+    variants = {}
+    for image, image_info in (manifest.get("images") or {}).items():
+        versions = image_info.get("versions") or {}
+        if not versions:
+            continue
+        # same logic as build-cargo uses to pick the version tagged with the bundle version
+        if "latest" in versions:
+            latest = "latest"
+        else:
+            latest = image_info.get("latest") or list(versions.keys())[-1]
+        cpu_variants = (versions.get(latest) or {}).get("cpu_variants")
+        if cpu_variants:
+            variants[image] = list(cpu_variants)
+    return variants
+
+
+def best_cpu_variant(variants: List[str]) -> Optional[str]:
+    """Picks the best of the given CPU variants for the level given by cpu_level(), or None if variants are
+    not enabled or that level supports none of them"""
+    level = cpu_level()
+    if level is None:
+        return None
+    supported = [variant for variant in variants if variant in CPU_VARIANTS and
+                 CPU_VARIANTS.index(variant) <= CPU_VARIANTS.index(level)]
+    return max(supported, key=CPU_VARIANTS.index) if supported else None
+
@@ -1,24 +1,24 @@
 import os.path
+from functools import lru_cache
 from typing import Dict, Any
-from omegaconf import OmegaConf
-from dataclasses import dataclass
 
 from scabha.cargo import Parameter
-
-@dataclass
-class JonesTemplateStructure:
-    JONES_TEMPLATE: Dict[str, Parameter]
-
-JonesTemplate = None
-
-if JonesTemplate is None:
-    _dirname = os.path.dirname(__file__)
-    _structure = OmegaConf.create(JonesTemplateStructure)
-    _config = OmegaConf.load(os.path.join(
-        os.path.dirname(__file__),
-        "schema_JONES_TEMPLATE.yaml"))
-    JonesTemplate = OmegaConf.merge(_structure, _config).JONES_TEMPLATE
-
+from cultcargo.genesis.memo import memoised_schema
+from cultcargo.resources import with_resource_profile
+from cultcargo.genesis.schema_cache import load_nested_schema
+
+@lru_cache(maxsize=None)
+def jones_template() -> Dict[str, Parameter]:
+    """Loads the JONES_TEMPLATE schema on first use. Its Parameters are shared by all Jones terms."""
+    return load_nested_schema(os.path.join(os.path.dirname(__file__), "schema_JONES_TEMPLATE.yaml"))["JONES_TEMPLATE"]
+
+def __getattr__(name):
+    if name == "JonesTemplate":
+        return jones_template()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@with_resource_profile("cubical")
+@memoised_schema(lambda params: params.get('sol.jones', []))
 def make_stimela_schema(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
     """Augments a schema for stimela based on solver.terms"""
     inputs = inputs.copy()
@@ -26,7 +26,7 @@ def make_stimela_schema(params: Dict[str, Any], inputs: Dict[str, Parameter], ou
     terms = params.get('sol.jones', [])
 
     for jones in terms:
-        for key, value in JonesTemplate.items():
+        for key, value in jones_template().items():
             inputs[f"{jones.lower()}.{key}"] = value
         # inputs[f"{jones}.label"].default = jones
 
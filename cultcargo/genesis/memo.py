@@ -0,0 +1,70 @@
+import threading
+import functools
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Hashable, Tuple
+from omegaconf import DictConfig, ListConfig
+from scabha.cargo import Parameter
+
+# number of augmented schemas kept by each memoised hook
+SCHEMA_CACHE_SIZE = 256
+
+
+def freeze(value: Any) -> Hashable:
+    """Converts parameter value into a hashable equivalent (lists to tuples, dicts to sorted item tuples)"""
+    if isinstance(value, (list, tuple, ListConfig)):
+        return tuple(freeze(x) for x in value)
+    if isinstance(value, (dict, DictConfig)):
+        return tuple(sorted((str(k), freeze(v)) for k, v in value.items()))
+    return value
+
+
+def memoised_schema(key: Callable[[Dict[str, Any]], Hashable], maxsize: int = SCHEMA_CACHE_SIZE):
+    """Decorator memoising a stimela dynamic schema hook, func(params, inputs, outputs) -> (inputs, outputs).
+
+    Results are cached per original inputs/outputs dicts (which stimela keeps for the lifetime of a cab,
+    i.e. across loop iterations of a step), and per key(params), which must extract just the parameters
+    that the hook depends on. The least recently used entries are evicted beyond maxsize. Callers get
+    shallow copies of the cached dicts, so the Parameter objects in them are shared, and must be treated
+    as immutable.
+    """
+    def decorator(func):
+        cache: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+        lock = threading.Lock()
+        stats = dict(hits=0, misses=0)
+
+        @functools.wraps(func)
+        def wrapper(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
+            try:
+                cache_key = (id(inputs), id(outputs), freeze(key(params)))
+                hash(cache_key)
+            except Exception:
+                # let the hook itself deal with odd parameters
+                return func(params, inputs, outputs)
+            with lock:
+                entry = cache.get(cache_key)
+                # entries hold on to the original dicts, so their ids can't be reused while cached
+                if entry is not None and entry[0] is inputs and entry[1] is outputs:
+                    cache.move_to_end(cache_key)
+                    stats["hits"] += 1
+                    return entry[2].copy(), entry[3].copy()
+            new_inputs, new_outputs = func(params, inputs, outputs)
+            with lock:
+                stats["misses"] += 1
+                cache[cache_key] = (inputs, outputs, new_inputs, new_outputs)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return new_inputs.copy(), new_outputs.copy()
+
+        def cache_info():
+            return dict(stats, size=len(cache), maxsize=maxsize)
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats.update(hits=0, misses=0)
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
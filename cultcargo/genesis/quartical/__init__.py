@@ -1,44 +1,44 @@
 import os.path
-from dataclasses import dataclass
-from omegaconf import OmegaConf as oc
-from typing import Dict
-from scabha import schema_utils
-from scabha.cargo import Parameter
+from functools import lru_cache
+from cultcargo.genesis.schema_cache import load_nested_schema, parameters_to_dataclass, nested_parameters_to_dataclass
 from .config_classes import BaseConfigSection, POST_INIT_MAP
 
-base_schema = gain_schema = None
+# The schemas and the dataclasses derived from them are expensive to set up, so this is only done on first
+# use, i.e. when one of BaseConfig, base_schema, Gain or gain_schema is accessed. The parameter schemas
+# themselves are cached on disk, see schema_cache.py.
 
-# This should only run on the first import of this module. Sets up schemas.
-if base_schema is None:
-    dirname = os.path.dirname(__file__)
+dirname = os.path.dirname(__file__)
 
-    # Make dataclass based on the argument schema.
-    base_schema = oc.load(f"{dirname}/argument_schema.yaml")
+
+@lru_cache(maxsize=None)
+def _schemas():
+    # Argument schema, as dict of sections of Parameters.
+    base_schema = load_nested_schema(f"{dirname}/argument_schema.yaml")
 
     # Create the base config class.
-    BaseConfig = schema_utils.nested_schema_to_dataclass(
+    BaseConfig = nested_parameters_to_dataclass(
         base_schema,
         "BaseConfig",
         section_bases=(BaseConfigSection,),
         post_init_map=POST_INIT_MAP
     )
 
-    @dataclass
-    class _GainSchema(object):
-        gain: Dict[str, Parameter]
-
     # The gain section is loaded explicitly, since we need to form up multiple
     # instances.
-    gain_schema = oc.merge(
-        oc.structured(_GainSchema),
-        oc.load(f"{dirname}/gain_schema.yaml")
-    )
-    gain_schema = gain_schema.gain
+    gain_schema = load_nested_schema(f"{dirname}/gain_schema.yaml")["gain"]
 
     # Create gain dataclass.
-    Gain = schema_utils.schema_to_dataclass(
+    Gain = parameters_to_dataclass(
         gain_schema,
         "Gain",
         bases=(BaseConfigSection,),
         post_init=POST_INIT_MAP['gain']
     )
+
+    return dict(base_schema=base_schema, BaseConfig=BaseConfig, gain_schema=gain_schema, Gain=Gain)
+
+
+def __getattr__(name):
+    if name in ("base_schema", "BaseConfig", "gain_schema", "Gain"):
+        return _schemas()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,7 +2,11 @@ from dataclasses import make_dataclass
 from omegaconf import OmegaConf as oc
 from typing import Dict, Any
 from scabha.cargo import Parameter
-from . import Gain, BaseConfig, gain_schema
+from cultcargo.genesis.memo import memoised_schema
+from cultcargo.resources import with_resource_profile
+from cultcargo.genesis.quartical.planner import with_chunk_planner
+# schemas are set up on first access of their attributes
+from cultcargo.genesis import quartical
 
 
 def finalize_structure(additional_config):
@@ -16,17 +20,27 @@ def finalize_structure(additional_config):
             break
 
     # Use the default terms if no alternative is specified.
-    terms = terms or BaseConfig.solver.terms
+    terms = terms or quartical.BaseConfig.solver.terms
 
     FinalConfig = make_dataclass(
         "FinalConfig",
-        [(t, Gain, Gain()) for t in terms],
-        bases=(BaseConfig,)
+        [(t, quartical.Gain, quartical.Gain()) for t in terms],
+        bases=(quartical.BaseConfig,)
     )
 
     return FinalConfig
 
 
+def solver_terms(params: Dict[str, Any]):
+    """Returns solver.terms setting, or None if not set."""
+    if 'solver' in params:  # Is this ever the case?
+        return params['solver'].get('terms', None)
+    return params.get('solver.terms', None)
+
+
+@with_chunk_planner
+@with_resource_profile("quartical")
+@memoised_schema(solver_terms)
 def make_stimela_schema(
     params: Dict[str, Any],
     inputs: Dict[str, Parameter],
@@ -36,16 +50,15 @@ def make_stimela_schema(
 
     inputs = inputs.copy()
 
-    if 'solver' in params:  # Is this ever the case?
-        terms = params['solver'].get('terms', None)
-    else:
-        terms = params.get('solver.terms', None)
+    terms = solver_terms(params)
     if terms is None:
-        terms = BaseConfig.solver.terms  # Fall back to default.
+        # Fall back to default. (BaseConfig sections are instance fields, so get it from the schema.)
+        terms = quartical.base_schema['solver']['terms'].default
 
     # For each term, add the relevant entries to the inputs.
     for jones in terms:
-        for key, value in gain_schema.items():
+        # gain schema Parameters are shared by all terms
+        for key, value in quartical.gain_schema.items():
             inputs[f"{jones}.{key}"] = value
 
     return inputs, outputs
@@ -0,0 +1,292 @@
+import os
+import copy
+import math
+import logging
+import functools
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple
+
+from scabha.cargo import Parameter
+from cultcargo.resources import step_allocation
+from cultcargo.genesis import quartical
+from cultcargo.genesis.quartical.converters import as_time, as_freq
+
+# Rough model of QuartiCal's memory use. For every visibility (row, channel and correlation) of a chunk, the
+# data and each model direction are read in single precision and copied to double precision, and the weights,
+# flags and output visibilities are held alongside. Gains take 16 bytes per element, times GAIN_WORKSPACE for
+# the solver's intermediate products.
+BYTES_PER_VIS_DIRECTION = 8 + 16
+BYTES_PER_VIS_OTHER = 4 + 1 + 8
+GAIN_WORKSPACE = 4
+
+# fraction of the memory budget that chunks are planned to fill, and memory taken by QuartiCal regardless of
+# chunking (interpreter, libraries, dask bookkeeping)
+MEMORY_HEADROOM = 0.8
+BASE_MEMORY_GB = 1.0
+
+# chunks smaller than this spend more time in dask overheads than in the solvers
+SMALL_CHUNK_MB = 32
+
+PLANNER_MODES = ("auto", "check", "none")
+
+_log = logging.getLogger(__name__)
+
+# warnings are only issued once, rather than on every evaluation of the dynamic schema
+_warned = set()
+
+
+@dataclass(frozen=True)
+class MSDimensions(object):
+    nrow: int
+    ntime: int                  # number of unique timestamps
+    nchan: int                  # channels per spectral window (the largest, if they differ)
+    ncorr: int
+    nant: int
+    integration: float          # integration time, in seconds
+    chan_width: float           # channel width, in Hz
+
+    @property
+    def rows_per_time(self) -> float:
+        return self.nrow / max(self.ntime, 1)
+
+
+@lru_cache(maxsize=16)
+def _read_ms_dimensions(path: str, mtime: float) -> Optional[MSDimensions]:
+    try:
+        import numpy as np
+        from casacore.tables import table
+    except ImportError:
+        _log.debug("python-casacore is not available, can't plan QuartiCal chunking")
+        return None
+    try:
+        with table(path, ack=False) as ms:
+            nrow = ms.nrows()
+            ntime = len(np.unique(ms.getcol("TIME")))
+            integration = float(np.median(ms.getcol("INTERVAL", nrow=min(nrow, 10000)))) if nrow else 0.
+        with table(f"{path}::SPECTRAL_WINDOW", ack=False) as spw:
+            nchan = int(spw.getcol("NUM_CHAN").max())
+            chan_width = float(np.abs(spw.getcell("CHAN_WIDTH", 0)).mean())
+        with table(f"{path}::POLARIZATION", ack=False) as pol:
+            ncorr = int(pol.getcol("NUM_CORR").max())
+        with table(f"{path}::ANTENNA", ack=False) as ant:
+            nant = ant.nrows()
+    except Exception as exc:
+        _log.debug(f"can't read dimensions of {path}: {exc}")
+        return None
+    return MSDimensions(nrow=nrow, ntime=ntime, nchan=nchan, ncorr=ncorr, nant=nant,
+                        integration=integration, chan_width=chan_width)
+
+
+def ms_dimensions(path: str) -> Optional[MSDimensions]:
+    """Returns dimensions of a measurement set, or None if it can't be read (e.g. because it doesn't exist yet,
+    or because python-casacore is not installed)"""
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "table.dat"))
+    except OSError:
+        return None
+    return _read_ms_dimensions(os.path.abspath(path), mtime)
+
+
+def _timeslots(value: Any, dims: MSDimensions) -> Optional[int]:
+    """Converts a time chunk or solution interval into a number of timeslots. Returns 0 for the full axis,
+    and None if the value can't be interpreted."""
+    try:
+        value = as_time(str(value))
+    except ValueError:
+        return None
+    if isinstance(value, float):
+        return max(1, math.ceil(value / dims.integration)) if dims.integration else None
+    return value
+
+
+def _channels(value: Any, dims: MSDimensions) -> Optional[int]:
+    """Converts a frequency chunk or solution interval into a number of channels, as _timeslots() does"""
+    try:
+        value = as_freq(str(value))
+    except ValueError:
+        return None
+    if isinstance(value, float):
+        return max(1, math.ceil(value / dims.chan_width)) if dims.chan_width else None
+    return value
+
+
+def _unit(intervals: List[Optional[int]]) -> Optional[int]:
+    """Returns the smallest chunk size that is a multiple of all solution intervals, or None if chunking is
+    not possible along the axis (some interval spans the full axis, or can't be interpreted)"""
+    if any(not interval for interval in intervals):
+        return None
+    # math.lcm() needs Python>=3.9
+    return functools.reduce(lambda a, b: a * b // math.gcd(a, b), intervals, 1)
+
+
+def count_directions(recipe: Optional[str]) -> int:
+    """Counts the model directions in an input_model.recipe. Directions tagged in a sky model (LSM@tag)
+    count as one, since their number is not known without reading the model."""
+    if not recipe:
+        return 1
+    return max(1, len(recipe.split(":")))
+
+
+@dataclass
+class ChunkPlan(object):
+    time_chunk: int             # timeslots per chunk
+    freq_chunk: int             # channels per chunk
+    threads: int                # number of chunks processed concurrently
+    chunk_gb: float             # estimated memory per chunk
+    total_gb: float             # estimated peak memory
+
+    def settings(self, dims: MSDimensions) -> Dict[str, Any]:
+        """Returns the plan as QuartiCal settings, where 0 stands for the full axis"""
+        return {"input_ms.time_chunk": str(self.time_chunk if self.time_chunk < dims.ntime else 0),
+                "input_ms.freq_chunk": str(self.freq_chunk if self.freq_chunk < dims.nchan else 0),
+                "dask.threads": self.threads}
+
+
+def chunk_memory_gb(dims: MSDimensions, time_chunk: int, freq_chunk: int, directions: int,
+                    terms: List[Tuple[int, int, bool]]) -> float:
+    """Estimates the memory needed to process one chunk. Terms is a list of (time_interval, freq_interval,
+    direction_dependent) tuples, with intervals in timeslots and channels (0 for the full chunk)."""
+    nvis = time_chunk * dims.rows_per_time * freq_chunk * dims.ncorr
+    total = nvis * (BYTES_PER_VIS_DIRECTION * (1 + directions) + BYTES_PER_VIS_OTHER)
+    for time_interval, freq_interval, dd in terms:
+        ntint = math.ceil(time_chunk / time_interval) if time_interval else 1
+        nfint = math.ceil(freq_chunk / freq_interval) if freq_interval else 1
+        total += ntint * nfint * dims.nant * (directions if dd else 1) * dims.ncorr * 16 * GAIN_WORKSPACE
+    return total / 2**30
+
+
+def _estimate(dims, time_chunk, freq_chunk, threads, directions, terms) -> ChunkPlan:
+    chunk_gb = chunk_memory_gb(dims, time_chunk, freq_chunk, directions, terms)
+    return ChunkPlan(time_chunk, freq_chunk, threads, chunk_gb, BASE_MEMORY_GB + threads * chunk_gb)
+
+
+def plan_chunks(dims: MSDimensions, mem_gb: float, max_threads: int, directions: int,
+                terms: List[Tuple[int, int, bool]], time_unit: Optional[int], freq_unit: Optional[int],
+                time_chunk: int = 0, freq_chunk: int = 0, adjust_threads: bool = True) -> ChunkPlan:
+    """Plans chunk sizes and the number of dask threads for a memory budget.
+
+    Chunks are multiples of time_unit timeslots and freq_unit channels (None if the axis can't be chunked),
+    unless time_chunk or freq_chunk give a fixed size. The full band is preferred, with as many timeslots as fit
+    into the budget, but no more than needed to give each of max_threads threads a chunk. If a single unit does
+    not fit, the band is split, and failing that, the number of threads is reduced (if adjust_threads is set).
+    The result may still exceed the budget if even the smallest chunks don't fit.
+    """
+    ntime, nchan = max(dims.ntime, 1), max(dims.nchan, 1)
+    threads = max_threads
+    while True:
+        per_thread = (mem_gb * MEMORY_HEADROOM - BASE_MEMORY_GB) / threads
+
+        def fitting_units(tchunk, fchunk):
+            per_unit = chunk_memory_gb(dims, tchunk, fchunk, directions, terms)
+            return int(per_thread // per_unit) if per_unit > 0 else 0
+
+        # as many timeslots across the (fixed or full) band as fit
+        fchunk = freq_chunk or nchan
+        if time_chunk or not time_unit:
+            tchunk = time_chunk or ntime
+            if fitting_units(tchunk, fchunk) >= 1:
+                return _estimate(dims, tchunk, fchunk, threads, directions, terms)
+        else:
+            # no point in chunks bigger than needed to keep all threads busy
+            units = min(fitting_units(time_unit, fchunk), math.ceil(math.ceil(ntime / threads) / time_unit))
+            if units >= 1:
+                return _estimate(dims, min(units * time_unit, ntime), fchunk, threads, directions, terms)
+        # split the band
+        tchunk = time_chunk or time_unit or ntime
+        if not freq_chunk and freq_unit:
+            units = fitting_units(tchunk, freq_unit)
+            if units >= 1:
+                return _estimate(dims, tchunk, min(units * freq_unit, nchan), threads, directions, terms)
+        if threads == 1 or not adjust_threads:
+            return _estimate(dims, tchunk, freq_chunk or freq_unit or nchan, threads, directions, terms)
+        threads = max(1, threads // 2)
+
+
+def _warn(message: str):
+    if message not in _warned:
+        _warned.add(message)
+        _log.warning(message)
+
+
+def _effective(params: Dict[str, Any], inputs: Dict[str, Parameter], name: str):
+    """Returns the value a parameter will take: its setting, or else the default in its (dynamic) schema"""
+    if params.get(name) is not None:
+        return params[name]
+    schema = inputs.get(name)
+    return schema.default if schema is not None else None
+
+
+def apply_chunk_planner(params: Dict[str, Any], inputs: Dict[str, Parameter]) -> Dict[str, Parameter]:
+    """Plans chunking and dask threads of a QuartiCal step, see plan_chunks(). In auto mode, fills in
+    time_chunk and freq_chunk if they are unset or 0 (i.e. the full axis), and dask.threads if unset. Warns if
+    the resulting configuration is expected to exceed the memory budget, or to process tiny chunks."""
+    mode = params.get("planner.mode", "auto")
+    ms = params.get("input_ms.path")
+    if mode not in PLANNER_MODES or mode == "none" or not isinstance(ms, str):
+        return inputs
+    alloc = step_allocation(params)
+    if alloc is None or not alloc.mem_gb:
+        return inputs
+    dims = ms_dimensions(ms)
+    if dims is None or not dims.nrow:
+        return inputs
+
+    terms = params.get("solver.terms") or quartical.base_schema['solver']['terms'].default
+    directions = params.get("planner.directions") or count_directions(params.get("input_model.recipe"))
+    intervals = []
+    for term in terms:
+        intervals.append((_timeslots(_effective(params, inputs, f"{term}.time_interval") or "1", dims),
+                          _channels(_effective(params, inputs, f"{term}.freq_interval") or "1", dims),
+                          bool(_effective(params, inputs, f"{term}.direction_dependent"))))
+    time_unit = _unit([t for t, _, _ in intervals])
+    freq_unit = _unit([f for _, f, _ in intervals])
+    terms_model = [(t or 0, f or 0, dd) for t, f, dd in intervals]
+
+    solver_threads = _effective(params, inputs, "solver.threads") or 1
+    threads = _effective(params, inputs, "dask.threads") or max(1, alloc.cores // solver_threads)
+    time_chunk = _timeslots(_effective(params, inputs, "input_ms.time_chunk") or "0", dims)
+    freq_chunk = _channels(_effective(params, inputs, "input_ms.freq_chunk") or "0", dims)
+    if time_chunk is None or freq_chunk is None or not isinstance(threads, int):
+        return inputs
+
+    if mode == "auto":
+        # explicit chunk sizes and thread counts are kept
+        current = plan_chunks(dims, alloc.mem_gb, threads, directions, terms_model, time_unit, freq_unit,
+                              time_chunk=min(time_chunk, dims.ntime), freq_chunk=min(freq_chunk, dims.nchan),
+                              adjust_threads=not params.get("dask.threads"))
+        inputs = inputs.copy()
+        for name, value in current.settings(dims).items():
+            if name in inputs and params.get(name) in (None, 0, "0"):
+                # schemas are shared between steps, so modify a copy
+                schema = inputs[name] = copy.copy(inputs[name])
+                schema.default = value
+    else:
+        current = _estimate(dims, min(time_chunk or dims.ntime, dims.ntime), min(freq_chunk or dims.nchan, dims.nchan),
+                            threads, directions, terms_model)
+
+    budget = alloc.mem_gb * MEMORY_HEADROOM
+    if current.total_gb > budget:
+        advice = plan_chunks(dims, alloc.mem_gb, threads, directions, terms_model, time_unit, freq_unit)
+        settings = ", ".join(f"{name}={value}" for name, value in advice.settings(dims).items())
+        _warn(f"QuartiCal on {ms}: estimated peak memory of {current.total_gb:.1f} GB exceeds "
+              f"{MEMORY_HEADROOM:.0%} of the {alloc.mem_gb:.1f} GB available. "
+              + (f"Try {settings}." if advice.total_gb <= budget else "Consider running on a larger node."))
+    elif current.chunk_gb * 1024 < SMALL_CHUNK_MB and current.time_chunk < dims.ntime and \
+            current.time_chunk * threads < dims.ntime:
+        advice = plan_chunks(dims, alloc.mem_gb, threads, directions, terms_model, time_unit, freq_unit,
+                             adjust_threads=False)
+        if advice.chunk_gb > current.chunk_gb:
+            settings = ", ".join(f"{name}={value}" for name, value in advice.settings(dims).items())
+            _warn(f"QuartiCal on {ms}: chunks of ~{current.chunk_gb * 1024:.0f} MB are small enough for "
+                  f"overheads to dominate. Try {settings}.")
+    return inputs
+
+
+def with_chunk_planner(func):
+    """Decorator applying apply_chunk_planner() to the inputs returned by a QuartiCal dynamic schema hook"""
+    @functools.wraps(func)
+    def wrapper(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
+        inputs, outputs = func(params, inputs, outputs)
+        return apply_chunk_planner(params, inputs), outputs
+    return wrapper
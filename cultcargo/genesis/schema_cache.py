@@ -0,0 +1,105 @@
+import os
+import sys
+import copy
+import pickle
+import hashlib
+import logging
+from dataclasses import make_dataclass, field
+from typing import List, Dict, Any, Callable, Optional
+from omegaconf import OmegaConf
+
+try:
+    from importlib import metadata
+except ImportError: # for Python<3.8
+    import importlib_metadata as metadata
+
+# environment variable overriding the schema cache directory. Set to an empty string to disable caching.
+SCHEMA_CACHE_ENV = "CULT_CARGO_SCHEMA_CACHE"
+
+# bump this when the format of cached schemas changes
+CACHE_FORMAT = 1
+
+_log = logging.getLogger(__name__)
+
+
+def schema_cache_dir() -> Optional[str]:
+    """Returns directory of compiled schema cache, or None if caching is disabled"""
+    if SCHEMA_CACHE_ENV in os.environ:
+        return os.environ[SCHEMA_CACHE_ENV] or None
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "cult-cargo", "schemas")
+
+
+def _scabha_version():
+    # scabha is distributed as part of stimela
+    try:
+        return metadata.version("stimela")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def cached(name: str, sources: List[str], build: Callable[[], Any]):
+    """Returns the result of build(), caching it on disk.
+
+    The cache entry is keyed on the content of the source files that the result is built from, and on the
+    scabha (i.e. stimela) and Python versions, so it is rebuilt whenever any of these change. Failure to read
+    or write the cache is never an error: the result is then simply built.
+    """
+    cache_dir = schema_cache_dir()
+    if not cache_dir:
+        return build()
+    hasher = hashlib.sha256(f"{CACHE_FORMAT} {_scabha_version()} {sys.version_info[:2]}".encode())
+    for path in sources:
+        with open(path, "rb") as f:
+            hasher.update(f.read())
+    cache_file = os.path.join(cache_dir, f"{name}-{hasher.hexdigest()[:16]}.pickle")
+    try:
+        with open(cache_file, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        _log.debug(f"ignoring unreadable schema cache {cache_file}: {exc}")
+    result = build()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmpfile = f"{cache_file}.{os.getpid()}"
+        with open(tmpfile, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmpfile, cache_file)
+    except Exception as exc:
+        _log.debug(f"can't write schema cache {cache_file}: {exc}")
+    return result
+
+
+def load_nested_schema(path: str) -> Dict[str, Dict[str, Any]]:
+    """Loads YAML file of schema sections (each a mapping of parameter names to schemas) into a dict of dicts of
+    Parameters. This involves an expensive structured merge, so the result is cached on disk."""
+    def build():
+        from scabha.cargo import Parameter
+        content = OmegaConf.load(path)
+        structure = make_dataclass("_NestedSchemas", [(name, Dict[str, Parameter]) for name in content.keys()])
+        nested = OmegaConf.unsafe_merge(OmegaConf.structured(structure), content)
+        return {section: {name: OmegaConf.to_object(schema) for name, schema in params.items()}
+                for section, params in nested.items()}
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return cached(f"{os.path.basename(os.path.dirname(path))}-{name}", [path], build)
+
+
+def parameters_to_dataclass(params: Dict[str, Any], class_name: str, bases=(), post_init=None):
+    """Equivalent of scabha.schema_utils.schema_to_dataclass(), which leaves the given Parameters unmodified"""
+    from scabha import schema_utils
+    # converting Parameters to dataclass fields modifies them, so work on copies
+    return schema_utils.schema_to_dataclass({name: copy.copy(schema) for name, schema in params.items()},
+                                            class_name, bases=bases, post_init=post_init)
+
+
+def nested_parameters_to_dataclass(nested: Dict[str, Dict[str, Any]], class_name: str, bases=(), section_bases=(),
+                                   post_init_map={}):
+    """Equivalent of scabha.schema_utils.nested_schema_to_dataclass(), for schemas loaded by load_nested_schema()"""
+    fields = []
+    for section, params in nested.items():
+        dcls = parameters_to_dataclass(params, f"{class_name}_{section}", bases=section_bases,
+                                       post_init=post_init_map.get(section))
+        fields.append((section, dcls, field(default_factory=dcls)))
+    return make_dataclass(class_name, fields, bases=bases)
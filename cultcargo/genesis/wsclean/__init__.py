@@ -1,6 +1,13 @@
+from functools import lru_cache
 from scabha.cargo import Parameter
 from typing import Dict, Any
+from cultcargo.genesis.memo import memoised_schema
+from cultcargo.resources import with_resource_profile
 
+_UNSET = object()
+
+# the same image outputs recur for many combinations of settings, so their Parameters are shared
+@lru_cache(maxsize=None)
 def img_output(imagetype, desc, path, glob=True, must_exist=False):
     # reamp image type to output filename component
     if imagetype == "restored":
@@ -16,6 +23,15 @@ def img_output(imagetype, desc, path, glob=True, must_exist=False):
         must_exist=must_exist)   
 
 
+def _schema_key(params: Dict[str, Any]):
+    """Returns the settings that the schema depends on"""
+    return (params.get('predict'), params.get('nchan', 1), params.get('multi.chan', _UNSET), params.get('pol'),
+            params.get('multi.stokes', False), params.get('intervals-out', 1), params.get('multi.interval', False),
+            params.get('no-dirty', False), params.get('niter', 0) > 0)
+
+
+@with_resource_profile("wsclean")
+@memoised_schema(_schema_key)
 def make_stimela_schema(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
     """Augments a schema for stimela based on wsclean settings"""
 
@@ -0,0 +1,83 @@
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
+import yaml
+
+
+# lockfiles mapping image references (REGISTRY/IMAGE:TAG) to content digests. The one shipped with the package
+# holds the digests of released images, and is updated by maintainers (build-cargo --lockfile LOCKFILE) when
+# pushing a release. By default, build-cargo records pushed images in a lockfile of the user instead (see
+# user_lockfile()), which takes precedence.
+LOCKFILE = os.path.join(os.path.dirname(__file__), "image-digests.yml")
+
+# set this environment variable to a non-empty value to have cabs reference images as TAG@DIGEST. This suits
+# the docker, podman and kubernetes backends. It is off by default since apptainer/singularity can't parse
+# such references (and caches SIF images by tag anyway).
+PIN_DIGESTS_ENV = "CULT_CARGO_PIN_DIGESTS"
+
+_HEADER = "# Content digests of pushed images. Generated by build-cargo, do not edit.\n"
+
+
+def user_lockfile() -> str:
+    """Returns path of the lockfile of the user, following XDG conventions"""
+    return os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"), "cult-cargo",
+                        "image-digests.yml")
+
+
+def read_lockfile(path: str = LOCKFILE) -> Dict[str, str]:
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError):
+        return {}
+
+
+@lru_cache
+def known_digests() -> Dict[str, str]:
+    """Returns digests of images known to have been pushed, from the shipped and the user's lockfiles"""
+    return {**read_lockfile(LOCKFILE), **read_lockfile(user_lockfile())}
+
+
+def image_digest(ref: str) -> Optional[str]:
+    """Returns digest of image reference according to the lockfiles, or None if not known
+    or digest pinning is not enabled"""
+    if not os.environ.get(PIN_DIGESTS_ENV):
+        return None
+    return known_digests().get(ref)
+
+
+class Lockfile(object):
+    """Updates a lockfile as images are pushed"""
+    def __init__(self, path: str):
+        self.path = path
+        self.digests = read_lockfile(path)
+        self._lock = threading.RLock()
+        self.error: Optional[str] = None
+
+    def set(self, ref: str, digest: str) -> bool:
+        """Records digest of image reference. Returns False if the lockfile couldn't be written."""
+        with self._lock:
+            if self.digests.get(ref) != digest:
+                self.digests[ref] = digest
+                return self.save()
+        return True
+
+    def save(self) -> bool:
+        """Writes the lockfile. If it can't be written (e.g. inside an installed package), sets error and
+        returns False."""
+        with self._lock:
+            tmpfile = f"{self.path}.{os.getpid()}"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmpfile, "wt") as f:
+                    f.write(_HEADER)
+                    yaml.safe_dump(dict(sorted(self.digests.items())), f, default_flow_style=False, width=1000)
+                os.replace(tmpfile, self.path)
+            except OSError as exc:
+                self.error = f"can't write lockfile {self.path}: {exc}"
+                if os.path.exists(tmpfile):
+                    os.unlink(tmpfile)
+                return False
+        self.error = None
+        return True
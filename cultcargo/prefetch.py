@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import os
+import sys
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Any
+import click
+from rich.console import Console
+from rich.progress import Progress, SpinnerColumn, TimeElapsedColumn, BarColumn, MofNCompleteColumn
+
+BACKENDS = ("docker", "podman", "singularity")
+
+
+def _get(conf: Any, key: str):
+    return conf.get(key) if hasattr(conf, "get") else None
+
+
+def recipe_images(recipe: Any, backend: Any, images: Dict[str, List[str]], errors: Dict[str, str], prefix: str = ""):
+    """Walks the steps of a recipe (and its sub-recipes), adding the image reference of each step's cab
+    to the images dict, which maps image references to the steps using them"""
+    import stimela
+    from stimela.kitchen.cab import Cab
+
+    for label, step in (_get(recipe, "steps") or {}).items():
+        fqname = f"{prefix}{label}"
+        cab, subrecipe = _get(step, "cab"), _get(step, "recipe")
+        if cab is not None:
+            try:
+                if isinstance(cab, str):
+                    if cab not in stimela.CONFIG.cabs:
+                        raise KeyError(f"unknown cab '{cab}'")
+                    cab = stimela.CONFIG.cabs[cab]
+                cab = Cab(**cab)
+                ref = cab.flavour.get_image_name(cab, backend)
+            except Exception as exc:
+                errors[fqname] = str(exc)
+                continue
+            if ref:
+                images.setdefault(ref, []).append(fqname)
+        elif subrecipe is not None:
+            if isinstance(subrecipe, str):
+                if subrecipe not in stimela.CONFIG.lib.recipes:
+                    errors[fqname] = f"unknown recipe '{subrecipe}'"
+                    continue
+                subrecipe = stimela.CONFIG.lib.recipes[subrecipe]
+            recipe_images(subrecipe, backend, images, errors, prefix=f"{fqname}.")
+    return images
+
+
+def load_recipe(filename: str, recipe_name: Optional[str] = None):
+    """Loads stimela config and recipe file. Returns (recipe name, recipe config)."""
+    import stimela
+    import stimela.config
+    from stimela.commands.run import load_recipe_files
+
+    stimela.logger(loglevel=logging.WARNING)
+    stimela.CONFIG = stimela.config.load_config(extra_configs=[])
+    if stimela.CONFIG is None:
+        raise RuntimeError("failed to load stimela configuration")
+    names, default_name = load_recipe_files([filename])
+    recipe_name = recipe_name or default_name or (names[0] if len(names) == 1 else None)
+    if recipe_name is None:
+        raise RuntimeError(f"{filename} defines {len(names)} recipes, please specify one of: {', '.join(names)}")
+    if recipe_name not in stimela.CONFIG.lib.recipes:
+        raise RuntimeError(f"recipe '{recipe_name}' not found in {filename}")
+    return recipe_name, stimela.CONFIG.lib.recipes[recipe_name]
+
+
+@click.command()
+@click.option('-l', '--list', 'do_list', is_flag=True, help='List the images needed, but do not fetch them.')
+@click.option('-j', '--jobs', 'jobs_', type=int, default=4, show_default=True,
+                help='Number of images to fetch concurrently.')
+@click.option('--backend', type=click.Choice(BACKENDS),
+                help='How to fetch images: pull them with docker/podman, or convert them to SIF files. Default is '
+                     'the first of these among the selected stimela backends, else docker.')
+@click.option('--sif-dir', metavar='DIR',
+                help='Directory for SIF files. Default is the singularity image_dir of the stimela config.')
+@click.option('--sif-converter', metavar='COMMAND',
+                help='Command used to convert images to SIF files. Default is apptainer or singularity, whichever is found.')
+@click.option('--boring', is_flag=True, help='Simpler console output.')
+@click.argument('filename', type=str)
+@click.argument('recipe_name', type=str, required=False)
+def prefetch_cargo(filename: str, recipe_name: Optional[str] = None, do_list=False, jobs_=4,
+                   backend: Optional[str] = None, sif_dir: Optional[str] = None, sif_converter: Optional[str] = None,
+                   boring=False):
+    """Fetches all images needed by the steps of a recipe, so that the recipe doesn't stall on image pulls."""
+    console = Console(highlight=False, no_color=boring, force_terminal=False if boring else None)
+    print = console.print
+
+    import stimela
+
+    try:
+        recipe_name, recipe = load_recipe(filename, recipe_name)
+    except Exception as exc:
+        print(f"[red]{exc}[/red]")
+        sys.exit(1)
+
+    backend_opts = stimela.CONFIG.opts.backend
+    if backend is None:
+        selected = [name for name in (backend_opts.select or []) if name in BACKENDS]
+        backend = selected[0] if selected else "docker"
+
+    images: Dict[str, List[str]] = {}
+    errors: Dict[str, str] = {}
+    recipe_images(recipe, backend_opts, images, errors)
+
+    for fqname, error in errors.items():
+        print(f"[yellow]step {fqname}: can't resolve image: {error}[/yellow]")
+    print(f"Recipe [bold]{recipe_name}[/bold] uses {len(images)} image(s):")
+    for ref, steps in images.items():
+        print(f"  [bold]{ref}[/bold] ({', '.join(steps)})")
+    if do_list or not images:
+        return 0
+
+    if backend == "singularity":
+        from cultcargo.builder.sif import SifCache
+        sif_cache = SifCache(os.path.expanduser(sif_dir or backend_opts.singularity.image_dir), sif_converter)
+
+        def fetch(ref: str):
+            if os.path.exists(sif_cache.path(ref)):
+                return f"{sif_cache.path(ref)} exists"
+            sif_cache.convert(ref, None, capture=True)
+            return f"converted to {sif_cache.path(ref)}"
+    else:
+        def fetch(ref: str):
+            result = subprocess.run([backend, "pull", "-q", ref], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True)
+            if result.returncode:
+                raise RuntimeError(result.stdout.strip())
+            return "pulled"
+
+    failed = 0
+    with Progress(TimeElapsedColumn(), SpinnerColumn(), "{task.description}", BarColumn(), MofNCompleteColumn(),
+                  console=console, transient=True, disable=boring) as progress:
+        task = progress.add_task(f"fetching {len(images)} image(s) via {backend}", total=len(images))
+        with ThreadPoolExecutor(max_workers=max(jobs_, 1)) as executor:
+            futures = {executor.submit(fetch, ref): ref for ref in images}
+            for future in as_completed(futures):
+                ref = futures[future]
+                try:
+                    progress.console.print(f"[green]{ref}: {future.result()}[/green]")
+                except Exception as exc:
+                    failed += 1
+                    progress.console.print(f"[red]{ref}: {exc}[/red]")
+                progress.advance(task)
+
+    if failed:
+        print(f"[red]{failed} image(s) failed to fetch[/red]")
+        sys.exit(1)
+    print("All images fetched")
+    return 0
+
+
+def driver():
+    return prefetch_cargo()
+
+
+if __name__ == "__main__":
+    driver()
@@ -0,0 +1,52 @@
+import os
+from typing import Any
+from .cpu import best_cpu_variant, manifest_cpu_variants
+from .lockfile import image_digest, known_digests
+
+
+def image_version_resolver(version: str, *, _parent_: Any = None):
+    """OmegaConf resolver for vars.cult-cargo.images.version. When resolved inside a cab's image section,
+    returns the tag of the best CPU variant of the image, if variants are enabled (see cpu.py) and the variant
+    is known to have been pushed, according to the lockfiles, or else the generic tag. The tag is pinned to the
+    image digest recorded in the lockfile, if enabled (see lockfile.py)."""
+    if _parent_ is None or not hasattr(_parent_, "get"):
+        return version
+    name, registry = _parent_.get("name"), _parent_.get("registry")
+    if not name:
+        return version
+    # only variants recorded in a lockfile, since a variant that failed to build or push can't be pulled
+    variants = [variant for variant in manifest_cpu_variants().get(name, [])
+                if registry and f"{registry}/{name}:{version}-{variant}" in known_digests()]
+    variant = best_cpu_variant(variants)
+    if variant:
+        version = f"{version}-{variant}"
+    # TAG@DIGEST lets the container runtime use a cached image without a registry lookup
+    digest = registry and image_digest(f"{registry}/{name}:{version}")
+    return f"{version}@{digest}" if digest else version
+
+
+# environment variable overriding the host directory of persistent numba caches, see vars.cult-cargo.numba-cache
+NUMBA_CACHE_ENV = "CULT_CARGO_NUMBA_CACHE"
+
+
+def numba_cache_resolver(default: str):
+    """OmegaConf resolver for vars.cult-cargo.numba-cache: returns the host directory holding persistent numba
+    caches, which is $CULT_CARGO_NUMBA_CACHE if set, or else the given default"""
+    return os.environ.get(NUMBA_CACHE_ENV) or default
+
+
+def catalog_resolver(section: str):
+    """OmegaConf resolver used by catalog.yml: returns a section of the pre-resolved catalog of all cult-cargo
+    cabs, see catalog.py"""
+    from .catalog import load_catalog, catalog_cabs
+    return catalog_cabs() if section == "cabs" else load_catalog()[section]
+
+
+def cabs_resolver(*names: str, _root_: Any = None):
+    """OmegaConf resolver for a recipe's cabs section. Returns definitions of the named cult-cargo cabs or, if no
+    names are given, of those cabs that the steps of recipes in the same file invoke, taken from the catalog."""
+    from omegaconf import OmegaConf
+    from .catalog import catalog_cabs, referenced_cabs
+    if not names:
+        names = referenced_cabs(OmegaConf.to_container(_root_, resolve=False)) if _root_ is not None else ()
+    return catalog_cabs(names)
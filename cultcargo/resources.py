@@ -0,0 +1,255 @@
+import os
+import copy
+import math
+import functools
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, Optional, List
+
+from scabha.cargo import Parameter
+from scabha.exceptions import ParameterValidationError
+
+# environment variables setting the number of cores and the memory (in GB) available to each step, overriding
+# host detection. These are considered an explicit allocation, as are the resources.* inputs of a step.
+CORES_ENV = "CULT_CARGO_CORES"
+MEM_ENV = "CULT_CARGO_MEM_GB"
+
+# inputs (see lib.params.cult-cargo.resources in genesis/cult-cargo-base.yml) through which a step can set its
+# allocation, or disable the resource profile
+CORES_PARAM = "resources.cores"
+MEM_PARAM = "resources.mem-gb"
+AUTO_PARAM = "resources.auto"
+
+# cgroup limits at or above this are effectively unlimited
+_UNLIMITED = 1 << 60
+
+
+@dataclass(frozen=True)
+class Allocation(object):
+    cores: int                          # number of cores a step may use
+    mem_gb: Optional[float] = None      # memory a step may use, None if unknown
+    explicit: bool = False              # True if set by the user, rather than detected
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cores() -> Optional[int]:
+    """Returns the CPU quota of our cgroup in (rounded up) cores, or None if there is no quota"""
+    # cgroup v2: "max 100000" or "QUOTA PERIOD"
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    # cgroup v1
+    quota, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return max(1, math.ceil(int(quota) / int(period)))
+    return None
+
+
+def _cgroup_memory() -> Optional[int]:
+    """Returns the memory limit of our cgroup in bytes, or None if there is no limit"""
+    for path in "/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes":
+        limit = _read(path)
+        if limit and limit.isdigit() and int(limit) < _UNLIMITED:
+            return int(limit)
+    return None
+
+
+def _physical_memory() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+@lru_cache
+def host_allocation() -> Allocation:
+    """Returns the resources available to steps running on this host.
+
+    The CULT_CARGO_CORES and CULT_CARGO_MEM_GB environment variables take precedence, followed by the allocation
+    of the enclosing Slurm job (if stimela itself runs inside one), and finally the CPU affinity, cgroup limits and
+    physical memory of the host.
+    """
+    explicit = False
+    cores = mem_gb = None
+    if os.environ.get(CORES_ENV):
+        cores, explicit = int(os.environ[CORES_ENV]), True
+    if os.environ.get(MEM_ENV):
+        mem_gb, explicit = float(os.environ[MEM_ENV]), True
+    # Slurm gives memory in MB
+    if cores is None and os.environ.get("SLURM_CPUS_PER_TASK"):
+        cores, explicit = int(os.environ["SLURM_CPUS_PER_TASK"]), True
+    if mem_gb is None:
+        if os.environ.get("SLURM_MEM_PER_NODE"):
+            mem_gb, explicit = int(os.environ["SLURM_MEM_PER_NODE"]) / 1024, True
+        elif os.environ.get("SLURM_MEM_PER_CPU") and cores is not None:
+            mem_gb, explicit = int(os.environ["SLURM_MEM_PER_CPU"]) * cores / 1024, True
+    if cores is None:
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:   # not available on macOS
+            cores = os.cpu_count() or 1
+        quota = _cgroup_cores()
+        if quota:
+            cores = min(cores, quota)
+    if mem_gb is None:
+        limits = [limit for limit in (_cgroup_memory(), _physical_memory()) if limit]
+        if limits:
+            mem_gb = min(limits) / 2**30
+    return Allocation(cores=cores, mem_gb=mem_gb, explicit=explicit)
+
+
+def step_allocation(params: Dict[str, Any]) -> Optional[Allocation]:
+    """Returns the allocation of a step, given its parameters, or None if the resource profile is disabled,
+    or if the resources.* inputs are not resolved yet"""
+    auto = params.get(AUTO_PARAM, True)
+    cores = params.get(CORES_PARAM)
+    mem_gb = params.get(MEM_PARAM)
+    # anything else is a formula that stimela hasn't evaluated yet
+    if not isinstance(auto, bool) or not isinstance(cores, (int, type(None))) or \
+            not isinstance(mem_gb, (int, float, type(None))):
+        return None
+    if not auto:
+        return None
+    host = host_allocation()
+    if cores is not None and cores < 1:
+        raise ParameterValidationError(f"{CORES_PARAM}={cores}: at least one core expected")
+    return Allocation(cores=cores or host.cores, mem_gb=mem_gb if mem_gb is not None else host.mem_gb,
+                      explicit=host.explicit or cores is not None)
+
+
+def _is_set(value: Any) -> bool:
+    # 0 means "pick automatically" for the thread and worker counts of most tools
+    return value is not None and value != 0
+
+
+def split_cores(alloc: Allocation, params: Dict[str, Any], names: List[str], fill: str,
+                budget: Optional[int] = None) -> Dict[str, int]:
+    """Splits cores between nested levels of parallelism, given by a list of parameter names, such that
+    the product of their values doesn't exceed the budget (default is all allocated cores).
+
+    Levels that are set in params keep their values. If the fill level is unset, it gets the cores left over,
+    while other unset levels get 1. Returns dict of name -> value for the unset levels. If the levels that are set
+    already exceed an explicit allocation, raises ParameterValidationError.
+    """
+    budget = alloc.cores if budget is None else budget
+    fixed = {name: params[name] for name in names if _is_set(params.get(name))}
+    if any(not isinstance(value, int) for value in fixed.values()):
+        return {}
+    product = math.prod(fixed.values())
+    if product > budget:
+        if alloc.explicit:
+            settings = "*".join(f"{name}={value}" for name, value in fixed.items())
+            raise ParameterValidationError(f"{settings} exceeds the allocation of {budget} core(s)")
+        return {name: 1 for name in names if name not in fixed}
+    values = {name: 1 for name in names if name not in fixed}
+    if fill in values:
+        values[fill] = max(1, budget // product)
+    return values
+
+
+def wsclean_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    values = split_cores(alloc, params, ["threads"], "threads")
+    # wsclean otherwise sizes its buffers from the memory of the whole node
+    if alloc.mem_gb and not _is_set(params.get("abs-mem")) and not _is_set(params.get("mem")):
+        values["abs-mem"] = round(alloc.mem_gb, 1)
+    return values
+
+
+def quartical_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    # total threads are dask.threads*solver.threads, per worker of the distributed scheduler
+    names = ["dask.threads", "solver.threads"]
+    if params.get("dask.scheduler") == "distributed":
+        names.insert(0, "dask.workers")
+    return split_cores(alloc, params, names, "dask.threads")
+
+
+def cubical_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    ncpu = params.get("dist.ncpu")
+    if _is_set(ncpu):
+        if not isinstance(ncpu, int):
+            return {}
+        if alloc.explicit and ncpu > alloc.cores:
+            raise ParameterValidationError(f"dist.ncpu={ncpu} exceeds the allocation of {alloc.cores} core(s)")
+        values = {}
+    else:
+        ncpu = alloc.cores
+        values = {"dist.ncpu": ncpu}
+    # with a single core, CubiCal runs serially
+    if ncpu > 1:
+        # one core is taken by the I/O worker
+        values.update(split_cores(alloc, params, ["dist.nworker", "dist.nthread"], "dist.nworker", budget=ncpu - 1))
+    return values
+
+
+def tricolour_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    return split_cores(alloc, params, ["nworkers"], "nworkers")
+
+
+def pfb_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    # each dask thread (per worker of the distributed scheduler) can spawn nvthreads threads. nthreads-dask
+    # determines the memory footprint, so the remaining cores go to nvthreads.
+    names = ["nthreads-dask", "nvthreads"]
+    if params.get("scheduler") == "distributed":
+        names.insert(0, "nworkers")
+    return split_cores(alloc, params, names, "nvthreads")
+
+
+def dask_cluster_profile(alloc: Allocation, params: Dict[str, Any]) -> Dict[str, Any]:
+    # the cluster outlives the step, but takes the step's allocation: workers*threads cores, and the memory
+    # split between the workers
+    values = split_cores(alloc, params, ["workers", "threads"], "threads")
+    workers = params.get("workers") if _is_set(params.get("workers")) else values.get("workers", 1)
+    if alloc.mem_gb and isinstance(workers, int) and not _is_set(params.get("memory-limit-gb")):
+        values["memory-limit-gb"] = round(alloc.mem_gb / workers, 1)
+    return values
+
+
+PROFILES = dict(wsclean=wsclean_profile, quartical=quartical_profile, cubical=cubical_profile,
+                tricolour=tricolour_profile, pfb=pfb_profile, dask_cluster=dask_cluster_profile)
+
+
+def apply_profile(tool: str, params: Dict[str, Any], inputs: Dict[str, Parameter]) -> Dict[str, Parameter]:
+    """Returns inputs with the defaults of the parallelism parameters of a tool set according to the allocation
+    of the step. Parameters that are set explicitly are left alone."""
+    alloc = step_allocation(params)
+    if alloc is None:
+        return inputs
+    values = PROFILES[tool](alloc, params)
+    inputs = inputs.copy()
+    for name, value in values.items():
+        if name in inputs and not _is_set(params.get(name)):
+            # schemas are shared between steps, so modify a copy
+            schema = inputs[name] = copy.copy(inputs[name])
+            schema.default = value
+    return inputs
+
+
+def with_resource_profile(tool: str):
+    """Decorator applying the resource profile of a tool to the inputs returned by a dynamic schema hook"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
+            inputs, outputs = func(params, inputs, outputs)
+            return apply_profile(tool, params, inputs), outputs
+        return wrapper
+    return decorator
+
+
+def _no_schema(params: Dict[str, Any], inputs: Dict[str, Parameter], outputs: Dict[str, Parameter]):
+    return inputs, outputs
+
+
+# dynamic schema hooks for cabs that have no other use for one
+tricolour_schema = with_resource_profile("tricolour")(_no_schema)
+pfb_schema = with_resource_profile("pfb")(_no_schema)
+dask_cluster_schema = with_resource_profile("dask_cluster")(_no_schema)
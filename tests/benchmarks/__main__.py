@@ -0,0 +1,71 @@
+import sys
+import click
+from rich.console import Console
+from rich.table import Table
+from . import bench_catalog, bench_schemas, bench_imports, bench_builder, bench_containers, bench_numba
+from .harness import save_results, load_results, regressions
+
+SUITES = dict(catalog=bench_catalog, schemas=bench_schemas, imports=bench_imports, builder=bench_builder,
+              containers=bench_containers, numba=bench_numba)
+
+# the containers suite pulls and runs images, and the numba suite needs numba, so they only run when asked for
+DEFAULT_SUITES = [suite for suite in SUITES if suite not in ("containers", "numba")]
+
+console = Console(highlight=False)
+print = console.print
+
+
+@click.command()
+@click.option('-o', '--output', metavar='FILE', type=click.Path(dir_okay=False),
+              help='Write results to a JSON file.')
+@click.option('-r', '--repeat', type=click.IntRange(min=1), default=5, show_default=True,
+              help='Number of repetitions of each benchmark.')
+@click.option('--quick', is_flag=True, help='Use smaller parameter sweeps, and skip the slowest benchmarks.')
+@click.option('--compare', 'compare_file', metavar='FILE', type=click.Path(exists=True, dir_okay=False),
+              help='Compare to results of a previous run, and return an error if any benchmark got slower.')
+@click.option('--threshold', type=float, default=0.2, show_default=True,
+              help='Relative slowdown (of the median time) considered a regression by --compare.')
+@click.option('--image', 'images', metavar='NAME[=REF]', multiple=True,
+              help='Image to benchmark in the containers suite (may be repeated). Default is all images.')
+@click.option('--runtime', type=click.Choice(bench_containers.RUNTIMES),
+              help='Container runtime of the containers suite. Default is the first one found.')
+@click.argument('suites', type=click.Choice(list(SUITES)), nargs=-1)
+def main(output=None, repeat=5, quick=False, compare_file=None, threshold=0.2, images=(), runtime=None, suites=()):
+    """Runs cult-cargo benchmarks: the given SUITES, or all of them except containers and numba."""
+    suites = list(suites) or DEFAULT_SUITES
+    measurements = []
+    for suite in suites:
+        with console.status(f"running {suite} benchmarks"):
+            if suite == "containers":
+                measurements += bench_containers.run(repeat, quick=quick, images=list(images), runtime=runtime)
+            else:
+                measurements += SUITES[suite].run(repeat, quick=quick)
+
+    baseline = load_results(compare_file) if compare_file else {}
+    table = Table("benchmark", "median (ms)", "min (ms)", "calls/s", "baseline (ms)", title="Benchmarks")
+    for m in measurements:
+        entry = m.summary()
+        if m.error:
+            table.add_row(m.key, f"[red]{m.error}[/red]", "", "", "")
+            continue
+        old = baseline.get(m.key, {}).get("median")
+        table.add_row(m.key, f"{entry['median']*1000:.3f}", f"{entry['min']*1000:.3f}",
+                      f"{entry['rate']:.0f}" if "rate" in entry else "", f"{old*1000:.3f}" if old else "")
+    print(table)
+
+    if output:
+        save_results(output, measurements, dict(repeat=repeat, quick=quick, suites=suites))
+        print(f"Wrote results to {output}")
+
+    failed = [m.key for m in measurements if m.error]
+    if failed:
+        print(f"[red]{len(failed)} benchmark(s) failed: {', '.join(failed)}[/red]")
+    slower = regressions(measurements, baseline, threshold)
+    for key, old, new in slower:
+        print(f"[red]{key}: {old*1000:.3f} ms -> {new*1000:.3f} ms[/red]")
+    if failed or slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
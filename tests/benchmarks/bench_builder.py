@@ -0,0 +1,69 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from omegaconf import OmegaConf
+from cultcargo.builder import build_cargo
+from .harness import measure
+
+SUITE = "builder"
+
+MANIFEST = os.path.join(os.path.dirname(build_cargo.__file__), "cargo-manifest.yml")
+
+# directory with the stand-in docker CLI
+FAKEBIN = os.path.join(os.path.dirname(__file__), "fakebin")
+
+
+@contextmanager
+def sandbox(cache_dir: str):
+    """Puts the stand-in docker CLI first in PATH, redirects build-cargo caches (which would otherwise record
+    the stand-in's answers) and state files to cache_dir, and silences build-cargo output"""
+    saved = {var: os.environ.get(var) for var in ("PATH", "XDG_CACHE_HOME")}
+    os.environ["PATH"] = f"{FAKEBIN}{os.pathsep}{saved['PATH'] or ''}"
+    os.environ["XDG_CACHE_HOME"] = cache_dir
+    build_cargo.console.quiet = True
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+        build_cargo.console.quiet = False
+
+
+def invoke(*args):
+    try:
+        build_cargo.build_cargo.main(list(args), standalone_mode=False)
+    except SystemExit as exc:
+        if exc.code:
+            raise RuntimeError(f"build-cargo {' '.join(args)} exited with status {exc.code}")
+
+
+def run(repeat: int, quick: bool = False):
+    """Measures manifest loading, and build-cargo planning and listing runs against a stand-in docker CLI"""
+    results = [measure(SUITE, "load-manifest", lambda: build_cargo.load_manifest(OmegaConf.load(MANIFEST)),
+                       repeat)]
+
+    with tempfile.TemporaryDirectory() as tmpdir, sandbox(tmpdir):
+        # no release checks against github
+        manifest = os.path.join(tmpdir, "manifest.yml")
+        conf = OmegaConf.load(MANIFEST)
+        conf.metadata.GITHUB_REPOSITORY = ""
+        OmegaConf.save(conf, manifest)
+        # state file defaults are fixed when build_cargo is imported, so they are not covered by sandbox()
+        common = ["-m", manifest, "--boring", "--lockfile=", "--state", os.path.join(tmpdir, "state.json"),
+                  "--journal", os.path.join(tmpdir, "journal.json")]
+        plan = os.path.join(tmpdir, "plan.json")
+
+        for nshards in (1, 4):
+            results.append(measure(SUITE, f"plan/{nshards}-shards",
+                                   lambda: invoke(*common, "-a", "--plan", plan, "--shard", f"1/{nshards}"),
+                                   repeat, shards=nshards))
+        # -l checks every tag in the registry, here via "docker manifest inspect"
+        if not quick:
+            results.append(measure(SUITE, "list/docker-probe",
+                                   lambda: invoke(*common, "-a", "-l", "--probe", "docker", "--probe-cache-ttl", "0",
+                                                  "-j", "8"),
+                                   repeat))
+    return results
@@ -0,0 +1,48 @@
+import os
+from omegaconf import OmegaConf
+from cultcargo import catalog
+from .harness import measure
+
+SUITE = "catalog"
+
+
+def run(repeat: int, quick: bool = False):
+    """Measures load and validation time of each cab definition file, and of the compiled catalog"""
+    from stimela.kitchen.cab import Cab
+    cab_schema = OmegaConf.structured(Cab)
+    results = []
+
+    for path in catalog.cab_files():
+        filename = os.path.basename(path)
+        loaded = {}
+
+        def load():
+            loaded["conf"], _ = catalog.load_cab_file(path)
+
+        results.append(measure(SUITE, f"load/{filename}", load, repeat))
+        conf = loaded.get("conf")
+        if conf is None or "cabs" not in conf:
+            continue
+
+        invalid = set()
+
+        def validate():
+            # as stimela does it: merge into the Cab schema, and instantiate
+            for name, cab in conf.cabs.items():
+                try:
+                    Cab(**OmegaConf.merge(cab_schema, cab))
+                except Exception:
+                    invalid.add(name)
+
+        result = measure(SUITE, f"validate/{filename}", validate, repeat, cabs=len(conf.cabs))
+        if invalid:
+            result.params["invalid"] = sorted(invalid)
+        results.append(result)
+
+    # compiled catalog: built here if needed, so that only loading it is timed
+    catalog.load_catalog()
+    results.append(measure(SUITE, "compiled/load", catalog.load_catalog, repeat,
+                           setup=catalog.load_catalog.cache_clear))
+    results.append(measure(SUITE, "compiled/materialise-all", catalog.catalog_cabs, repeat,
+                           cabs=len(catalog.cab_index())))
+    return results
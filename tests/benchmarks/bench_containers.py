@@ -0,0 +1,93 @@
+import os
+import shlex
+import shutil
+import subprocess
+from typing import List, Optional
+from omegaconf import OmegaConf
+import cultcargo.genesis
+from .harness import Measurement, measure_command
+
+SUITE = "containers"
+
+RUNTIMES = ("docker", "podman")
+
+# image -> (no-op entry command, Python interpreter, package whose import time is measured, or None)
+ENTRIES = {
+    "python-astro": ("python3.9 -c pass", "python3.9", "astropy"),
+    "quartical": ("goquartical --help", "python3.9", "quartical"),
+    "cubical": ("gocubical --help", "python3.9", "cubical"),
+    "tricolour": ("tricolour --help", "python3.9", "tricolour"),
+    "crystalball": ("crystalball --help", "python3.9", "crystalball"),
+    "pfb-clean": ("pfb --help", "python3.9", "pfb"),
+    "wsclean": ("wsclean --version", None, None),
+}
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+# puts bytecode written by the container under /tmp, so that the image's own precompiled bytecode is ignored
+# and every run compiles the modules it imports, like an image built without the startup optimisation
+NO_PYC = ["-e", "PYTHONPYCACHEPREFIX=/tmp/no-pyc"]
+
+
+def image_ref(name: str) -> str:
+    """Returns the reference of an image as used by the cabs, i.e. tagged with the bundle version"""
+    base = OmegaConf.load(os.path.join(os.path.dirname(cultcargo.genesis.__file__), "cult-cargo-base.yml"))
+    settings = base.vars["cult-cargo"]
+    return f"{settings.images.registry}/{name}:{settings['bundle-version']}"
+
+
+def drop_page_cache() -> bool:
+    """Drops the page cache of the host, so that the image files are read from disk. Needs root."""
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+def run(repeat: int, quick: bool = False, images: Optional[List[str]] = None, runtime: Optional[str] = None):
+    """Measures the startup latency of the entry command of each image with a cold and a warm page cache, and
+    the import time of its Python package, with and without the bytecode precompiled into the image.
+
+    Images are given by name (e.g. quartical), or as NAME=REF to benchmark a specific build of the image, such as
+    one built with "startup: {enabled: false}" in the manifest, for comparison. Images are pulled beforehand."""
+    runtime = runtime or next((name for name in RUNTIMES if shutil.which(name)), None)
+    if runtime is None or not shutil.which(runtime):
+        return [Measurement(SUITE, "runtime", error=f"no container runtime found ({', '.join(RUNTIMES)})")]
+
+    results = []
+    for spec in images or ENTRIES:
+        name, _, ref = spec.partition("=")
+        if name not in ENTRIES:
+            results.append(Measurement(SUITE, f"startup/{name}", error=f"unknown image, expected one of "
+                                                                       f"{', '.join(ENTRIES)}"))
+            continue
+        command, python, module = ENTRIES[name]
+        ref = ref or image_ref(name)
+        params = dict(image=ref, runtime=runtime)
+
+        pull = subprocess.run([runtime, "pull", ref], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if pull.returncode:
+            results.append(Measurement(SUITE, f"startup/{name}", params=params,
+                                       error=pull.stderr.strip().split("\n")[-1]))
+            continue
+
+        docker_run = [runtime, "run", "--rm"]
+        # without root, only the first run after the pull can be measured as cold
+        if not quick:
+            cold = drop_page_cache()
+            results.append(measure_command(SUITE, f"startup/{name}/cold", docker_run + [ref] + shlex.split(command),
+                                           repeat if cold else 1, setup=drop_page_cache if cold else None,
+                                           wall=True, page_cache="dropped" if cold else "first-run", **params))
+        results.append(measure_command(SUITE, f"startup/{name}/warm", docker_run + [ref] + shlex.split(command),
+                                       repeat, wall=True, **params))
+        if module:
+            script = [python, "-c", IMPORT_SCRIPT.format(module=module)]
+            results.append(measure_command(SUITE, f"import/{name}", docker_run + [ref] + script, repeat,
+                                           module=module, **params))
+            if not quick:
+                results.append(measure_command(SUITE, f"import/{name}/no-pyc", docker_run + NO_PYC + [ref] + script,
+                                               repeat, module=module, **params))
+    return results
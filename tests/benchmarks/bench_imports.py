@@ -0,0 +1,51 @@
+from .harness import measure_subprocess
+
+SUITE = "imports"
+
+MODULES = [
+    "scabha.cargo",                               # baseline: the genesis packages all build on it
+    "cultcargo",
+    "cultcargo.genesis",
+    "cultcargo.genesis.wsclean",
+    "cultcargo.genesis.quartical",
+    "cultcargo.genesis.quartical.external",
+    "cultcargo.genesis.cubical.make_stimela_schema",
+    "cultcargo.catalog",
+]
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# first use of the schemas that the genesis packages load lazily
+FIRST_USE = {
+    "quartical": "from cultcargo.genesis import quartical; quartical.BaseConfig, quartical.Gain",
+    "cubical": "from cultcargo.genesis.cubical import make_stimela_schema; make_stimela_schema.jones_template()",
+}
+
+FIRST_USE_SCRIPT = """
+import time
+import scabha.cargo
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run(repeat: int, quick: bool = False):
+    """Measures import time of the cult-cargo and genesis packages, each in a fresh interpreter, and the time
+    taken by the first use of their schemas with and without the compiled schema cache"""
+    results = [measure_subprocess(SUITE, module, SCRIPT.format(module=module), repeat)
+               for module in MODULES]
+    for name, code in FIRST_USE.items():
+        script = FIRST_USE_SCRIPT.format(code=code)
+        # an empty cache directory disables the cache
+        results.append(measure_subprocess(SUITE, f"first-use/{name}/uncached", script, repeat,
+                                          env={"CULT_CARGO_SCHEMA_CACHE": ""}))
+        # populate the cache first
+        measure_subprocess(SUITE, f"first-use/{name}/cached", script, 1)
+        results.append(measure_subprocess(SUITE, f"first-use/{name}/cached", script, repeat))
+    return results
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import subprocess
+from cultcargo.cpu import host_cpu_level
+from .harness import Measurement, measure_subprocess
+
+SUITE = "numba"
+
+# the kernel, modelled on the application of diagonal gains to model visibilities by QuartiCal and CubiCal.
+# It is written to a module file, since numba only caches functions defined in files.
+KERNEL = """
+import numpy as np
+import numba
+
+
+@numba.njit(cache=True, nogil=True)
+def apply_gains(model, gains, ant1, ant2, out):
+    for row in range(model.shape[0]):
+        p, q = ant1[row], ant2[row]
+        for chan in range(model.shape[1]):
+            for corr in range(model.shape[2]):
+                out[row, chan, corr] = gains[p, chan, corr] * model[row, chan, corr] * \\
+                    np.conj(gains[q, chan, corr])
+"""
+
+# loads the kernel from the cache and touches the output array (in an untimed call), then times a call on arrays
+# of {nant} antennas and {nchan} channels
+SCRIPT = """
+import time
+import numpy as np
+from kernel import apply_gains
+
+nant, nchan, ncorr = {nant}, {nchan}, 2
+ant1, ant2 = [np.array(a, dtype=np.int32) for a in np.triu_indices(nant, 1)]
+rng = np.random.default_rng(42)
+model = (rng.standard_normal((ant1.size, nchan, ncorr)) + 1j * rng.standard_normal((ant1.size, nchan, ncorr)))
+gains = (rng.standard_normal((nant, nchan, ncorr)) + 1j * rng.standard_normal((nant, nchan, ncorr)))
+out = np.empty_like(model)
+apply_gains(model, gains, ant1, ant2, out)
+start = time.perf_counter()
+apply_gains(model, gains, ant1, ant2, out)
+print(time.perf_counter() - start)
+"""
+
+
+def run(repeat: int, quick: bool = False):
+    """Measures warm runs (i.e. with the kernel loaded from the numba cache, as in an image with a pre-warmed
+    cache) of a numba kernel compiled for the host CPU, for a generic CPU (as in images with portable numba
+    warm-ups, see cultcargo/builder/jitcache.py) and for the x86-64 level of the host (as in CPU-tuned images)"""
+    if subprocess.run([sys.executable, "-c", "import numba"], stderr=subprocess.DEVNULL).returncode:
+        return [Measurement(SUITE, "kernel", error="numba not installed")]
+
+    targets = dict(host=None, generic="generic")
+    if host_cpu_level():
+        targets[host_cpu_level()] = host_cpu_level()
+    nant, nchan = (16, 256) if quick else (64, 1024)
+    script = SCRIPT.format(nant=nant, nchan=nchan)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "kernel.py"), "wt") as f:
+            f.write(KERNEL)
+        for name, cpu_name in targets.items():
+            env = dict(PYTHONPATH=os.pathsep.join(filter(None, [tmpdir, os.environ.get("PYTHONPATH")])),
+                       NUMBA_CACHE_DIR=os.path.join(tmpdir, "cache"))
+            if cpu_name:
+                env.update(NUMBA_CPU_NAME=cpu_name, NUMBA_CPU_FEATURES="")
+            # compile into the cache first
+            warmup = measure_subprocess(SUITE, f"apply-gains/{name}", script, 1, env=env)
+            if warmup.error:
+                results.append(warmup)
+                continue
+            results.append(measure_subprocess(SUITE, f"apply-gains/{name}", script, repeat, env=env,
+                                              cpu=cpu_name or "host", nant=nant, nchan=nchan))
+    return results
@@ -0,0 +1,50 @@
+import itertools
+from omegaconf import OmegaConf
+from cultcargo.catalog import catalog_cabs
+from .harness import measure
+
+SUITE = "schemas"
+
+
+def wsclean_sweep(quick: bool):
+    nchans = [1, 4] if quick else [1, 2, 4, 8, 16]
+    return [{"nchan": nchan, "pol": pol, "intervals-out": intervals, "niter": niter}
+            for nchan, pol, intervals, niter in itertools.product(nchans, ["I", "IV", "IQUV"], [1, 2, 4], [0, 1000])]
+
+
+def quartical_sweep(quick: bool):
+    return [{"solver.terms": [f"T{i}" for i in range(nterms)]} for nterms in range(1, 6 if quick else 21)]
+
+
+def cubical_sweep(quick: bool):
+    return [{"sol.jones": [f"J{i}" for i in range(njones)]} for njones in range(1, 4 if quick else 11)]
+
+
+# cab name -> function returning list of parameter sets to sweep over
+SWEEPS = dict(wsclean=wsclean_sweep, quartical=quartical_sweep, cubical=cubical_sweep)
+
+
+def make_cab(name: str):
+    from stimela.kitchen.cab import Cab
+    return Cab(**OmegaConf.merge(OmegaConf.structured(Cab), catalog_cabs([name])[name]))
+
+
+def run(repeat: int, quick: bool = False):
+    """Measures throughput of the dynamic schema hooks over parameter sweeps, with and without memoisation"""
+    results = []
+    for name, sweep in SWEEPS.items():
+        points = sweep(quick)
+        cab = make_cab(name)
+        hook = cab._dyn_schema
+        # first call sets up lazily loaded schemas, which are covered by the imports suite
+        cab.apply_dynamic_schemas(points[0])
+        cycle = itertools.cycle(points)
+
+        def call():
+            cab.apply_dynamic_schemas(next(cycle))
+
+        # a repetition calls the hook once per point, clearing its cache first, so every call computes a schema
+        results.append(measure(SUITE, f"{name}/computed", call, repeat, calls=len(points),
+                               setup=getattr(hook, "cache_clear", None), points=len(points)))
+        results.append(measure(SUITE, f"{name}/memoised", call, repeat, calls=len(points), points=len(points)))
+    return results
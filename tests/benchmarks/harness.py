@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import json
+import socket
+import platform
+import statistics
+import subprocess
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Callable, Optional
+
+try:
+    from importlib import metadata
+except ImportError: # for Python<3.8
+    import importlib_metadata as metadata
+
+# bump this when the layout of the results file changes
+RESULTS_FORMAT = 1
+
+
+@dataclass
+class Measurement(object):
+    suite: str                                    # catalog, schemas, imports, builder or containers
+    name: str                                     # benchmark name, unique within suite
+    times: List[float] = field(default_factory=list)    # seconds per repetition (per call, if calls > 1)
+    calls: int = 1                                # calls timed in each repetition
+    params: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def key(self):
+        return f"{self.suite}/{self.name}"
+
+    def summary(self) -> Dict[str, Any]:
+        entry = dict(suite=self.suite, name=self.name, params=self.params, calls=self.calls, times=self.times)
+        if self.error:
+            entry["error"] = self.error
+        if self.times:
+            median = statistics.median(self.times)
+            entry.update(min=min(self.times), median=median, mean=statistics.mean(self.times),
+                         stdev=statistics.stdev(self.times) if len(self.times) > 1 else 0.0)
+            if self.calls > 1 and median > 0:
+                entry["rate"] = 1 / median
+        return entry
+
+
+def measure(suite: str, name: str, func: Callable[[], Any], repeat: int, calls: int = 1,
+            setup: Optional[Callable[[], Any]] = None, **params) -> Measurement:
+    """Times func(). Each of the repeat repetitions calls setup() (untimed), then func() calls times,
+    and records the time per call. An exception is recorded as the error of the measurement."""
+    result = Measurement(suite, name, calls=calls, params=params)
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            for _ in range(calls):
+                func()
+            result.times.append((time.perf_counter() - start) / calls)
+    except Exception as exc:
+        result.error = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def measure_command(suite: str, name: str, command: List[str], repeat: int, env: Optional[Dict[str, str]] = None,
+                    setup: Optional[Callable[[], Any]] = None, wall: bool = False, **params) -> Measurement:
+    """Runs a command repeat times, calling setup() (untimed) before each run. If wall is set, records the
+    wall-clock time of each run, else the command must print the time it measured (in seconds) as its last
+    line of output. A failing run is recorded as the error of the measurement."""
+    result = Measurement(suite, name, params=params)
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                  env=dict(os.environ, **(env or {})))
+            elapsed = time.perf_counter() - start
+            if proc.returncode:
+                result.error = (proc.stderr.strip() or f"exit status {proc.returncode}").split("\n")[-1]
+                break
+            result.times.append(elapsed if wall else float(proc.stdout.strip().split("\n")[-1]))
+    except Exception as exc:
+        result.error = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def measure_subprocess(suite: str, name: str, script: str, repeat: int, env: Optional[Dict[str, str]] = None,
+                       **params) -> Measurement:
+    """Runs a Python script in a fresh interpreter repeat times. The script must print the time it measured
+    (in seconds) as its last line of output."""
+    return measure_command(suite, name, [sys.executable, "-c", script], repeat, env=env, **params)
+
+
+def _version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _git_describe():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(__file__),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """Returns description of the environment the benchmarks ran in"""
+    return dict(timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"), host=socket.gethostname(),
+                python=platform.python_version(), platform=platform.platform(), cpus=os.cpu_count(),
+                cult_cargo=_version("cult-cargo"), stimela=_version("stimela"), omegaconf=_version("omegaconf"),
+                git=_git_describe())
+
+
+def save_results(path: str, measurements: List[Measurement], settings: Dict[str, Any]):
+    results = dict(format=RESULTS_FORMAT, environment=environment(), settings=settings,
+                   benchmarks=[m.summary() for m in measurements])
+    with open(path, "wt") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """Loads results file, returning dict of suite/name -> benchmark entry"""
+    with open(path) as f:
+        results = json.load(f)
+    return {f"{entry['suite']}/{entry['name']}": entry for entry in results.get("benchmarks", [])}
+
+
+def regressions(measurements: List[Measurement], baseline: Dict[str, Dict[str, Any]], threshold: float):
+    """Returns list of (key, old median, new median) for benchmarks whose median time grew by more than the
+    threshold (a fraction) relative to the baseline"""
+    result = []
+    for m in measurements:
+        old = baseline.get(m.key, {}).get("median")
+        new = m.summary().get("median")
+        if old and new and new > old * (1 + threshold):
+            result.append((m.key, old, new))
+    return result
@@ -0,0 +1,50 @@
+import pytest
+from cultcargo import cpu, resolvers
+
+IMAGE = dict(name="wsclean", registry="quay.io/stimela2")
+
+
+@pytest.fixture
+def variants(monkeypatch):
+    """Makes wsclean built in v3 and v4 variants, and returns the set of pushed images, initially empty"""
+    pushed = {}
+    monkeypatch.setattr(resolvers, "manifest_cpu_variants", lambda: {"wsclean": ["x86-64-v3", "x86-64-v4"]})
+    monkeypatch.setattr(resolvers, "known_digests", lambda: pushed)
+    monkeypatch.delenv(cpu.CPU_VARIANT_ENV, raising=False)
+    monkeypatch.delenv("CULT_CARGO_PIN_DIGESTS", raising=False)
+    return pushed
+
+
+def test_variants_opt_in(variants, monkeypatch):
+    variants["quay.io/stimela2/wsclean:cc0.1.3-x86-64-v3"] = "sha256:v3"
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3"
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "x86-64-v4")
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3-x86-64-v3"
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "generic")
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3"
+
+
+def test_only_pushed_variants(variants, monkeypatch):
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "x86-64-v4")
+    # nothing in the lockfiles: the generic tag
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3"
+    variants["quay.io/stimela2/wsclean:cc0.1.3-x86-64-v3"] = "sha256:v3"
+    variants["quay.io/stimela2/wsclean:cc0.1.3-x86-64-v4"] = "sha256:v4"
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3-x86-64-v4"
+    # never above the given level
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "x86-64-v2")
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3"
+    # pinned to the digest of the variant
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "x86-64-v3")
+    monkeypatch.setenv("CULT_CARGO_PIN_DIGESTS", "1")
+    monkeypatch.setattr(resolvers, "image_digest", lambda ref: variants.get(ref))
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3-x86-64-v3@sha256:v3"
+
+
+def test_host_detection(variants, monkeypatch):
+    variants["quay.io/stimela2/wsclean:cc0.1.3-x86-64-v3"] = "sha256:v3"
+    monkeypatch.setattr(cpu, "host_cpu_level", lambda: "x86-64-v3")
+    monkeypatch.setenv(cpu.CPU_VARIANT_ENV, "host")
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3-x86-64-v3"
+    monkeypatch.setattr(cpu, "host_cpu_level", lambda: None)
+    assert resolvers.image_version_resolver("cc0.1.3", _parent_=IMAGE) == "cc0.1.3"
@@ -0,0 +1,41 @@
+import os
+import pytest
+from cultcargo.builder import jitcache
+from cultcargo.builder.jitcache import add_numba_warmup, stage_hook, HOOK_DIR, HOOK_SOURCE, NUMBA_CACHE_DIR
+
+
+def test_warmup_stage():
+    content = add_numba_warmup("FROM base\n", dict(modules=["quartical"], ms=True, commands=["goquartical"]),
+                               python="python3.9", image="quartical:0.2.2")
+    lines = content.split("\n")
+    # the hook is copied from the build context, rather than embedded in the Dockerfile
+    assert f"COPY cult_cargo_numba.py {HOOK_DIR}/" in lines
+    assert "base64" not in content and max(len(line) for line in lines) < 200
+    assert "NUMBA_CPU_NAME" not in content
+    assert content.rstrip().endswith(f"chmod -R a+rX {NUMBA_CACHE_DIR}")
+    with pytest.raises(ValueError):
+        add_numba_warmup("FROM base\n", {}, python="python3", image="x:1")
+
+
+def test_cpu_target():
+    portable = add_numba_warmup("FROM base\n", dict(modules=["x"], portable=True), python="python3", image="x:1")
+    assert "NUMBA_CPU_NAME=generic" in portable
+    variant = add_numba_warmup("FROM base\n", dict(modules=["x"]), python="python3", image="x:1",
+                               cpu_variant="x86-64-v3")
+    assert "NUMBA_CPU_NAME=x86-64-v3" in variant
+
+
+def test_stage_hook(tmp_path, monkeypatch):
+    stage_hook(str(tmp_path))
+    staged = tmp_path / "cult_cargo_numba.py"
+    assert staged.read_bytes() == open(HOOK_SOURCE, "rb").read()
+    # an up-to-date copy is left alone, a stale one replaced
+    mtime = os.stat(staged).st_mtime_ns
+    stage_hook(str(tmp_path))
+    assert os.stat(staged).st_mtime_ns == mtime
+    source = tmp_path / "hook.py"
+    source.write_text("def seed(): pass\n")
+    monkeypatch.setattr(jitcache, "HOOK_SOURCE", str(source))
+    stage_hook(str(tmp_path))
+    assert staged.read_text() == "def seed(): pass\n"
+    assert sorted(os.listdir(tmp_path)) == ["cult_cargo_numba.py", "hook.py"]
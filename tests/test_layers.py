@@ -0,0 +1,48 @@
+import os
+import stat
+import subprocess
+import pytest
+from cultcargo.builder.layers import timed_pull, format_reference
+
+
+@pytest.fixture
+def fake_docker(tmp_path, monkeypatch):
+    """Stand-in docker CLI logging its arguments, whose pull (in any container) fails for images tagged broken"""
+    log = tmp_path / "log"
+    script = tmp_path / "docker"
+    script.write_text(f"""#!/bin/bash
+echo "$*" >> {log}
+if [[ "$1 $3 $4" == "exec docker pull" && "$6" == *:broken ]]; then
+  echo "manifest unknown" >&2
+  exit 1
+fi
+exit 0
+""")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return log
+
+
+def test_format_reference():
+    assert format_reference("quay.io/stimela2/casa:5.8.0", "gzip") == "quay.io/stimela2/casa:5.8.0"
+    assert format_reference("quay.io/stimela2/casa:5.8.0", "zstd") == "quay.io/stimela2/casa:5.8.0-zstd"
+
+
+def test_pull_in_throwaway_daemon(fake_docker):
+    assert timed_pull("localhost:5000/casa:5.8.0-zstd", insecure_registry="localhost:5000") >= 0
+    calls = fake_docker.read_text().splitlines()
+    # the pull never goes through the local daemon, which may hold the layers already
+    assert not any(call.startswith("pull") for call in calls)
+    name = calls[0].split("--name ")[1].split()[0]
+    assert calls[0].startswith("run -d --rm --privileged --network host")
+    assert "--insecure-registry=localhost:5000" in calls[0]
+    assert f"exec {name} docker pull -q localhost:5000/casa:5.8.0-zstd" in calls
+    assert calls[-1] == f"rm -f -v {name}"
+
+
+def test_failed_pull_removes_daemon(fake_docker):
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        timed_pull("localhost:5000/casa:broken")
+    assert "manifest unknown" in exc.value.stderr
+    calls = fake_docker.read_text().splitlines()
+    assert calls[-1].startswith("rm -f -v cult-cargo-pull-")
@@ -0,0 +1,47 @@
+import os
+import pytest
+from cultcargo import lockfile
+from cultcargo.lockfile import Lockfile, read_lockfile
+
+
+def test_set_and_read(tmp_path):
+    path = str(tmp_path / "sub" / "image-digests.yml")
+    lock = Lockfile(path)
+    assert lock.set("quay.io/stimela2/wsclean:3.3-cc0.1.3", "sha256:abc")
+    assert read_lockfile(path) == {"quay.io/stimela2/wsclean:3.3-cc0.1.3": "sha256:abc"}
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root can write anywhere")
+def test_unwritable(tmp_path):
+    tmp_path.chmod(0o555)
+    try:
+        lock = Lockfile(str(tmp_path / "image-digests.yml"))
+        assert not lock.set("quay.io/stimela2/wsclean:3.3-cc0.1.3", "sha256:abc")
+        assert "can't write lockfile" in lock.error
+    finally:
+        tmp_path.chmod(0o755)
+
+
+def test_unwritable_path(tmp_path):
+    # a file where the directory should be fails for root too
+    (tmp_path / "file").write_text("")
+    lock = Lockfile(str(tmp_path / "file" / "image-digests.yml"))
+    assert not lock.set("quay.io/stimela2/wsclean:3.3-cc0.1.3", "sha256:abc")
+    assert lock.error
+
+
+def test_user_lockfile_takes_precedence(tmp_path, monkeypatch):
+    shipped, user = tmp_path / "shipped.yml", tmp_path / "data" / "cult-cargo" / "image-digests.yml"
+    Lockfile(str(shipped)).set("r/a:1", "sha256:old")
+    Lockfile(str(shipped)).set("r/b:1", "sha256:b")
+    Lockfile(str(user)).set("r/a:1", "sha256:new")
+    monkeypatch.setattr(lockfile, "LOCKFILE", str(shipped))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    monkeypatch.setenv(lockfile.PIN_DIGESTS_ENV, "1")
+    lockfile.known_digests.cache_clear()
+    try:
+        assert lockfile.image_digest("r/a:1") == "sha256:new"
+        assert lockfile.image_digest("r/b:1") == "sha256:b"
+        assert lockfile.image_digest("r/c:1") is None
+    finally:
+        lockfile.known_digests.cache_clear()
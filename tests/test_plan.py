@@ -0,0 +1,35 @@
+from cultcargo.builder.plan import PlanJob, make_shards
+
+
+def plan(*jobs):
+    return {job.name: job for job in jobs}
+
+
+def owners(shards):
+    return {name: i for i, shard in enumerate(shards) for name, owned in shard.items() if owned}
+
+
+def test_shards_replicate_bases():
+    jobs = plan(PlanJob("base", 100, "report"),
+                PlanJob("a", 50, "report", parents=["base"]),
+                PlanJob("b", 50, "report", parents=["base"]))
+    shards = make_shards(jobs, 2)
+    # every job is owned by exactly one shard, and the children go to different shards, both building the base
+    assert sorted(owners(shards)) == ["a", "b", "base"]
+    assert owners(shards)["a"] != owners(shards)["b"]
+    assert all("base" in shard for shard in shards)
+    # the original order is kept
+    assert all(list(shard) == [name for name in jobs if name in shard] for shard in shards)
+
+
+def test_pushed_parents_share_owner():
+    jobs = plan(PlanJob("base", 100, "report"),
+                PlanJob("mid", 10, "report", parents=["base"], pushed_parents=True),
+                PlanJob("leaf", 10, "report", parents=["mid"], pushed_parents=True),
+                PlanJob("other", 50, "report", parents=["base"]))
+    for nshards in (2, 3):
+        shards = make_shards(jobs, nshards)
+        owner = owners(shards)
+        # buildx children are never built on top of a replica, which wouldn't be pushed
+        assert owner["mid"] == owner["base"] and owner["leaf"] == owner["mid"]
+        assert sorted(owner) == sorted(jobs)
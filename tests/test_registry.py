@@ -0,0 +1,164 @@
+import os
+import json
+import stat
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from cultcargo.builder import registry
+from cultcargo.builder.registry import RegistryProbe, ProbeResult, split_image_reference
+
+TOKEN = "sesame"
+
+
+class StubRegistry(object):
+    """Minimal registry v2 API: HEAD/GET of manifests, with optional bearer token authentication"""
+    def __init__(self):
+        self.manifests = {}             # repo:tag -> digest
+        self.auth = False               # require a bearer token
+        self.status = None              # if set, answer every manifest request with this status
+        self.requests = []              # (method, path) of every request
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, headers=None, body=b""):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _handle(self):
+                stub.requests.append((self.command, self.path))
+                if self.path.startswith("/token"):
+                    return self._reply(200, body=json.dumps(dict(token=TOKEN)).encode())
+                if stub.auth and self.headers.get("Authorization") != f"Bearer {TOKEN}":
+                    realm = f"http://{self.headers['Host']}/token"
+                    challenge = f'Bearer realm="{realm}",service="stub",scope="repository:x:pull"'
+                    return self._reply(401, {"WWW-Authenticate": challenge})
+                if stub.status:
+                    return self._reply(stub.status)
+                repo, _, tag = self.path[len("/v2/"):].partition("/manifests/")
+                digest = stub.manifests.get(f"{repo}:{tag}")
+                if digest is None:
+                    return self._reply(404)
+                return self._reply(200, {"Docker-Content-Digest": digest}, b"{}")
+
+            do_GET = do_HEAD = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host = f"localhost:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def ref(self, name):
+        return f"{self.host}/stimela2/{name}"
+
+    def manifest_requests(self):
+        return [request for request in self.requests if "/manifests/" in request[1]]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # talk to the stub directly, even if a proxy is configured
+    monkeypatch.setenv("NO_PROXY", "localhost,127.0.0.1")
+    stub = StubRegistry()
+    stub.thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def fake_docker(tmp_path, monkeypatch):
+    """Stand-in docker CLI, whose 'manifest inspect' knows the images listed in the returned file"""
+    images = tmp_path / "images"
+    images.write_text("")
+    script = tmp_path / "docker"
+    script.write_text(f"""#!/bin/bash
+if [ "$1 $2" == "manifest inspect" ]; then
+  grep -qxF "$3" {images} && echo '{{}}' && exit 0
+  echo "no such manifest: $3" >&2
+  exit 1
+fi
+exit 0
+""")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    # no credentials from the user's docker config
+    monkeypatch.setenv("DOCKER_CONFIG", str(tmp_path))
+    return images
+
+
+def test_split_image_reference():
+    assert split_image_reference("quay.io/stimela2/wsclean:3.3-cc0.1.3") == \
+        ("quay.io", "stimela2/wsclean", "3.3-cc0.1.3")
+    assert split_image_reference("localhost:5000/x/y") == ("localhost:5000", "x/y", "latest")
+    assert split_image_reference("ubuntu:22.04") == (registry.DOCKER_HUB, "library/ubuntu", "22.04")
+
+
+def test_existing_and_missing(stub, fake_docker):
+    stub.manifests["stimela2/wsclean:3.3"] = "sha256:abc"
+    probe = RegistryProbe(use_cache=False)
+    results = probe.check([stub.ref("wsclean:3.3"), stub.ref("wsclean:3.4")])
+    assert results[stub.ref("wsclean:3.3")] == ProbeResult(True, "sha256:abc")
+    # a HEAD request answered by 404 means the image has to be built
+    assert results[stub.ref("wsclean:3.4")] == ProbeResult(False)
+    assert all(method == "HEAD" for method, _ in stub.manifest_requests())
+
+
+def test_token_handshake(stub, fake_docker):
+    stub.auth = True
+    stub.manifests["stimela2/quartical:0.2.2"] = "sha256:def"
+    probe = RegistryProbe(use_cache=False)
+    assert probe.probe(stub.ref("quartical:0.2.2")) == ProbeResult(True, "sha256:def")
+    assert probe.probe(stub.ref("quartical:latest")) == ProbeResult(False)
+    # the token is fetched once, and reused
+    assert [path for _, path in stub.requests if path.startswith("/token")] == \
+        ["/token?service=stub&scope=repository%3Ax%3Apull"]
+
+
+def test_fallback_to_docker(stub, fake_docker):
+    stub.status = 500
+    fake_docker.write_text(stub.ref("cubical:1.6.4") + "\n")
+    probe = RegistryProbe(use_cache=False)
+    assert probe.probe(stub.ref("cubical:1.6.4")) == ProbeResult(True)
+    assert probe.probe(stub.ref("cubical:1.6.5")) == ProbeResult(False)
+    assert stub.manifest_requests()
+
+
+def test_docker_method(stub, fake_docker):
+    fake_docker.write_text(stub.ref("cubical:1.6.4") + "\n")
+    probe = RegistryProbe(use_cache=False, method="docker")
+    assert probe.probe(stub.ref("cubical:1.6.4")) == ProbeResult(True)
+    assert not stub.requests
+
+
+def test_cache_ttl(stub, fake_docker, tmp_path, monkeypatch):
+    stub.manifests["stimela2/tricolour:0.1.8"] = "sha256:123"
+    ref = stub.ref("tricolour:0.1.8")
+    cache_dir = str(tmp_path / "cache")
+    now = [1000.0]
+    monkeypatch.setattr(registry.time, "time", lambda: now[0])
+
+    probe = RegistryProbe(cache_dir=cache_dir, ttl=60)
+    probe.check([ref])
+    assert len(stub.manifest_requests()) == 1
+
+    # within the TTL, a new probe (e.g. the next build-cargo run) answers from the cache file
+    del stub.manifests["stimela2/tricolour:0.1.8"]
+    now[0] += 30
+    assert RegistryProbe(cache_dir=cache_dir, ttl=60).probe(ref) == ProbeResult(True, "sha256:123")
+    assert len(stub.manifest_requests()) == 1
+
+    # once the entry has expired, the registry is asked again
+    now[0] += 60
+    assert RegistryProbe(cache_dir=cache_dir, ttl=60).probe(ref) == ProbeResult(False)
+    assert len(stub.manifest_requests()) == 2
+
+    # use_cache=False always asks the registry
+    RegistryProbe(cache_dir=cache_dir, ttl=60, use_cache=False).probe(ref)
+    assert len(stub.manifest_requests()) == 3
@@ -0,0 +1,126 @@
+import threading
+import time
+import pytest
+from cultcargo.builder.scheduler import Task, TaskFailed, run_tasks, parse_base_images
+
+
+def recorder():
+    """Returns (list of events, function making task callables that append start/end events)"""
+    events = []
+    lock = threading.Lock()
+
+    def make(name, delay=0.02, fail=False):
+        def func():
+            with lock:
+                events.append(("start", name))
+            time.sleep(delay)
+            with lock:
+                events.append(("end", name))
+            if fail:
+                raise RuntimeError(f"{name} failed")
+        return func
+    return events, make
+
+
+def max_concurrency(events, names=None):
+    running = peak = 0
+    for event, name in events:
+        if names is None or name in names:
+            running += 1 if event == "start" else -1
+            peak = max(peak, running)
+    return peak
+
+
+def test_parse_base_images():
+    content = "FROM --platform=linux/amd64 ubuntu:22.04 AS builder\nRUN make\nfrom base:1\n"
+    assert parse_base_images(content) == ["ubuntu:22.04", "base:1"]
+
+
+def test_serial_order():
+    events, make = recorder()
+    tasks = [Task("c", make("c"), deps={"b"}), Task("a", make("a")), Task("b", make("b"), deps={"a"})]
+    run_tasks(tasks, max_workers=1)
+    assert [name for event, name in events if event == "start"] == ["a", "b", "c"]
+
+
+def test_dependencies_complete_first():
+    events, make = recorder()
+    tasks = [Task("base", make("base")), Task("x", make("x"), deps={"base"}), Task("y", make("y"), deps={"base"}),
+             Task("z", make("z"), deps={"x", "y"})]
+    run_tasks(tasks, max_workers=4)
+    assert events.index(("end", "base")) < events.index(("start", "x"))
+    assert events.index(("end", "base")) < events.index(("start", "y"))
+    assert events.index(("start", "z")) > max(events.index(("end", "x")), events.index(("end", "y")))
+    # x and y run in parallel
+    assert max_concurrency(events, {"x", "y"}) == 2
+
+
+def test_unknown_dependencies():
+    events, make = recorder()
+    with pytest.raises(ValueError, match="unknown tasks: a -> elsewhere"):
+        run_tasks([Task("a", make("a"), deps={"elsewhere"})], max_workers=2)
+    assert events == []
+
+
+def test_cpu_admission():
+    events, make = recorder()
+    tasks = [Task(name, make(name), cpus=2) for name in "abcd"]
+    run_tasks(tasks, max_workers=4, max_cpus=4)
+    assert max_concurrency(events) == 2
+
+
+def test_memory_admission():
+    events, make = recorder()
+    tasks = [Task(name, make(name), memory=3) for name in "abc"]
+    run_tasks(tasks, max_workers=3, max_memory=4)
+    assert max_concurrency(events) == 1
+
+
+def test_oversized_task_runs_alone():
+    events, make = recorder()
+    tasks = [Task("small", make("small"), cpus=1), Task("huge", make("huge"), cpus=16),
+             Task("other", make("other"), cpus=1)]
+    run_tasks(tasks, max_workers=3, max_cpus=4)
+    start, end = events.index(("start", "huge")), events.index(("end", "huge"))
+    assert all(event == "start" and name == "huge" or event == "end" and name == "huge"
+               for event, name in events[start:end + 1])
+
+
+def test_failure_propagation():
+    events, make = recorder()
+    tasks = [Task("a", make("a", fail=True)), Task("b", make("b"), deps={"a"}), Task("c", make("c"))]
+    with pytest.raises(TaskFailed) as info:
+        run_tasks(tasks, max_workers=1)
+    assert list(info.value.failures) == ["a"]
+    assert isinstance(info.value.failures["a"], RuntimeError)
+    # no new tasks are started after the failure
+    assert ("start", "b") not in events and ("start", "c") not in events
+
+
+def test_running_tasks_finish_after_failure():
+    events, make = recorder()
+    tasks = [Task("fails", make("fails", delay=0.01, fail=True)), Task("slow", make("slow", delay=0.2)),
+             Task("later", make("later"), deps={"slow"})]
+    with pytest.raises(TaskFailed):
+        run_tasks(tasks, max_workers=2)
+    assert ("end", "slow") in events
+    assert ("start", "later") not in events
+
+
+def test_callback():
+    calls = []
+    run_tasks([Task("a", lambda: None), Task("b", lambda: None, deps={"a"})], max_workers=1,
+              callback=lambda running, done, total: calls.append((set(running), done, total)))
+    assert calls[0] == ({"a"}, 0, 2)
+    assert ({"b"}, 1, 2) in calls
+
+
+def test_dependency_cycle():
+    tasks = [Task("a", lambda: None, deps={"b"}), Task("b", lambda: None, deps={"a"})]
+    with pytest.raises(ValueError, match="dependency cycle"):
+        run_tasks(tasks, max_workers=2)
+
+
+def test_duplicate_names():
+    with pytest.raises(ValueError, match="unique"):
+        run_tasks([Task("a", lambda: None), Task("a", lambda: None)])
@@ -0,0 +1,87 @@
+import os
+import json
+import stat
+import pytest
+from cultcargo.builder.sif import SifCache, SIF_INDEX, file_sha256
+
+
+@pytest.fixture
+def converter(tmp_path):
+    """Stand-in for "apptainer build FILE docker://REF", which writes the reference and the contents of the
+    returned content file into FILE, logs its calls, and fails (after writing part of FILE) for images tagged
+    broken"""
+    content = tmp_path / "content"
+    content.write_text("v1\n")
+    script = tmp_path / "apptainer"
+    script.write_text(f"""#!/bin/bash
+echo "$*" >> {tmp_path}/calls
+[ "$1" == "build" ] || exit 2
+if [[ "$3" == *:broken ]]; then
+  echo partial > "$2"
+  echo "FATAL: can't pull $3"
+  exit 255
+fi
+(echo "$3"; cat {content}) > "$2"
+""")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return script
+
+
+def calls(converter):
+    path = converter.parent / "calls"
+    return path.read_text().splitlines() if path.exists() else []
+
+
+def test_convert_and_cache_hit(tmp_path, converter):
+    ref = "quay.io/stimela2/wsclean:3.3"
+    cache = SifCache(str(tmp_path / "sif"), str(converter))
+    assert not cache.is_current(ref, "sha256:aaa")
+    entry = cache.convert(ref, "sha256:aaa", aliases=["quay.io/stimela2/wsclean:latest"])
+    path = cache.path(ref)
+    assert os.path.basename(path) == "quay.io-stimela2-wsclean:3.3.simg"
+    assert open(path).read() == "docker://quay.io/stimela2/wsclean:3.3\nv1\n"
+    assert entry["digest"] == "sha256:aaa" and entry["sha256"] == file_sha256(path)
+    assert open(f"{path}.sha256").read() == f"{entry['sha256']}  {os.path.basename(path)}\n"
+    assert os.readlink(cache.path("quay.io/stimela2/wsclean:latest")) == os.path.basename(path)
+    assert len(calls(converter)) == 1
+
+    # a new cache (e.g. the next build-cargo run) reads the index, and finds the image up to date
+    cache = SifCache(str(tmp_path / "sif"), str(converter))
+    assert cache.is_current(ref, "sha256:aaa")
+    assert cache.index["quay.io/stimela2/wsclean:latest"]["alias_of"] == ref
+    # unknown digest (e.g. the registry couldn't be asked), or a missing file, are not current
+    assert not cache.is_current(ref, None)
+    os.unlink(path)
+    assert not cache.is_current(ref, "sha256:aaa")
+
+
+def test_rebuild_on_digest_change(tmp_path, converter):
+    ref = "quay.io/stimela2/quartical:0.2.2"
+    cache = SifCache(str(tmp_path / "sif"), str(converter))
+    first = cache.convert(ref, "sha256:aaa")
+
+    (tmp_path / "content").write_text("v2\n")
+    cache = SifCache(str(tmp_path / "sif"), str(converter))
+    assert not cache.is_current(ref, "sha256:bbb")
+    second = cache.convert(ref, "sha256:bbb")
+    assert second["sha256"] != first["sha256"]
+    assert open(cache.path(ref)).read().endswith("v2\n")
+    assert json.load(open(tmp_path / "sif" / SIF_INDEX))[ref]["digest"] == "sha256:bbb"
+    assert SifCache(str(tmp_path / "sif"), str(converter)).is_current(ref, "sha256:bbb")
+    assert len(calls(converter)) == 2
+
+
+def test_failed_conversion(tmp_path, converter):
+    ref = "quay.io/stimela2/cubical:broken"
+    directory = tmp_path / "sif"
+    cache = SifCache(str(directory), str(converter))
+    good = cache.convert("quay.io/stimela2/cubical:1.6.4", "sha256:aaa")
+
+    with pytest.raises(RuntimeError, match="exit code 255: FATAL: can't pull"):
+        cache.convert(ref, "sha256:bbb", aliases=["quay.io/stimela2/cubical:latest"], capture=True)
+    # the partial file is removed, and neither the image nor its alias are recorded
+    assert sorted(os.listdir(directory)) == sorted([os.path.basename(cache.path("quay.io/stimela2/cubical:1.6.4")),
+                                                    good["file"] + ".sha256", SIF_INDEX])
+    assert ref not in cache.index and "quay.io/stimela2/cubical:latest" not in cache.index
+    assert list(json.load(open(directory / SIF_INDEX))) == ["quay.io/stimela2/cubical:1.6.4"]
+    assert SifCache(str(directory), str(converter)).is_current("quay.io/stimela2/cubical:1.6.4", "sha256:aaa")